@@ -0,0 +1,134 @@
+"""
+ASGI serving mode for the chatbot: a threaded adapter, not an async engine.
+
+Serves every route registered in newbot.ROUTES with the same JSON contract
+and cookies as the Flask app; the route handlers themselves are shared with
+newbot.py. The event loop holds the client connections and SSE streams, so a
+slow reader costs no thread.
+
+The handlers are the blocking newbot.py code: OpenAI (including the run
+polling), Zoho and MySQL calls are not awaited. Each request in flight runs
+in a thread of the handler pool (ASGI_WORKER_THREADS) for as long as its
+handler runs, the whole assistant run included. Concurrency is therefore
+still capped by that thread count, as with Flask behind a threaded server;
+this mode does not give the awaited, hundreds-per-process engine asked for
+in the original async serving request.
+
+Run with e.g.:
+    hypercorn asgi:app --bind 0.0.0.0:$PORT
+"""
+import asyncio
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from quart import Quart, Response, request, jsonify, make_response, g
+from quart_cors import cors
+
+import newbot
+
+app = cors(Quart(__name__), allow_origin=newbot.CORS_ORIGINS, allow_credentials=True)
+
+handler_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ASGI_WORKER_THREADS", 256)),
+    thread_name_prefix="asgi-handler"
+)
+
+
+@app.before_request
+async def start_request_tracking():
+    g.metrics_started = time.perf_counter()
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    newbot.current_route.set(route)
+    newbot.tracer.start_request(route, route=route, method=request.method)
+
+
+@app.after_request
+async def finish_request_tracking(response):
+    if "metrics_started" in g:
+        newbot.observe_request(newbot.current_route.get(), response.status_code, time.perf_counter() - g.metrics_started)
+    newbot.tracer.finish_request(status_code=response.status_code)
+    return response
+
+
+async def run_blocking(context, func, *args):
+    """
+    Runs func(*args) in the handler pool inside the request's context
+    (current route, trace span) and awaits the result.
+    """
+    return await asyncio.get_running_loop().run_in_executor(handler_executor, context.run, func, *args)
+
+
+async def stream_events(events, context):
+    """
+    Forwards the SSE events of a streamed reply. The blocking iterator is
+    advanced in the handler pool and closed there once the stream ends or the
+    client goes away, which releases the session's run lock.
+    """
+    iterator = iter(events)
+    step = None
+    try:
+        while True:
+            step = asyncio.ensure_future(run_blocking(context, next, iterator, None))
+            event = await asyncio.shield(step)
+            if event is None:
+                return
+            yield event
+    finally:
+        if step is not None and not step.done():
+            # The generator cannot be closed while next() is still running in its thread
+            await asyncio.wait({step})
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            await run_blocking(context, close)
+
+
+async def quart_reply(reply, context):
+    """
+    Turns a newbot.RouteReply into a Quart response.
+    """
+    if reply.events is not None:
+        response = Response(stream_events(reply.events, context), mimetype="text/event-stream",
+                            headers=newbot.SSE_HEADERS)
+    elif reply.text is not None:
+        response = Response(reply.text, status=reply.status, mimetype=reply.mimetype)
+    else:
+        response = await make_response(jsonify(reply.payload), reply.status)
+    if reply.session_id:
+        response.set_cookie("session_id", reply.session_id, **newbot.SESSION_COOKIE)
+    return response
+
+
+def quart_view(handler):
+    async def view():
+        route_request = newbot.RouteRequest(
+            await request.get_json(silent=True) or {},
+            request.cookies.get("session_id"),
+            request.headers.get("Accept", ""),
+            request.headers.get("Authorization", ""),
+        )
+        context = contextvars.copy_context()
+        reply = await run_blocking(context, handler, route_request)
+        return await quart_reply(reply, context)
+
+    view.__doc__ = handler.__doc__
+    return view
+
+
+for rule, endpoint, handler, methods in newbot.ROUTES:
+    app.add_url_rule(rule, endpoint, quart_view(handler), methods=methods)
+
+
+@app.before_serving
+async def start_background_workers():
+    newbot.zoho_outbox.ensure_started()
+    newbot.zoho_tokens.ensure_started()
+    if newbot.thread_pool is not None:
+        newbot.thread_pool.ensure_started()
+
+
+@app.after_serving
+async def flush_chat_logs():
+    await asyncio.to_thread(newbot.chat_log_writer.stop)
+    handler_executor.shutdown(wait=False)
@@ -0,0 +1,343 @@
+"""
+Benchmark for extract_details_from_summary.
+
+Runs a held-out set of hand-written summaries plus a seeded corpus of
+generated ones in the formats the assistant produces (plain, markdown, bullets,
+numbered lists, other labels, CRLF, JSON blocks, prose after the field list)
+and measures throughput and success rate of the current extractor against the
+previous line-by-line parser. Both run interleaved over several passes; the
+best and median passes are reported, so numbers can be compared across runs.
+
+Usage: python bench_summary_extraction.py [generated_summaries] [repeats]
+"""
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ["SUMMARY_EXTRACTION_MODEL"] = ""
+logging.disable(logging.CRITICAL)
+
+import newbot  # noqa: E402
+
+# Hand-written summaries in the styles the assistant produces, written
+# independently of SUMMARY_FIELD_LABELS so the extractor is measured on text
+# it was not built from. Each entry: (expected required fields, summary).
+HELD_OUT = [
+    ({
+        'first_name': 'Max', 'last_name': 'Mustermann', 'email': 'max@example.de', 'phone': '0171 2345678',
+        'zip_code': '10115', 'quantity': 'ca. 300 t', 'description': 'Bodenaushub aus Baugrube',
+        'geplanter_start': 'KW 23',
+    }, """Hier ist eine Zusammenfassung Ihrer Anfrage:
+
+Anrede: Herr
+Vorname: Max
+Nachname: Mustermann
+Email: max@example.de
+Telefon: 0171 2345678
+Postleitzahl: 10115
+Menge: ca. 300 t
+Beschreibung: Bodenaushub aus Baugrube
+Betreff: Entsorgung Bodenaushub
+Geplanter Start: KW 23
+Leistung: Entsorgung
+
+Sind diese Angaben korrekt?"""),
+    ({
+        'first_name': 'Anna', 'last_name': 'Schäfer', 'email': 'a.schaefer@bau-gmbh.de', 'phone': '+49 30 123456',
+        'zip_code': '80331', 'quantity': '2 LKW-Ladungen', 'description': 'Bauschutt, teilweise mit Asphalt',
+        'geplanter_start': 'Anfang Mai',
+    }, """Vielen Dank! Ich fasse kurz zusammen:
+
+- **Vorname:** Anna
+- **Nachname:** Schäfer
+- **E-Mail:** a.schaefer@bau-gmbh.de
+- **Telefonnummer:** +49 30 123456
+- **PLZ:** 80331
+- **Menge:** 2 LKW-Ladungen
+- **Beschreibung:** Bauschutt, teilweise mit Asphalt
+- **Geplanter Beginn:** Anfang Mai
+
+Start: sobald Sie die Angaben bestätigen, leite ich alles weiter.
+Passt das so?"""),
+    ({
+        'first_name': 'Jörg', 'last_name': 'Meyer-Lüdenscheid', 'email': 'joerg@meyer.de', 'phone': '0221 998877',
+        'zip_code': '50667', 'quantity': '50 m³', 'description': 'Recyclingmaterial für Wegebau',
+        'geplanter_start': 'sofort',
+    }, """Zusammenfassung:
+1. Vorname: Jörg
+2. Nachname: Meyer-Lüdenscheid
+3. E-Mail-Adresse: joerg@meyer.de
+4. Telefon: 0221 998877
+5. Postleitzahl: 50667
+6. Menge: 50 m³
+7. Beschreibung: Recyclingmaterial für Wegebau
+8. Startdatum: sofort"""),
+    ({
+        'first_name': 'Özlem', 'last_name': 'Yilmaz', 'email': 'oezlem.yilmaz@web.de', 'phone': '0151 11223344',
+        'zip_code': '20095', 'quantity': '12 Proben', 'description': 'Deklarationsanalyse nach LAGA PN 98',
+        'geplanter_start': 'Mitte Juni',
+    }, """### Ihre Anfrage im Überblick
+
+* Vorname: Özlem
+* Nachname: Yilmaz
+* Email: oezlem.yilmaz@web.de
+* Mobil: 0151 11223344
+* PLZ: 20095
+* Mengenangabe: 12 Proben
+* Projektbeschreibung: Deklarationsanalyse nach LAGA PN 98
+* Geplanter Start: Mitte Juni
+
+Anzahl: der Proben kann sich nach der Probenahme noch ändern."""),
+    ({
+        'first_name': 'Peter', 'last_name': 'Klein', 'email': 'p.klein@klein-bau.de', 'phone': '089 445566',
+        'zip_code': '81241', 'quantity': '8 Rammkernsondierungen', 'description': 'Baugrundgutachten für EFH',
+        'geplanter_start': 'Juli',
+    }, "\r\n".join([
+        "Prima, dann fasse ich zusammen:", "Vorname: Peter", "Nachname: Klein", "E-Mail: p.klein@klein-bau.de",
+        "Telefon: 089 445566", "Postleitzahl: 81241", "Menge: 8 Rammkernsondierungen",
+        "Beschreibung: Baugrundgutachten für EFH", "Geplanter Start: Juli", "Ist alles korrekt?",
+    ])),
+    ({
+        'first_name': 'Laura', 'last_name': 'Becker', 'email': 'laura.becker@gmx.de', 'phone': '0176 5544332',
+        'zip_code': '01067', 'quantity': '150 t', 'description': 'Mutterboden liefern',
+        'geplanter_start': 'nächste Woche',
+    }, """Hier die Zusammenfassung:
+```json
+{
+  "first_name": "Laura",
+  "last_name": "Becker",
+  "email": "laura.becker@gmx.de",
+  "phone": "0176 5544332",
+  "zip_code": "01067",
+  "quantity": "150 t",
+  "description": "Mutterboden liefern",
+  "geplanter_start": "nächste Woche"
+}
+```"""),
+    ({
+        'first_name': 'Thomas', 'last_name': 'Wagner', 'email': 't.wagner@wagner-tiefbau.de', 'phone': '0711 303030',
+        'zip_code': '70173', 'quantity': '3 Container', 'description': 'Gleisschotter entsorgen',
+        'geplanter_start': 'ab 01.09.',
+    }, """Gerne, hier nochmal alles:
+
+**Vorname**: Thomas
+**Nachname**: Wagner
+**Email-Adresse**: t.wagner@wagner-tiefbau.de
+**Telefon**: 0711 303030
+**Postleitzahl**: 70173
+**Menge**: 3 Container
+**Beschreibung**: Gleisschotter entsorgen
+**Projektstart**: ab 01.09.
+
+Hinweis: Für Gleisschotter benötigen wir eine Deklarationsanalyse.
+Beginn: der Abholung nach Terminabsprache."""),
+    # Label styles the extractor does not know ("Name", "Kontakt"): expected to fail
+    ({
+        'first_name': 'Sabine', 'last_name': 'Hoffmann', 'email': 's.hoffmann@t-online.de', 'phone': '0341 787878',
+        'zip_code': '04109', 'quantity': '20 t', 'description': 'Asphaltaufbruch',
+        'geplanter_start': 'Ende August',
+    }, """Zusammenfassung Ihrer Anfrage:
+Name: Sabine Hoffmann
+Kontakt: s.hoffmann@t-online.de, 0341 787878
+Ort: 04109 Leipzig
+Menge: 20 t
+Material: Asphaltaufbruch
+Zeitraum: Ende August"""),
+]
+
+
+# Generated summaries: assembled from hand-written label spellings, line styles,
+# values and surrounding prose as they appear in assistant answers (again not
+# taken from SUMMARY_FIELD_LABELS). Some spellings are ones the extractor does
+# not know ("Mail", "Anzahl", "Zeitraum", ...), so not every summary can succeed.
+SEED = 16
+
+LABELS = {
+    'first_name': [('Vorname', 1)],
+    'last_name': [('Nachname', 6), ('Familienname', 1)],
+    'email': [('E-Mail', 5), ('Email', 3), ('E-Mail-Adresse', 2), ('Mail', 1)],
+    'phone': [('Telefon', 5), ('Telefonnummer', 3), ('Tel.', 1), ('Mobil', 1), ('Handynummer', 1)],
+    'zip_code': [('Postleitzahl', 4), ('PLZ', 4), ('PLZ der Baustelle', 1)],
+    'quantity': [('Menge', 8), ('Mengenangabe', 1), ('Anzahl', 1)],
+    'description': [('Beschreibung', 6), ('Projektbeschreibung', 2), ('Anliegen', 1), ('Material', 1)],
+    'geplanter_start': [('Geplanter Start', 6), ('Geplanter Beginn', 2), ('Startdatum', 1), ('Projektstart', 1),
+                        ('Zeitraum', 1)],
+}
+
+FIRST_NAMES = ['Max', 'Anna', 'Jörg', 'Özlem', 'Peter', 'Laura', 'Thomas', 'Sabine', 'Lukas', 'Marie',
+               'Hans-Peter', 'Ayşe', 'Dominik', 'Katrin', 'Jan']
+LAST_NAMES = ['Mustermann', 'Schäfer', 'Meyer-Lüdenscheid', 'Yilmaz', 'Klein', 'Becker', 'Wagner', 'Hoffmann',
+              'Nowak', 'Groß', 'von Bergen', 'Schmidt', 'Öztürk', 'Weiß', 'Krüger']
+MAIL_DOMAINS = ['web.de', 'gmx.de', 't-online.de', 'bau-gmbh.de', 'gmail.com', 'tiefbau-nord.de']
+QUANTITIES = ['ca. 300 t', '2 LKW-Ladungen', '50 m³', '12 Proben', '8 Rammkernsondierungen', '150 t', '3 Container',
+              '1 Analyse', 'ca. 20 m³ (geschätzt)', '500–600 t']
+DESCRIPTIONS = ['Bodenaushub aus Baugrube', 'Bauschutt, teilweise mit Asphalt', 'Recyclingmaterial für Wegebau',
+                'Deklarationsanalyse nach LAGA PN 98', 'Baugrundgutachten für EFH', 'Mutterboden liefern',
+                'Gleisschotter entsorgen', 'Asphaltaufbruch, evtl. teerhaltig', 'Analyse nach EBV: MEB und BM-F0',
+                'Probenahme vor Ort, danach Entsorgung']
+STARTS = ['KW 23', 'Anfang Mai', 'sofort', 'Mitte Juni', 'Juli', 'nächste Woche', 'ab 01.09.', 'Ende August',
+          'so bald wie möglich', '15.10.2026, 8:00 Uhr']
+
+LINE_STYLES = [
+    lambda n, label, value: f"{label}: {value}",
+    lambda n, label, value: f"**{label}:** {value}",
+    lambda n, label, value: f"**{label}**: {value}",
+    lambda n, label, value: f"- {label}: {value}",
+    lambda n, label, value: f"- **{label}:** {value}",
+    lambda n, label, value: f"* {label}: {value}",
+    lambda n, label, value: f"• {label}: {value}",
+    lambda n, label, value: f"{n}. {label}: {value}",
+    lambda n, label, value: f"{n}) **{label}**: {value}",
+]
+INTROS = ['Hier ist eine Zusammenfassung Ihrer Anfrage:', 'Vielen Dank! Ich fasse kurz zusammen:',
+          '### Ihre Anfrage im Überblick', 'Zusammenfassung:', 'Gerne, hier nochmal alles:', '']
+OUTROS = ['Sind diese Angaben korrekt?', 'Passt das so?', 'Ist alles korrekt?',
+          'Hinweis: Für Gleisschotter benötigen wir eine Deklarationsanalyse.',
+          'Start: sobald Sie die Angaben bestätigen, leite ich alles weiter.',
+          'Anzahl: der Proben kann sich nach der Probenahme noch ändern.',
+          'Bitte bestätigen Sie mit "Ja".', '']
+
+
+def pick(rng, weighted):
+    return rng.choices([label for label, _ in weighted], [weight for _, weight in weighted])[0]
+
+
+def make_summary(rng):
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    expected = {
+        'first_name': first,
+        'last_name': last,
+        'email': f"{first[0].lower()}.{last.split()[-1].lower()}@{rng.choice(MAIL_DOMAINS)}",
+        'phone': rng.choice([f"0{rng.randint(151, 179)} {rng.randint(1000000, 99999999)}",
+                             f"+49 {rng.randint(30, 89)} {rng.randint(100000, 9999999)}",
+                             f"0{rng.randint(201, 9999)}/{rng.randint(10000, 999999)}"]),
+        'zip_code': f"{rng.randint(1067, 99998):05d}",
+        'quantity': rng.choice(QUANTITIES),
+        'description': rng.choice(DESCRIPTIONS),
+        'geplanter_start': rng.choice(STARTS),
+    }
+    fields = [(pick(rng, LABELS[key]), value) for key, value in expected.items()]
+    if rng.random() < 0.4:
+        fields.insert(0, ('Anrede', rng.choice(['Herr', 'Frau'])))
+    if rng.random() < 0.3:
+        fields.append(('Leistung', rng.choice(['Entsorgung', 'Lieferung', 'Analyse'])))
+    if rng.random() < 0.2:
+        rng.shuffle(fields)
+
+    if rng.random() < 0.1:
+        body = json.dumps(rng.choice([expected, dict(fields)]), ensure_ascii=False, indent=2)
+        return expected, f"{rng.choice(INTROS)}\n```json\n{body}\n```"
+
+    style = rng.choice(LINE_STYLES)
+    lines = [rng.choice(INTROS)]
+    lines += [style(n, label, value) for n, (label, value) in enumerate(fields, 1)]
+    lines += ['', rng.choice(OUTROS)]
+    newline = "\r\n" if rng.random() < 0.1 else "\n"
+    return expected, newline.join(lines)
+
+
+def make_corpus(size, rng):
+    return [make_summary(rng) for _ in range(size)]
+
+
+def legacy_extract(summary):
+    """The extractor before the compiled pattern set, kept verbatim for comparison."""
+    try:
+        newbot.logger.info(f"Extracting details from summary:\n{summary}")
+        details = {}
+        field_mapping = {
+            'Anrede': 'salutation',
+            'Vorname': 'first_name',
+            'Nachname': 'last_name',
+            'Email': 'email',
+            'Telefon': 'phone',
+            'Postleitzahl': 'zip_code',
+            'Menge': 'quantity',
+            'Beschreibung': 'description',
+            'Betreff': 'subject',
+            'Geplanter Start': 'geplanter_start',
+            'Leistung': 'leistung'
+        }
+
+        lines = summary.splitlines()
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            if ':' in line:
+                field_name_part, value = line.split(':', 1)
+                field_name = field_name_part.strip().strip('-').strip().strip('**').strip()
+                value = value.strip()
+                key = field_mapping.get(field_name)
+                if key:
+                    details[key] = value
+                    newbot.logger.info(f"Extracted {key}: {value}")
+                else:
+                    newbot.logger.warning(f"Ignored unrecognized field: {field_name}")
+            else:
+                newbot.logger.warning(f"Ignored line without colon: {line}")
+
+        required_fields = [
+            'first_name', 'last_name', 'email', 'phone',
+            'zip_code', 'quantity', 'description', 'geplanter_start'
+        ]
+        if all(field in details for field in required_fields):
+            newbot.logger.info(f"Parsed Details: {details}")
+            return details
+        else:
+            missing_fields = [field for field in required_fields if field not in details]
+            newbot.logger.error(f"Missing fields: {missing_fields}")
+            return None
+    except Exception as e:
+        newbot.logger.error(f"Error extracting details from summary: {e}")
+        return None
+
+
+def measure(extract, corpus):
+    start = time.perf_counter()
+    results = [extract(summary) for _, summary in corpus]
+    return time.perf_counter() - start, results
+
+
+def success_rate(corpus, results):
+    correct = sum(
+        1 for (expected, _), details in zip(corpus, results)
+        if details and all(details.get(field) == expected[field] for field in newbot.SUMMARY_REQUIRED_FIELDS)
+    )
+    return 100 * correct / len(corpus)
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 9
+    corpus = HELD_OUT + make_corpus(size, random.Random(SEED))
+    extractors = {"legacy": legacy_extract, "compiled": newbot.extract_details_from_summary}
+    print(f"Python {platform.python_version()} on {platform.machine()}, "
+          f"{len(corpus)} summaries ({len(HELD_OUT)} hand-written, {size} generated, seed {SEED}), "
+          f"best and median of {repeats} interleaved runs")
+
+    times = {name: [] for name in extractors}
+    success = {}
+    for _ in range(repeats):
+        # Interleaved, so that noise on the machine hits both extractors alike
+        for name, extract in extractors.items():
+            elapsed, results = measure(extract, corpus)
+            times[name].append(elapsed)
+            success[name] = success_rate(corpus, results)
+
+    for name in extractors:
+        best, median = min(times[name]), statistics.median(times[name])
+        print(f"{name:<10} best {len(corpus) / best:>8.0f}/s   median {len(corpus) / median:>8.0f}/s"
+              f"   success {success[name]:5.1f}%")
+    speedup = statistics.median(legacy / compiled for legacy, compiled in zip(times["legacy"], times["compiled"]))
+    print(f"compiled is {speedup:.2f}x as fast as legacy (median of the per-run ratios)")
+
+
+if __name__ == "__main__":
+    main()
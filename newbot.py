@@ -1,16 +1,36 @@
-from flask import Flask, request, jsonify, render_template, make_response
+from flask import Flask, Response, request, jsonify, render_template, make_response, g
 from flask_cors import CORS
 import os
-from openai import OpenAI
+from openai import OpenAI, NOT_GIVEN
 from dotenv import load_dotenv
 import pymysql
+from pymysql.constants import SERVER_STATUS
+import redis
 import uuid
 import requests
 import time
 import logging
+import json
+import atexit
+import bisect
+import contextvars
+import functools
+import hashlib
+import hmac
+import queue
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from contextlib import closing, contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 from datetime import datetime
 import random  # for random choice
 import re
+import difflib
+try:
+    import fcntl
+except ImportError:  # Windows: the Zoho token refresh is single-flighted per process only
+    fcntl = None
 
 load_dotenv()
 
@@ -20,6 +40,7 @@ logger = logging.getLogger(__name__)
 
 key = os.getenv("OPENAI_API_KEY")
 assistant_id_berater = os.getenv("ASSISTANT_ID_berater")
+assistant_id_pricefinder = os.getenv("ASSISTANT_ID_pricefinder", "")
 
 # Log environment variables
 logger.info("Checking environment variables...")
@@ -33,21 +54,1507 @@ if assistant_id_berater:
 else:
     logger.error("OPENAI_ASSISTANT_ID_berater is NOT set")
 
+if assistant_id_pricefinder:
+    logger.info("ASSISTANT_ID_pricefinder is set")
+else:
+    logger.error("ASSISTANT_ID_pricefinder is NOT set")
+
 client = OpenAI(api_key=key)
 app = Flask(__name__)
 # Enable CORS with credentials
-CORS(app, supports_credentials=True, origins=["https://probenahmeprotokoll.de", "https://erdbaron.com", "https://ersatzbaustoffverordnung.online", "https://deponieverordnung.online", "https://kreislaufwirtschaftsgesetz.online", "https://laga-pn-98.online", "https://bundesbodenschutzverordnung.online"])
+# ----------------------------------------------------------------------
+#  Law-info assistant sites (*.online)
+#  Adding a site = adding an entry here + its ASSISTANT_ID_* env variable.
+#    route           Flask route (its name without "/" is the endpoint name)
+#    name            shown in the logs
+#    assistant_env   env variable holding the OpenAI assistant id
+#    log_table       chat log table (must exist in MySQL)
+#    store_location  log the user's IP, region and city (else empty strings)
+#    origin          site origin, allowed by CORS
+#    cache_answers   serve repeated first-turn questions from the answer cache
+#                    (only if ANSWER_CACHE_ENABLED is set)
+# ----------------------------------------------------------------------
+LAW_SITES = [
+    {
+        "route": "/ersatzbaustoffverordnung",
+        "name": "Ersatzbaustoffverordnung",
+        "assistant_env": "ASSISTANT_ID_ersatzbaustoffverordnung.online",
+        "log_table": "ersatzbaustoffverordnung_log",
+        "store_location": True,
+        "cache_answers": True,
+        "origin": "https://ersatzbaustoffverordnung.online",
+    },
+    {
+        "route": "/kreislaufwirtschaftsgesetz",
+        "name": "Kreislaufwirtschaftsgesetz",
+        "assistant_env": "ASSISTANT_ID_kreislaufwirtschaftsgesetz.online",
+        "log_table": "kreislaufwirtschaftsgesetz_logs",
+        "store_location": False,
+        "cache_answers": True,
+        "origin": "https://kreislaufwirtschaftsgesetz.online",
+    },
+    {
+        "route": "/bundesbodenschutzverordnung",
+        "name": "Bundesbodenschutzverordnung",
+        "assistant_env": "ASSISTANT_ID_bundesbodenschutzverordnung.online",
+        "log_table": "bundesbodenschutzverordnung_logs",
+        "store_location": False,
+        "cache_answers": True,
+        "origin": "https://bundesbodenschutzverordnung.online",
+    },
+    {
+        "route": "/lagapn98",
+        "name": "LAGA PN 98",
+        "assistant_env": "ASSISTANT_ID_laga-pn-98.online",
+        "log_table": "lagapn98_logs",
+        "store_location": False,
+        "cache_answers": True,
+        "origin": "https://laga-pn-98.online",
+    },
+    {
+        "route": "/deponieverordnung",
+        "name": "Deponieverordnung",
+        "assistant_env": "ASSISTANT_ID_deponieverordnung.online",
+        "log_table": "deponieverordnung_logs",
+        "store_location": False,
+        "cache_answers": True,
+        "origin": "https://deponieverordnung.online",
+    },
+]
+
+# Resolve the assistant ids once at startup
+for site in LAW_SITES:
+    site["assistant_id"] = os.getenv(site["assistant_env"])
+    if site["assistant_id"]:
+        logger.info(f"{site['assistant_env']} is set")
+    else:
+        logger.error(f"{site['assistant_env']} is NOT set")
+
+CORS_ORIGINS = ["https://probenahmeprotokoll.de", "https://erdbaron.com"] + [site["origin"] for site in LAW_SITES]
+CORS(app, supports_credentials=True, origins=CORS_ORIGINS)
+
+# ----------------------------------------------------------------------
+#  Metrics (Prometheus text format on /metrics)
+#  request_seconds / requests_total   per route and status
+#  stage_seconds / stage_errors_total per route and stage (OpenAI, Zoho, MySQL, ...)
+#  gauges (sessions, DB pool, queue depths) are read when /metrics is scraped
+# ----------------------------------------------------------------------
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRIC_HELP = {
+    "request_seconds": "Time until the response of a route was returned.",
+    "requests_total": "Requests per route and HTTP status.",
+    "stage_seconds": "Time spent in one stage of a request (OpenAI, Zoho, MySQL, parsing).",
+    "stage_errors_total": "Stages that raised an exception.",
+}
+
+# Route of the request being served; work outside a request is labelled "background"
+current_route = contextvars.ContextVar("current_route", default="background")
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """
+    Small in-process metrics registry rendered in the Prometheus text format.
+    - observe(name, seconds, **labels) adds a histogram sample (fixed buckets)
+    - inc(name, amount, **labels) increments a counter
+    - stage(name) / timed(name) time a stage of the current route (and trace it as a span)
+    - gauge(name, help, collect, label) registers a value read at scrape time;
+      collect() returns a number, or {label value: number}
+    Recording costs a bisect and a few additions under one lock.
+    """
+
+    def __init__(self, buckets=METRICS_BUCKETS, prefix="chatbot_"):
+        self.buckets = buckets
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._histograms = {}  # (name, labels) -> [count per bucket..., count above, sum]
+        self._counters = {}  # (name, labels) -> value
+        self._gauges = []  # (name, help, collect, label)
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            entry = self._histograms.get(key)
+            if entry is None:
+                entry = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[index] += 1
+            entry[-1] += seconds
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    @contextmanager
+    def stage(self, name, route=None):
+        route = route or current_route.get()
+        started = time.perf_counter()
+        try:
+            with tracer.span(name):
+                yield
+        except Exception:
+            self.inc("stage_errors_total", stage=name, route=route)
+            raise
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - started, stage=name, route=route)
+
+    def timed(self, name):
+        """
+        Decorator: times every call of the function as stage `name`.
+        Meant for I/O boundaries (HTTP, database); a span costs several µs, too
+        much for small functions that are called in loops.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def gauge(self, name, help_text, collect, label=None):
+        self._gauges.append((name, help_text, collect, label))
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in pairs) + "}"
+
+    def render(self):
+        with self._lock:
+            histograms = {key: list(entry) for key, entry in self._histograms.items()}
+            counters = dict(self._counters)
+
+        lines = []
+        described = set()
+
+        def describe(name, kind, help_text=None):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {self.prefix}{name} {help_text or METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {self.prefix}{name} {kind}")
+
+        for (name, labels), entry in sorted(histograms.items()):
+            describe(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                lines.append(f"{self.prefix}{name}_bucket{self._labels(labels, [('le', bound)])} {cumulative}")
+            cumulative += entry[len(self.buckets)]
+            lines.append(f"{self.prefix}{name}_bucket{self._labels(labels, [('le', '+Inf')])} {cumulative}")
+            lines.append(f"{self.prefix}{name}_sum{self._labels(labels)} {entry[-1]:.6f}")
+            lines.append(f"{self.prefix}{name}_count{self._labels(labels)} {cumulative}")
+
+        for (name, labels), value in sorted(counters.items()):
+            describe(name, "counter")
+            lines.append(f"{self.prefix}{name}{self._labels(labels)} {value}")
+
+        for name, help_text, collect, label in self._gauges:
+            try:
+                values = collect()
+            except Exception as e:
+                logger.warning(f"Metric {name} could not be collected: {e}")
+                continue
+            if values is None:
+                continue
+            describe(name, "gauge", help_text)
+            if isinstance(values, dict):
+                for label_value, value in values.items():
+                    lines.append(f"{self.prefix}{name}{self._labels([(label, label_value)])} {value}")
+            else:
+                lines.append(f"{self.prefix}{name} {values}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def observe_request(route, status, seconds):
+    """
+    Records one finished request (called from the after_request hooks).
+    """
+    metrics.observe("request_seconds", seconds, route=route)
+    metrics.inc("requests_total", route=route, status=str(status))
+
+
+# ----------------------------------------------------------------------
+#  Sampled request tracing
+#  TRACE_SAMPLE_RATE   share of requests traced (0 = off, 1 = all)
+#  TRACE_SLOW_MS       additionally keep every request slower than this (0 = off)
+#  TRACE_FILE          JSONL file, one span per line (default traces.jsonl)
+#  TRACE_OTLP_ENDPOINT send spans as OTLP/HTTP JSON instead,
+#                      e.g. http://localhost:4318/v1/traces
+# ----------------------------------------------------------------------
+current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    One timed operation of a trace; spans of a trace are exported together
+    once the request's root span has ended.
+    """
+
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attributes", "status",
+                 "start_time", "_started", "duration_ms")
+
+    def __init__(self, trace, name, parent_id=None, attributes=None):
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes or {}
+        self.status = "ok"
+        self.start_time = time.time()
+        self._started = time.perf_counter()
+        self.duration_ms = None
+
+    def end(self):
+        self.duration_ms = (time.perf_counter() - self._started) * 1000
+        self.trace["spans"].append(self)
+
+    def as_dict(self):
+        return {
+            "trace_id": self.trace["trace_id"],
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "duration_ms": round(self.duration_ms, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class TraceExporter:
+    """
+    Writes finished traces off the request path: a background thread appends
+    the spans to a JSONL file, or posts them in OTLP/HTTP JSON to `endpoint`.
+    The queue is bounded; traces that do not fit are dropped and counted.
+    """
+
+    def __init__(self, path="traces.jsonl", endpoint=None, max_queue=1000, service_name="chatbot"):
+        self.path = path
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+        self._counters = {"exported": 0, "spans": 0, "dropped": 0, "failed": 0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+                return
+            self._worker = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+            self._worker_pid = os.getpid()
+            self._worker.start()
+
+    def export(self, spans):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self._count("dropped")
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 50:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            spans = [span for trace in batch for span in trace]
+            try:
+                if self.endpoint:
+                    self._post(spans)
+                else:
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        for span in spans:
+                            f.write(json.dumps(span.as_dict(), ensure_ascii=False, default=str) + "\n")
+                self._count("exported", len(batch))
+                self._count("spans", len(spans))
+            except Exception as e:
+                logger.error(f"Error exporting {len(spans)} span(s): {e}")
+                self._count("failed", len(batch))
+            for _ in batch:
+                self._queue.task_done()
+
+    @staticmethod
+    def _otlp_value(value):
+        if isinstance(value, bool):
+            return {"boolValue": value}
+        if isinstance(value, int):
+            return {"intValue": str(value)}
+        if isinstance(value, float):
+            return {"doubleValue": value}
+        return {"stringValue": str(value)}
+
+    def _post(self, spans):
+        resource = {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]}
+        payload = {"resourceSpans": [{
+            "resource": resource,
+            "scopeSpans": [{
+                "scope": {"name": __name__},
+                "spans": [{
+                    "traceId": span.trace["trace_id"],
+                    "spanId": span.span_id,
+                    "parentSpanId": span.parent_id or "",
+                    "name": span.name,
+                    "kind": 2 if span.parent_id is None else 3,  # SERVER for the request, CLIENT for calls
+                    "startTimeUnixNano": str(int(span.start_time * 1e9)),
+                    "endTimeUnixNano": str(int(span.start_time * 1e9 + span.duration_ms * 1e6)),
+                    "attributes": [
+                        {"key": key, "value": self._otlp_value(value)} for key, value in span.attributes.items()
+                    ],
+                    "status": {"code": 2 if span.status == "error" else 1},
+                } for span in spans],
+            }],
+        }]}
+        response = requests.post(self.endpoint, json=payload, timeout=10)
+        response.raise_for_status()
+
+    def flush(self, timeout=5):
+        """
+        Waits (up to `timeout` seconds) until everything queued is exported.
+        """
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.05)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats["queued"] = self._queue.qsize()
+        return stats
+
+
+class Tracer:
+    """
+    Lightweight request tracing.
+    start_request() opens the root span of a request when it is sampled (or when
+    slow requests are kept); span() opens a child span of the current span and
+    does nothing for requests that are not traced; annotate() adds attributes to
+    the current span. Stages timed by `metrics` are traced as spans as well.
+    """
+
+    def __init__(self, exporter, sample_rate=0.0, slow_ms=0.0):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        self._counters = {"traced": 0, "kept": 0}
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0 or self.slow_ms > 0
+
+    def start_request(self, name, **attributes):
+        if not self.enabled:
+            return None
+        sampled = random.random() < self.sample_rate
+        trace = {"trace_id": f"{random.getrandbits(128):032x}", "sampled": sampled, "spans": []}
+        span = Span(trace, name, attributes=attributes)
+        current_span.set(span)
+        with self._lock:
+            self._counters["traced"] += 1
+        return span
+
+    def finish_request(self, **attributes):
+        span = current_span.get()
+        if span is None:
+            return
+        current_span.set(None)
+        span.attributes.update(attributes)
+        if attributes.get("status_code", 0) >= 500:
+            span.status = "error"
+        span.end()
+        trace = span.trace
+        if trace["sampled"] or (self.slow_ms and span.duration_ms >= self.slow_ms):
+            with self._lock:
+                self._counters["kept"] += 1
+            self.exporter.export(trace["spans"])
+
+    @contextmanager
+    def span(self, name, **attributes):
+        parent = current_span.get()
+        if parent is None:
+            yield None
+            return
+        span = Span(parent.trace, name, parent.span_id, attributes)
+        token = current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.status = "error"
+            span.attributes["error"] = str(e)[:200]
+            raise
+        finally:
+            current_span.reset(token)
+            span.end()
+
+    def annotate(self, **attributes):
+        span = current_span.get()
+        if span is not None:
+            span.attributes.update({key: value for key, value in attributes.items() if value is not None})
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats.update({"sample_rate": self.sample_rate, "slow_ms": self.slow_ms, "exporter": self.exporter.stats()})
+        return stats
+
+
+tracer = Tracer(
+    TraceExporter(
+        path=os.getenv("TRACE_FILE", "traces.jsonl"),
+        endpoint=os.getenv("TRACE_OTLP_ENDPOINT") or None,
+        max_queue=int(os.getenv("TRACE_QUEUE_SIZE", 1000)),
+    ),
+    sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", 0)),
+    slow_ms=float(os.getenv("TRACE_SLOW_MS", 0)),
+)
+atexit.register(tracer.exporter.flush)
+if tracer.enabled:
+    logger.info(f"Request tracing is enabled (sample rate {tracer.sample_rate}, slow {tracer.slow_ms} ms).")
+
+
+@app.before_request
+def start_request_tracking():
+    g.metrics_started = time.perf_counter()
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    current_route.set(route)
+    tracer.start_request(route, route=route, method=request.method)
+
+
+@app.after_request
+def finish_request_tracking(response):
+    # Streaming responses are measured until their first byte
+    if "metrics_started" in g:
+        observe_request(current_route.get(), response.status_code, time.perf_counter() - g.metrics_started)
+    tracer.finish_request(status_code=response.status_code)
+    return response
+
+
+# ----------------------------------------------------------------------
+#  Session store (session_id -> thread id + user details)
+# ----------------------------------------------------------------------
+class SessionStore(ABC):
+    """
+    Interface for session backends.
+    Each record only keeps what the routes need: thread_id, user_details and summary.
+    Every backend must:
+    - serialize assistant runs per session (one OpenAI thread accepts only one
+      active run) through acquire_run_lock()/release_run_lock(),
+    - expire sessions idle for longer than `ttl` seconds,
+    - evict the least recently used session once more than `max_entries` exist,
+    - keep a secondary index thread_id -> session_id so a session can be found
+      from the front-end threadId in O(1) when the cookie is missing
+      (third-party cookie blocking),
+    - apply update(), append_pending()/take_pending() and append_transcript()
+      atomically, so concurrent workers never lose each other's writes.
+    Records returned by get() may be copies; changes go through update().
+    """
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+    @abstractmethod
+    def get(self, session_id):
+        """
+        Returns the session's record (refreshing its idle timer), or None.
+        """
+
+    @abstractmethod
+    def create(self, session_id, thread_id):
+        """
+        Creates (or replaces) the session's record and returns it.
+        """
+
+    @abstractmethod
+    def update(self, session_id, **fields):
+        """
+        Sets the given record fields, leaving all others untouched.
+        Returns the updated record, or None if the session does not exist.
+        """
+
+    @abstractmethod
+    def find_by_thread(self, thread_id):
+        """
+        Returns the session_id owning the OpenAI thread, or None.
+        """
+
+    @abstractmethod
+    def append_pending(self, session_id, messages):
+        """
+        Appends [(role, content)] messages that still have to be written to
+        the session's thread.
+        """
+
+    @abstractmethod
+    def take_pending(self, session_id):
+        """
+        Removes and returns all pending [(role, content)] messages, oldest first.
+        """
+
+    @abstractmethod
+    def append_transcript(self, session_id, lines):
+        """
+        Appends lines to the session's local transcript.
+        """
+
+    @abstractmethod
+    def get_transcript(self, session_id):
+        """
+        Returns the session's transcript lines, or None if the session does not exist.
+        """
+
+    @abstractmethod
+    def acquire_run_lock(self, session_id, wait=60, lease=180):
+        """
+        Waits up to `wait` seconds for the session's run lock and returns a
+        token for release_run_lock(), or None on timeout. A lock not released
+        within `lease` seconds (crashed worker, abandoned stream) expires.
+        """
+
+    @abstractmethod
+    def release_run_lock(self, session_id, token):
+        """
+        Releases the run lock if `token` still holds it.
+        """
+
+    @abstractmethod
+    def run_locked(self, session_id):
+        """
+        True while some request holds the session's run lock.
+        """
+
+    @abstractmethod
+    def evict(self, session_id):
+        """
+        Removes the session with its thread index entry and transcript; returns the old record.
+        """
+
+    @abstractmethod
+    def stats(self):
+        """
+        Returns the store's counters as a dict.
+        """
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Thread-safe, bounded session store inside the current process.
+    Only suitable for a single worker.
+    """
+
+    def __init__(self, max_entries=10000, ttl=86400):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._sessions = OrderedDict()  # least recently used first
+        self._last_access = {}
+        self._by_thread = {}
+        self._lock = threading.RLock()
+        self._run_locks = {}  # session_id -> {"holder", "expires_at", "queue"}
+        self._run_lock_changed = threading.Condition(self._lock)
+        self._counters = {
+            "created": 0,
+            "hits": 0,
+            "misses": 0,
+            "evicted_lru": 0,
+            "evicted_ttl": 0,
+        }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def get(self, session_id):
+        now = time.time()
+        with self._lock:
+            record = self._sessions.get(session_id)
+            if record is not None and now - self._last_access[session_id] > self.ttl:
+                self._remove(session_id)
+                self._counters["evicted_ttl"] += 1
+                record = None
+            if record is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["hits"] += 1
+            self._sessions.move_to_end(session_id)
+            self._last_access[session_id] = now
+            return record
+
+    def create(self, session_id, thread_id):
+        record = {
+            "thread_id": thread_id,
+            "user_details": {},
+            "summary": None,
+            "transcript": [],
+            "pending_messages": []
+        }
+        now = time.time()
+        with self._lock:
+            self._remove(session_id)
+            self._sessions[session_id] = record
+            self._last_access[session_id] = now
+            if thread_id:
+                self._by_thread[thread_id] = session_id
+            self._counters["created"] += 1
+            self._evict(now)
+        return record
+
+    def update(self, session_id, **fields):
+        with self._lock:
+            record = self._sessions.get(session_id)
+            if record is None:
+                return None
+            old_thread_id = record["thread_id"]
+            record.update(fields)
+            if record["thread_id"] != old_thread_id:
+                if old_thread_id and self._by_thread.get(old_thread_id) == session_id:
+                    del self._by_thread[old_thread_id]
+                if record["thread_id"]:
+                    self._by_thread[record["thread_id"]] = session_id
+            return record
+
+    def append_pending(self, session_id, messages):
+        with self._lock:
+            record = self._sessions.get(session_id)
+            if record is not None:
+                record.setdefault("pending_messages", []).extend([role, content] for role, content in messages)
+
+    def take_pending(self, session_id):
+        with self._lock:
+            record = self._sessions.get(session_id)
+            if record is None:
+                return []
+            pending = record.get("pending_messages", [])
+            record["pending_messages"] = []
+            return pending
+
+    def append_transcript(self, session_id, lines):
+        with self._lock:
+            record = self._sessions.get(session_id)
+            if record is not None:
+                record.setdefault("transcript", []).extend(lines)
+
+    def get_transcript(self, session_id):
+        with self._lock:
+            record = self._sessions.get(session_id)
+            if record is None:
+                return None
+            return list(record.get("transcript", []))
+
+    def acquire_run_lock(self, session_id, wait=60, lease=180):
+        # FIFO: requests for the same session get the lock in arrival order
+        token = uuid.uuid4().hex
+        deadline = time.time() + wait
+        with self._lock:
+            entry = self._run_locks.setdefault(session_id, {"holder": None, "expires_at": 0, "queue": deque()})
+            entry["queue"].append(token)
+            while True:
+                now = time.time()
+                if entry["holder"] is not None and now >= entry["expires_at"]:
+                    logger.warning(f"Run lock for session {session_id} expired, taking over.")
+                    entry["holder"] = None
+                if entry["holder"] is None and entry["queue"][0] == token:
+                    entry["queue"].popleft()
+                    entry["holder"] = token
+                    entry["expires_at"] = now + lease
+                    return token
+                if now >= deadline:
+                    entry["queue"].remove(token)
+                    if entry["holder"] is None and not entry["queue"]:
+                        del self._run_locks[session_id]
+                    self._run_lock_changed.notify_all()
+                    return None
+                timeout = deadline - now
+                if entry["holder"] is not None:
+                    timeout = min(timeout, entry["expires_at"] - now)
+                self._run_lock_changed.wait(timeout)
+
+    def release_run_lock(self, session_id, token):
+        with self._lock:
+            entry = self._run_locks.get(session_id)
+            if entry is None or entry["holder"] != token:
+                return
+            entry["holder"] = None
+            if not entry["queue"]:
+                del self._run_locks[session_id]
+            self._run_lock_changed.notify_all()
+
+    def run_locked(self, session_id):
+        with self._lock:
+            entry = self._run_locks.get(session_id)
+            return entry is not None and entry["holder"] is not None and time.time() < entry["expires_at"]
+
+    def find_by_thread(self, thread_id):
+        with self._lock:
+            session_id = self._by_thread.get(thread_id)
+            if session_id is not None and time.time() - self._last_access[session_id] > self.ttl:
+                self._remove(session_id)
+                self._counters["evicted_ttl"] += 1
+                return None
+            return session_id
+
+    def evict(self, session_id):
+        with self._lock:
+            return self._remove(session_id)
+
+    def _evict(self, now):
+        # Expired sessions sit at the front (least recently used), so this stops at the first live one.
+        while self._sessions:
+            oldest = next(iter(self._sessions))
+            if len(self._sessions) > self.max_entries:
+                self._counters["evicted_lru"] += 1
+            elif now - self._last_access[oldest] > self.ttl:
+                self._counters["evicted_ttl"] += 1
+            else:
+                break
+            self._remove(oldest)
+
+    def _remove(self, session_id):
+        record = self._sessions.pop(session_id, None)
+        self._last_access.pop(session_id, None)
+        if record is not None and self._by_thread.get(record["thread_id"]) == session_id:
+            del self._by_thread[record["thread_id"]]
+        return record
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({
+                "size": len(self._sessions),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+            })
+        return stats
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Session store shared by all workers/instances through Redis.
+    Keys (all under `prefix`):
+      record:<session_id>   hash, one JSON-encoded value per record field,
+                            expires after `ttl` idle seconds
+      thread:<thread_id>    session_id, expires together with its session
+      pending:<session_id>  list of JSON [role, content] messages not yet in the thread
+      transcript:<session_id>  list of transcript lines, expires together with its session
+      runlock:<session_id>  token of the request whose assistant run is active (SET NX with a lease)
+      lru                   sorted set session_id -> last access, used for LRU eviction
+    get() refreshes the expiries and the LRU score in a single round-trip.
+    update() only writes the given fields (HSET inside a script), so concurrent
+    workers updating different fields never overwrite each other.
+    """
+
+    _TOUCH_SCRIPT = """
+    local fields = redis.call('HGETALL', KEYS[1])
+    if #fields == 0 then
+        return nil
+    end
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+    local thread_id = cjson.decode(redis.call('HGET', KEYS[1], 'thread_id') or 'null')
+    if type(thread_id) == 'string' then
+        redis.call('EXPIRE', ARGV[2] .. thread_id, ARGV[1])
+    end
+    redis.call('ZADD', KEYS[2], ARGV[3], ARGV[4])
+    return fields
+    """
+
+    # ARGV: ttl, thread key prefix, session_id, new thread_id ('' = none),
+    # '1' if thread_id changes, then field/value pairs
+    _UPDATE_SCRIPT = """
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return nil
+    end
+    if ARGV[5] == '1' then
+        local old = cjson.decode(redis.call('HGET', KEYS[1], 'thread_id') or 'null')
+        if type(old) == 'string' and old ~= ARGV[4] and redis.call('GET', ARGV[2] .. old) == ARGV[3] then
+            redis.call('DEL', ARGV[2] .. old)
+        end
+        if ARGV[4] ~= '' then
+            redis.call('SET', ARGV[2] .. ARGV[4], ARGV[3], 'EX', ARGV[1])
+        end
+    end
+    redis.call('HSET', KEYS[1], unpack(ARGV, 6))
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+    return redis.call('HGETALL', KEYS[1])
+    """
+
+    _RELEASE_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, url=None, max_entries=10000, ttl=86400, prefix="chatbot:", client=None):
+        self.max_entries = max_entries
+        self.ttl = int(ttl)
+        self.prefix = prefix
+        self._redis = client if client is not None else redis.Redis.from_url(url, decode_responses=True)
+        self._touch = self._redis.register_script(self._TOUCH_SCRIPT)
+        self._update = self._redis.register_script(self._UPDATE_SCRIPT)
+        self._release = self._redis.register_script(self._RELEASE_SCRIPT)
+        self._lru_key = f"{prefix}lru"
+        self._lock = threading.Lock()
+        self._counters = {
+            "created": 0,
+            "hits": 0,
+            "misses": 0,
+            "evicted_lru": 0,
+            "evicted_ttl": 0,
+        }
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _session_key(self, session_id):
+        return f"{self.prefix}record:{session_id}"
+
+    def _thread_key(self, thread_id):
+        return f"{self.prefix}thread:{thread_id}"
+
+    def _pending_key(self, session_id):
+        return f"{self.prefix}pending:{session_id}"
+
+    def _transcript_key(self, session_id):
+        return f"{self.prefix}transcript:{session_id}"
+
+    def _run_lock_key(self, session_id):
+        return f"{self.prefix}runlock:{session_id}"
+
+    @staticmethod
+    def _decode(fields):
+        # HGETALL through a script comes back as a flat [field, value, ...] list
+        if isinstance(fields, list):
+            fields = dict(zip(fields[::2], fields[1::2]))
+        return {name: json.loads(value) for name, value in fields.items()}
+
+    def __len__(self):
+        return self._redis.zcard(self._lru_key)
+
+    def get(self, session_id):
+        fields = self._touch(
+            keys=[self._session_key(session_id), self._lru_key],
+            args=[self.ttl, f"{self.prefix}thread:", time.time(), session_id],
+        )
+        if not fields:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return self._decode(fields)
+
+    def create(self, session_id, thread_id):
+        record = {
+            "thread_id": thread_id,
+            "user_details": {},
+            "summary": None
+        }
+        self.evict(session_id)
+        key = self._session_key(session_id)
+        pipe = self._redis.pipeline()
+        pipe.hset(key, mapping={name: json.dumps(value) for name, value in record.items()})
+        pipe.expire(key, self.ttl)
+        if thread_id:
+            pipe.set(self._thread_key(thread_id), session_id, ex=self.ttl)
+        pipe.zadd(self._lru_key, {session_id: time.time()})
+        pipe.execute()
+        self._count("created")
+        self._evict()
+        return record
+
+    def update(self, session_id, **fields):
+        if not fields:
+            return self.get(session_id)
+        thread_changes = "thread_id" in fields
+        args = [
+            self.ttl, f"{self.prefix}thread:", session_id,
+            (fields.get("thread_id") or "") if thread_changes else "",
+            "1" if thread_changes else "0",
+        ]
+        for name, value in fields.items():
+            args += [name, json.dumps(value)]
+        record = self._update(keys=[self._session_key(session_id)], args=args)
+        return self._decode(record) if record else None
+
+    def find_by_thread(self, thread_id):
+        return self._redis.get(self._thread_key(thread_id))
+
+    def append_pending(self, session_id, messages):
+        key = self._pending_key(session_id)
+        pipe = self._redis.pipeline()
+        pipe.rpush(key, *(json.dumps([role, content]) for role, content in messages))
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def take_pending(self, session_id):
+        # MULTI/EXEC: nothing appended between LRANGE and DEL gets lost
+        key = self._pending_key(session_id)
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.lrange(key, 0, -1)
+        pipe.delete(key)
+        values, _ = pipe.execute()
+        return [json.loads(value) for value in values]
+
+    def append_transcript(self, session_id, lines):
+        # RPUSH is atomic, so concurrent workers never lose each other's lines
+        key = self._transcript_key(session_id)
+        pipe = self._redis.pipeline()
+        pipe.rpush(key, *lines)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def acquire_run_lock(self, session_id, wait=60, lease=180):
+        # Polls with backoff; across workers the order of waiting requests is best effort
+        token = uuid.uuid4().hex
+        key = self._run_lock_key(session_id)
+        deadline = time.time() + wait
+        delay = 0.05
+        while True:
+            if self._redis.set(key, token, nx=True, px=int(lease * 1000)):
+                return token
+            if time.time() >= deadline:
+                return None
+            time.sleep(min(delay, max(deadline - time.time(), 0)))
+            delay = min(delay * 2, 0.5)
+
+    def release_run_lock(self, session_id, token):
+        # Only the holder may release; an expired lease may already belong to another request
+        self._release(keys=[self._run_lock_key(session_id)], args=[token])
+
+    def run_locked(self, session_id):
+        return bool(self._redis.exists(self._run_lock_key(session_id)))
+
+    def get_transcript(self, session_id):
+        pipe = self._redis.pipeline()
+        pipe.exists(self._session_key(session_id))
+        pipe.lrange(self._transcript_key(session_id), 0, -1)
+        exists, lines = pipe.execute()
+        return lines if exists else None
+
+    def evict(self, session_id):
+        fields = self._redis.hgetall(self._session_key(session_id))
+        record = self._decode(fields) if fields else None
+        pipe = self._redis.pipeline()
+        pipe.delete(self._session_key(session_id))
+        pipe.delete(self._pending_key(session_id))
+        pipe.delete(self._transcript_key(session_id))
+        if record is not None and record.get("thread_id"):
+            pipe.delete(self._thread_key(record["thread_id"]))
+        pipe.zrem(self._lru_key, session_id)
+        pipe.execute()
+        return record
+
+    def _evict(self):
+        # Expired keys are dropped by Redis itself; only the LRU index needs trimming.
+        expired = self._redis.zremrangebyscore(self._lru_key, "-inf", time.time() - self.ttl)
+        if expired:
+            self._count("evicted_ttl", expired)
+        overflow = self._redis.zcard(self._lru_key) - self.max_entries
+        if overflow > 0:
+            for session_id, _ in self._redis.zpopmin(self._lru_key, overflow):
+                self.evict(session_id)
+                self._count("evicted_lru")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats.update({
+            "size": len(self),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+        })
+        return stats
+
+
+def create_session_store():
+    """
+    Builds the session backend selected by SESSION_BACKEND ("memory" or "redis").
+    """
+    backend = os.getenv("SESSION_BACKEND", "memory").lower()
+    max_entries = int(os.getenv("SESSION_MAX_ENTRIES", 10000))
+    ttl = float(os.getenv("SESSION_TTL", 86400))
+    if backend == "redis":
+        logger.info("Using Redis session backend.")
+        return RedisSessionStore(
+            os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+            max_entries=max_entries,
+            ttl=ttl,
+            prefix=os.getenv("REDIS_KEY_PREFIX", "chatbot:"),
+        )
+    if backend != "memory":
+        logger.error(f"Unknown SESSION_BACKEND '{backend}', falling back to in-memory sessions.")
+    return InMemorySessionStore(max_entries=max_entries, ttl=ttl)
+
+
+session_store = create_session_store()
+
+
+def find_session_id(session_cookie=None, thread_id_from_body=None):
+    """
+    Returns the session_id from the cookie or, failing that, the session owning
+    the front-end threadId (via the thread index). Never creates anything.
+    """
+    session_id = session_cookie
+
+    # If no session_id, check if front-end gave us a threadId
+    if not session_id and thread_id_from_body:
+        session_id = session_store.find_by_thread(thread_id_from_body)
+        if session_id:
+            logger.info("Found matching session based on front-end threadId.")
+    return session_id
+
+
+def get_or_create_session(session_cookie=None, thread_id_from_body=None):
+    """
+    Resolves the session for the current request: the session_id cookie first,
+    then the front-end threadId (via the thread index), otherwise a new session.
+    New sessions have no OpenAI thread yet (thread_id None); it is created by
+    prepare_run() on the first turn that needs an assistant run; until then
+    replies without a run carry a local id (see reply_thread_id).
+    Returns (session_id, thread_id, is_new), is_new being True when the session was just created.
+    """
+    session_id = find_session_id(session_cookie, thread_id_from_body)
+    record = session_store.get(session_id) if session_id else None
+    is_new = record is None
+    if not session_id:
+        session_id = str(uuid.uuid4())
+        record = session_store.create(session_id, None)
+        logger.info(f"New session created with ID: {session_id}")
+    elif record is None:
+        # We have a session_id but no data for it (expired, evicted or after a restart)
+        record = session_store.create(session_id, None)
+        logger.info(f"Session data initialized for existing session ID: {session_id}")
+
+    thread_id = record["thread_id"]
+    logger.info(f"Using thread ID: {thread_id}")
+    return session_id, thread_id, is_new
+
+
+# Assistant runs of one session are serialized (an OpenAI thread accepts only one active run)
+RUN_LOCK_WAIT = float(os.getenv("RUN_LOCK_WAIT", 60))
+RUN_LOCK_LEASE = float(os.getenv("RUN_LOCK_LEASE", 180))
+BUSY_RESPONSE = "Einen Moment bitte – Ihre vorherige Nachricht wird noch beantwortet."
+
+
+class RunBusyError(Exception):
+    """
+    The session's previous run did not finish within RUN_LOCK_WAIT seconds.
+    """
+
+
+class SessionRunLock:
+    """
+    Holds the session's run lock (see SessionStore.acquire_run_lock) for one request:
+        with SessionRunLock(session_id) as run_lock:
+            ...
+    Requests on the same session wait for each other, other sessions stay parallel.
+    A streaming response takes over the release via hand_over().
+    """
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self._token = session_store.acquire_run_lock(session_id, wait=RUN_LOCK_WAIT, lease=RUN_LOCK_LEASE)
+        if self._token is None:
+            raise RunBusyError(session_id)
+        self._handed_over = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if not self._handed_over:
+            self.release()
+
+    def hand_over(self):
+        self._handed_over = True
+        return self.release
+
+    def release(self):
+        if self._token is not None:
+            session_store.release_run_lock(self.session_id, self._token)
+            self._token = None
+
+
+class MessageCoalescer:
+    """
+    Groups user messages of one session that arrive within `window` seconds
+    (or while that session's previous run is still active) into one batch,
+    answered by a single assistant run.
+    The first request of a batch leads it: it waits `window` seconds, takes the
+    session's run lock, then take()s the batch, runs and publishes the result;
+    the other requests of the batch just wait for that result.
+    Batches live in this process; across workers the run lock still serializes.
+    """
+
+    class Batch:
+        def __init__(self, message):
+            self.messages = [message]
+            self.closed = False
+            self.future = Future()
+
+    def __init__(self, window=1.0):
+        self.window = window
+        self._open = {}  # key -> Batch still accepting messages
+        self._lock = threading.Lock()
+        self._counters = {"batches": 0, "coalesced": 0}
+
+    def join(self, key, message):
+        """
+        Adds the message to the key's open batch or opens a new one.
+        Returns (batch, is_leader).
+        """
+        with self._lock:
+            batch = self._open.get(key)
+            if batch is not None:
+                batch.messages.append(message)
+                self._counters["coalesced"] += 1
+                return batch, False
+            batch = self.Batch(message)
+            self._open[key] = batch
+            self._counters["batches"] += 1
+            return batch, True
+
+    def take(self, key, batch):
+        """
+        Closes the batch for new messages and returns its messages.
+        """
+        with self._lock:
+            batch.closed = True
+            if self._open.get(key) is batch:
+                del self._open[key]
+            return list(batch.messages)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({"open": len(self._open), "window": self.window})
+        return stats
+
+
+message_coalescer = None
+if float(os.getenv("COALESCE_WINDOW", 0)) > 0:
+    message_coalescer = MessageCoalescer(window=float(os.getenv("COALESCE_WINDOW", 0)))
+    logger.info("Coalescing of rapid-fire user messages is enabled.")
+
+
+def coalesced_run(key, user_message, run_batch):
+    """
+    Calls run_batch(take_messages) once for all messages of `key` coalesced with
+    this one and returns its result to every request of the batch.
+    run_batch must call take_messages() once it holds the session's run lock;
+    it returns the user messages to answer. Without a coalescer it is [user_message].
+    """
+    if message_coalescer is None:
+        return run_batch(lambda: [user_message])
+
+    batch, is_leader = message_coalescer.join(key, user_message)
+    if not is_leader:
+        tracer.annotate(coalesced=True)
+        logger.info(f"Message coalesced into the pending run for {key[0]}.")
+        try:
+            return batch.future.result(timeout=RUN_LOCK_WAIT + RUN_LOCK_LEASE)
+        except FuturesTimeoutError:
+            raise RunBusyError(key)
+
+    time.sleep(message_coalescer.window)
+    try:
+        result = run_batch(lambda: message_coalescer.take(key, batch))
+    except Exception as e:
+        message_coalescer.take(key, batch)
+        batch.future.set_exception(e)
+        raise
+    batch.future.set_result(result)
+    return result
+
+
+# Assistant runs are polled by RunExecutor with a deadline per route
+RUN_DEADLINE = float(os.getenv("RUN_DEADLINE", 60))
+# e.g. RUN_DEADLINES="/pricefinder=30,/askberater=90"
+RUN_DEADLINES = {
+    route.strip(): float(seconds)
+    for route, _, seconds in (
+        entry.partition("=") for entry in os.getenv("RUN_DEADLINES", "").split(",") if "=" in entry
+    )
+}
+TIMEOUT_RESPONSE = "Die Antwort dauert gerade leider zu lange. Bitte versuchen Sie es gleich noch einmal."
+
+
+class RunTimeoutError(Exception):
+    """
+    The assistant run did not finish before its route's deadline (it was cancelled).
+    """
+
+
+class RunFailedError(Exception):
+    """
+    The assistant run ended without completing (failed, expired, cancelled, ...).
+    """
+
+
+class RunExecutor:
+    """
+    Starts assistant runs and polls them until they finish or the route's deadline
+    passes. Polling starts fast (min_interval) and backs off by `backoff` up to
+    max_interval, so short runs are picked up quickly and long ones cost few requests.
+    A run past its deadline is cancelled, so the thread accepts the next run again.
+    """
+
+    TERMINAL_STATUSES = {"completed", "failed", "cancelled", "expired", "incomplete", "requires_action"}
+
+    def __init__(self, default_deadline=60.0, deadlines=None, min_interval=0.25, max_interval=2.0,
+                 backoff=1.5, cancel_wait=5.0):
+        self.default_deadline = default_deadline
+        self.deadlines = deadlines or {}
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.cancel_wait = cancel_wait
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def deadline(self, route):
+        return self.deadlines.get(route, self.default_deadline)
+
+    def intervals(self):
+        interval = self.min_interval
+        while True:
+            yield interval
+            interval = min(interval * self.backoff, self.max_interval)
+
+    def run(self, route, thread_id, assistant_id, additional_messages=None):
+        """
+        Runs the assistant on the thread; returns the completed run.
+        """
+        run = client.beta.threads.runs.create(
+            thread_id=thread_id,
+            assistant_id=assistant_id,
+            additional_messages=additional_messages or NOT_GIVEN
+        )
+        return self.wait(route, run)
+
+    def stream(self, route, thread_id, assistant_id, additional_messages=None):
+        """
+        Runs the assistant through the OpenAI run stream and yields its text deltas.
+        Past the route's deadline a watchdog cancels the run and closes the stream,
+        so a stuck stream cannot hold the worker and the session's run lock; the
+        generator then raises RunTimeoutError. A stream closed early by its reader
+        (the client went away) cancels the run as well.
+        """
+        started = time.monotonic()
+        timed_out = threading.Event()
+        with client.beta.threads.runs.stream(
+            thread_id=thread_id,
+            assistant_id=assistant_id,
+            additional_messages=additional_messages or NOT_GIVEN
+        ) as stream:
+            def expire():
+                timed_out.set()
+                if stream.current_run is not None:
+                    self.cancel(stream.current_run)
+                stream.close()
+
+            watchdog = threading.Timer(self.deadline(route), expire)
+            watchdog.daemon = True
+            watchdog.start()
+            try:
+                for text in stream.text_deltas:
+                    if timed_out.is_set():
+                        break
+                    yield text
+            except GeneratorExit:
+                watchdog.cancel()
+                if stream.current_run is not None and stream.current_run.status not in self.TERMINAL_STATUSES:
+                    self.cancel(stream.current_run)
+                self.record(route, "cancelled", time.monotonic() - started, 0)
+                raise
+            except Exception:
+                if not timed_out.is_set():
+                    self.record(route, "failed", time.monotonic() - started, 0)
+                    raise
+            finally:
+                watchdog.cancel()
+        if timed_out.is_set():
+            self.record(route, "timeout", time.monotonic() - started, 0)
+            raise RunTimeoutError(f"Run stream on {route} exceeded {self.deadline(route)}s")
+        self.finish(route, stream.current_run, time.monotonic() - started, 0)
+
+    def wait(self, route, run):
+        with tracer.span("openai_run", thread_id=run.thread_id, run_id=run.id, assistant_id=run.assistant_id):
+            return self._poll(route, run)
+
+    def _poll(self, route, run):
+        started = time.monotonic()
+        deadline = started + self.deadline(route)
+        polls = 0
+        intervals = self.intervals()
+        while run.status not in self.TERMINAL_STATUSES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.cancel(run)
+                self.record(route, "timeout", time.monotonic() - started, polls)
+                raise RunTimeoutError(f"Run {run.id} on {route} exceeded {self.deadline(route)}s")
+            time.sleep(min(next(intervals), remaining))
+            run = client.beta.threads.runs.retrieve(thread_id=run.thread_id, run_id=run.id)
+            polls += 1
+        return self.finish(route, run, time.monotonic() - started, polls)
+
+    def cancel(self, run):
+        """
+        Cancels the run and waits (up to cancel_wait seconds) until OpenAI confirms it.
+        """
+        logger.warning(f"Cancelling run {run.id} on thread {run.thread_id}.")
+        try:
+            client.beta.threads.runs.cancel(thread_id=run.thread_id, run_id=run.id)
+            give_up = time.monotonic() + self.cancel_wait
+            while time.monotonic() < give_up:
+                run = client.beta.threads.runs.retrieve(thread_id=run.thread_id, run_id=run.id)
+                if run.status in self.TERMINAL_STATUSES:
+                    return
+                time.sleep(self.min_interval)
+            logger.error(f"Run {run.id} is still {run.status} after cancelling.")
+        except Exception as e:
+            logger.error(f"Error cancelling run {run.id}: {e}")
+
+    def finish(self, route, run, seconds, polls):
+        """
+        Records a finished run; returns it if it completed, raises RunFailedError otherwise.
+        """
+        self.record(route, run.status, seconds, polls)
+        if run.status == "completed":
+            return run
+        if run.status == "requires_action":
+            # No tools are wired up; a waiting run would block the thread until it expires
+            self.cancel(run)
+        raise RunFailedError(f"Run {run.id} on {route} ended with status {run.status}")
+
+    def record(self, route, outcome, seconds, polls):
+        tracer.annotate(status=outcome, polls=polls)
+        metrics.observe("stage_seconds", seconds, stage="openai_run", route=route)
+        if outcome != "completed":
+            metrics.inc("stage_errors_total", stage="openai_run", route=route)
+        with self._lock:
+            counters = self._routes.setdefault(route, {
+                "runs": 0, "completed": 0, "timeouts": 0, "failed": 0,
+                "polls": 0, "seconds": 0.0, "max_seconds": 0.0,
+            })
+            counters["runs"] += 1
+            if outcome == "completed":
+                counters["completed"] += 1
+            elif outcome == "timeout":
+                counters["timeouts"] += 1
+            else:
+                counters["failed"] += 1
+            counters["polls"] += polls
+            counters["seconds"] += seconds
+            counters["max_seconds"] = max(counters["max_seconds"], seconds)
+
+    def stats(self):
+        with self._lock:
+            routes = {
+                route: dict(
+                    counters,
+                    seconds=round(counters["seconds"], 3),
+                    max_seconds=round(counters["max_seconds"], 3),
+                    avg_seconds=round(counters["seconds"] / counters["runs"], 3),
+                    deadline=self.deadline(route),
+                )
+                for route, counters in self._routes.items()
+            }
+        return {"default_deadline": self.default_deadline, "routes": routes}
+
+
+run_executor = RunExecutor(
+    default_deadline=RUN_DEADLINE,
+    deadlines=RUN_DEADLINES,
+    min_interval=float(os.getenv("RUN_POLL_MIN", 0.25)),
+    max_interval=float(os.getenv("RUN_POLL_MAX", 2.0)),
+    backoff=float(os.getenv("RUN_POLL_BACKOFF", 1.5)),
+)
+
+
+def queue_thread_messages(session_id, thread_id, messages):
+    """
+    Stores [(role, content)] messages that need no assistant run with the
+    session. prepare_run() hands them to the next run under the session's run
+    lock, so they can never race a run on the thread (which rejects messages
+    while a run is active) from another request or worker.
+    """
+    session_store.append_pending(session_id, messages)
+
+
+# Replies without a run hand out a local thread id until the session's first run
+# creates its OpenAI thread; prepare_run() then swaps in the real one
+LOCAL_THREAD_PREFIX = "local_"
+
+
+def reply_thread_id(session_id, thread_id):
+    """
+    Returns the thread_id for a reply that needs no run, without calling OpenAI.
+    A session without a thread gets a local id, indexed like a thread id, so
+    cookie-less clients can send it back as threadId and keep their session.
+    """
+    if thread_id:
+        return thread_id
+    thread_id = LOCAL_THREAD_PREFIX + uuid.uuid4().hex
+    session_store.update(session_id, thread_id=thread_id)
+    return thread_id
+
+
+def prepare_run(session_id, thread_id, *user_messages):
+    """
+    Gets the session's thread ready for a run on the user's message(s)
+    (called while holding the session's SessionRunLock).
+    Returns (thread_id, additional_messages); the run adds additional_messages
+    to the thread itself, which saves a messages.create() round-trip.
+    Without a thread yet (or only a local id from reply_thread_id), a pre-warmed
+    one from thread_pool is used, or the thread is created together with the
+    pending messages and these messages.
+    """
+    # Another request of the session may have created the thread before we got the lock
+    record = session_store.get(session_id)
+    if record is not None and record["thread_id"]:
+        thread_id = record["thread_id"]
+
+    pending = session_store.take_pending(session_id)
+    messages = [{"role": role, "content": content} for role, content in pending]
+    messages += [{"role": "user", "content": user_message} for user_message in user_messages]
+
+    if thread_id and not thread_id.startswith(LOCAL_THREAD_PREFIX):
+        return thread_id, messages
+
+    thread_id = thread_pool.take() if thread_pool is not None else None
+    if thread_id:
+        additional_messages = messages
+        logger.info(f"Pre-warmed thread {thread_id} assigned to session {session_id}.")
+    else:
+        with metrics.stage("openai_thread_create"):
+            thread_id = client.beta.threads.create(messages=messages).id
+        additional_messages = []
+        logger.info(f"Thread {thread_id} created for session {session_id}.")
+    session_store.update(session_id, thread_id=thread_id)
+    return thread_id, additional_messages
 
-# Dictionary to store session data (thread IDs and user details)
-session_data = {}
 
 # Variables to manage tokens for Zoho API
 access_token = os.getenv("ZOHO_ACCESS_TOKEN")
 refresh_token = os.getenv("ZOHO_REFRESH_TOKEN")
 client_id = os.getenv("ZOHO_CLIENT_ID")
 client_secret = os.getenv("ZOHO_CLIENT_SECRET")
-token_expires_in = 3600  # Time in seconds
-token_last_refresh_time = time.time()
 
 # Log Zoho credentials
 logger.info("Checking Zoho API credentials...")
@@ -72,38 +1579,305 @@ else:
     logger.error("ZOHO_CLIENT_SECRET is NOT set")
 
 
-def refresh_access_token():
+# Shared keep-alive HTTP session for every Zoho call (token refresh + CRM)
+zoho_http = requests.Session()
+zoho_http.mount("https://", requests.adapters.HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=int(os.getenv("ZOHO_HTTP_POOL_SIZE", 10))
+))
+
+
+class ZohoTokenManager:
     """
-    Refreshes the Zoho CRM access token using the provided refresh token.
+    Thread-safe holder of the Zoho CRM access token.
+    - get_token() returns a valid token, refreshing it first if it is (nearly) expired.
+    - Concurrent refreshes are single-flighted: one thread calls Zoho, the
+      others wait and reuse its result.
+    - A background thread refreshes `refresh_ahead` seconds before expiry,
+      so requests normally never wait for a refresh.
+    - The token is persisted to `cache_path`, so a restart reuses it. Workers
+      sharing that file refresh under a file lock and re-read it first, so a
+      token another worker just fetched is reused instead of refreshed again
+      (use an absolute ZOHO_TOKEN_CACHE when workers run in different directories).
     """
-    global access_token, token_last_refresh_time, token_expires_in
-    url = "https://accounts.zoho.eu/oauth/v2/token"
-    payload = {
-        'refresh_token': refresh_token,
-        'client_id': client_id,
-        'client_secret': client_secret,
-        'grant_type': 'refresh_token'
-    }
-    response = requests.post(url, params=payload)
-    if response.status_code == 200:
-        response_data = response.json()
-        access_token = response_data['access_token']
-        token_expires_in = response_data.get('expires_in', 3600)
-        token_last_refresh_time = time.time()
-        logger.info("Access token refreshed.")
-    else:
-        logger.error(f"Failed to refresh access token: {response.text}")
-        raise Exception("Failed to refresh access token")
 
+    TOKEN_URL = "https://accounts.zoho.eu/oauth/v2/token"
+
+    def __init__(self, access_token, refresh_token, client_id, client_secret,
+                 cache_path=None, refresh_ahead=300, expires_in=3600):
+        self.refresh_token = refresh_token
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.cache_path = cache_path
+        self.refresh_ahead = refresh_ahead
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+        self._counters = {"refreshes": 0, "refresh_failures": 0, "shared_refreshes": 0}
+        self._access_token = access_token
+        self._expires_at = time.time() + expires_in
+        self._load()
+
+    def _load(self, newer_than=0):
+        """
+        Takes the token from cache_path if it is still valid and expires after
+        newer_than. Returns True if it did.
+        """
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return False
+        try:
+            with open(self.cache_path) as f:
+                cached = json.load(f)
+            if cached.get("expires_at", 0) > max(time.time(), newer_than):
+                with self._lock:
+                    self._access_token = cached["access_token"]
+                    self._expires_at = cached["expires_at"]
+                logger.info("Zoho access token loaded from cache.")
+                return True
+        except Exception as e:
+            logger.warning(f"Could not read Zoho token cache: {e}")
+        return False
+
+    @contextmanager
+    def _file_lock(self):
+        """
+        Serializes refreshes across the worker processes sharing cache_path.
+        """
+        if not self.cache_path or fcntl is None:
+            yield
+            return
+        with open(f"{self.cache_path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
 
-def ensure_valid_access_token():
+    def _save(self):
+        if not self.cache_path:
+            return
+        try:
+            tmp_path = f"{self.cache_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"access_token": self._access_token, "expires_at": self._expires_at}, f)
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, self.cache_path)
+        except Exception as e:
+            logger.warning(f"Could not persist Zoho token: {e}")
+
+    def get_token(self):
+        """
+        Returns an access token that is valid for at least a few more seconds.
+        """
+        self.ensure_started()
+        with self._lock:
+            token, expires_at = self._access_token, self._expires_at
+        if time.time() < expires_at - 30:
+            return token
+        return self.refresh(stale_token=token)
+
+    @metrics.timed("zoho_token_refresh")
+    def refresh(self, stale_token=None):
+        """
+        Refreshes the Zoho CRM access token using the refresh token.
+        If stale_token is given and another thread already replaced it, that
+        newer token is returned without calling Zoho again; so is a newer token
+        that another worker stored in cache_path.
+        """
+        with self._refresh_lock, self._file_lock():
+            with self._lock:
+                if stale_token is not None and self._access_token != stale_token:
+                    self._counters["shared_refreshes"] += 1
+                    return self._access_token
+                expires_at = self._expires_at
+            if self._load(newer_than=expires_at):
+                with self._lock:
+                    self._counters["shared_refreshes"] += 1
+                    return self._access_token
+            payload = {
+                'refresh_token': self.refresh_token,
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'grant_type': 'refresh_token'
+            }
+            response = zoho_http.post(self.TOKEN_URL, params=payload, timeout=15)
+            if response.status_code != 200 or 'access_token' not in response.json():
+                with self._lock:
+                    self._counters["refresh_failures"] += 1
+                logger.error(f"Failed to refresh access token: {response.text}")
+                raise Exception("Failed to refresh access token")
+            response_data = response.json()
+            with self._lock:
+                self._access_token = response_data['access_token']
+                self._expires_at = time.time() + float(response_data.get('expires_in', 3600))
+                self._counters["refreshes"] += 1
+                token = self._access_token
+            self._save()
+            logger.info("Access token refreshed.")
+            return token
+
+    def ensure_started(self):
+        """
+        Starts the proactive refresh thread for this process (again after a fork).
+        """
+        if not self.refresh_token:
+            return
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+                return
+            self._worker = threading.Thread(target=self._run, name="zoho-token-refresh", daemon=True)
+            self._worker_pid = os.getpid()
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                wait = self._expires_at - self.refresh_ahead - time.time()
+            if wait > 0:
+                time.sleep(min(wait, 60))
+                continue
+            try:
+                with self._lock:
+                    token = self._access_token
+                self.refresh(stale_token=token)
+            except Exception as e:
+                logger.error(f"Proactive Zoho token refresh failed: {e}")
+                time.sleep(30)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["expires_in"] = max(0, int(self._expires_at - time.time()))
+        return stats
+
+
+zoho_tokens = ZohoTokenManager(
+    access_token,
+    refresh_token,
+    client_id,
+    client_secret,
+    cache_path=os.getenv("ZOHO_TOKEN_CACHE", ".zoho_token.json"),
+    refresh_ahead=float(os.getenv("ZOHO_TOKEN_REFRESH_AHEAD", 300)),
+)
+
+
+# ----------------------------------------------------------------------
+# Summary field extraction
+# ----------------------------------------------------------------------
+# Field key -> labels the assistant uses for it in a summary (compared case-insensitively).
+# Only specific labels: generic words like "Start" or "Anzahl" also begin ordinary lines.
+SUMMARY_FIELD_LABELS = {
+    'salutation': ['Anrede'],
+    'first_name': ['Vorname'],
+    'last_name': ['Nachname', 'Familienname'],
+    'email': ['Email', 'E-Mail', 'E-Mail-Adresse', 'Email-Adresse', 'Emailadresse'],
+    'phone': ['Telefon', 'Telefonnummer', 'Tel', 'Tel.', 'Handy', 'Mobil', 'Mobilnummer', 'Rufnummer'],
+    'zip_code': ['Postleitzahl', 'PLZ'],
+    'quantity': ['Menge', 'Mengenangabe'],
+    'description': ['Beschreibung', 'Projektbeschreibung', 'Anliegen'],
+    'subject': ['Betreff'],
+    'geplanter_start': ['Geplanter Start', 'Geplanter Beginn', 'Startdatum', 'Projektstart'],
+    'leistung': ['Leistung', 'Leistungen', 'Gewünschte Leistung', 'Dienstleistung'],
+}
+
+SUMMARY_REQUIRED_FIELDS = [
+    'first_name', 'last_name', 'email', 'phone',
+    'zip_code', 'quantity', 'description', 'geplanter_start'
+]
+
+_SUMMARY_LABEL_TO_KEY = {
+    label.lower(): key
+    for key, labels in SUMMARY_FIELD_LABELS.items()
+    for label in labels
+}
+
+# Bullets, list numbers, markdown and blanks around a label ("- **1. Vorname**:")
+_SUMMARY_LABEL_TRIM = " \t>#*_-•–+0123456789.)"
+
+_SUMMARY_JSON_RE = re.compile(r'```(?:json)?\s*(\{.*?\})\s*```|^\s*(\{.*\})\s*$', re.DOTALL)
+
+# Optional: when the text pass misses required fields, ask this model for the
+# fields as JSON (structured output). Empty = disabled.
+SUMMARY_EXTRACTION_MODEL = os.getenv("SUMMARY_EXTRACTION_MODEL", "")
+
+SUMMARY_JSON_SCHEMA = {
+    "name": "summary_details",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {key: {"type": ["string", "null"]} for key in SUMMARY_FIELD_LABELS},
+        "required": list(SUMMARY_FIELD_LABELS),
+        "additionalProperties": False,
+    },
+}
+
+
+def _summary_field_key(label):
+    label = label.strip(_SUMMARY_LABEL_TRIM).lower()
+    return _SUMMARY_LABEL_TO_KEY.get(label) or _SUMMARY_LABEL_TO_KEY.get(" ".join(label.split()))
+
+
+def _details_from_json(summary):
     """
-    Ensures the Zoho CRM access token is still valid; if not, refresh it.
+    Decodes a summary that carries its fields as a JSON object (bare or in a
+    ```json block). Keys may be field keys or any of their labels.
     """
-    global token_last_refresh_time, token_expires_in
-    current_time = time.time()
-    if current_time - token_last_refresh_time >= token_expires_in:
-        refresh_access_token()
+    match = _SUMMARY_JSON_RE.search(summary) if "{" in summary else None
+    if not match:
+        return None
+    try:
+        data = json.loads(match.group(1) or match.group(2))
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    details = {}
+    for name, value in data.items():
+        key = name if name in SUMMARY_FIELD_LABELS else _summary_field_key(str(name))
+        if key and value not in (None, ""):
+            details[key] = str(value).strip()
+    return details
+
+
+def _details_from_text(summary):
+    """
+    Single pass over the summary's lines with str methods and the label table;
+    a regex over the whole summary is tried at every offset and measured slower.
+    The first line for a field wins, so text after the field list cannot
+    overwrite a value.
+    """
+    details = {}
+    for line in summary.splitlines():
+        label, colon, value = line.partition(":")
+        if not colon:
+            if "：" not in line:
+                continue
+            label, colon, value = line.partition("：")
+        label = label.strip(_SUMMARY_LABEL_TRIM).lower()
+        key = _SUMMARY_LABEL_TO_KEY.get(label) or _SUMMARY_LABEL_TO_KEY.get(" ".join(label.split()))
+        if key and key not in details:
+            value = value.strip(" \t*_")
+            if value:
+                details[key] = value
+    return details
+
+
+def _details_from_model(summary):
+    """
+    Structured-output extraction through SUMMARY_EXTRACTION_MODEL; the answer is
+    JSON matching SUMMARY_JSON_SCHEMA, so parsing is a plain decode.
+    """
+    completion = client.chat.completions.create(
+        model=SUMMARY_EXTRACTION_MODEL,
+        messages=[
+            {"role": "system", "content": "Extrahiere die Kundendaten aus der Zusammenfassung. Fehlende Felder sind null."},
+            {"role": "user", "content": summary},
+        ],
+        response_format={"type": "json_schema", "json_schema": SUMMARY_JSON_SCHEMA},
+    )
+    data = json.loads(completion.choices[0].message.content)
+    return {key: str(value).strip() for key, value in data.items() if value not in (None, "")}
 
 
 def extract_details_from_summary(summary):
@@ -112,65 +1886,34 @@ def extract_details_from_summary(summary):
     Returns a dictionary of details if successful, else None.
     """
     try:
-        logger.info(f"Extracting details from summary:\n{summary}")
-        details = {}
-        field_mapping = {
-            'Anrede': 'salutation',
-            'Vorname': 'first_name',
-            'Nachname': 'last_name',
-            'Email': 'email',
-            'Telefon': 'phone',
-            'Postleitzahl': 'zip_code',
-            'Menge': 'quantity',
-            'Beschreibung': 'description',
-            'Betreff': 'subject',
-            'Geplanter Start': 'geplanter_start',
-            'Leistung': 'leistung'
-        }
-
-        lines = summary.splitlines()
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-            if ':' in line:
-                field_name_part, value = line.split(':', 1)
-                field_name = field_name_part.strip().strip('-').strip().strip('**').strip()
-                value = value.strip()
-                key = field_mapping.get(field_name)
-                if key:
-                    details[key] = value
-                    logger.info(f"Extracted {key}: {value}")
-                else:
-                    logger.warning(f"Ignored unrecognized field: {field_name}")
-            else:
-                logger.warning(f"Ignored line without colon: {line}")
-
-        required_fields = [
-            'first_name', 'last_name', 'email', 'phone',
-            'zip_code', 'quantity', 'description', 'geplanter_start'
-        ]
-        if all(field in details for field in required_fields):
-            logger.info(f"Parsed Details: {details}")
+        details = _details_from_json(summary) or _details_from_text(summary)
+        missing_fields = [field for field in SUMMARY_REQUIRED_FIELDS if field not in details]
+        if missing_fields and SUMMARY_EXTRACTION_MODEL:
+            logger.info(f"Missing fields {missing_fields}, asking {SUMMARY_EXTRACTION_MODEL} for structured details.")
+            details = {**_details_from_model(summary), **details}
+            missing_fields = [field for field in SUMMARY_REQUIRED_FIELDS if field not in details]
+        if not missing_fields:
+            # Lazy: the details are only formatted when debug logging is on
+            logger.debug("Parsed Details: %s", details)
             return details
-        else:
-            missing_fields = [field for field in required_fields if field not in details]
-            logger.error(f"Missing fields: {missing_fields}")
-            return None
+        logger.error(f"Missing fields: {missing_fields}")
+        return None
     except Exception as e:
         logger.error(f"Error extracting details from summary: {e}")
         return None
 
 
+@metrics.timed("zoho_send")
 def send_to_zoho(user_details):
     """
     Sends the extracted user details to Zoho CRM as a new Deal.
+    Returns True if Zoho accepted it.
     """
     try:
-        ensure_valid_access_token()
+        token = zoho_tokens.get_token()
         zoho_url = "https://www.zohoapis.eu/crm/v3/Deals"
         headers = {
-            'Authorization': f'Zoho-oauthtoken {access_token}',
+            'Authorization': f'Zoho-oauthtoken {token}',
             'Content-Type': 'application/json',
         }
 
@@ -228,213 +1971,1058 @@ def send_to_zoho(user_details):
         }
 
         logger.info(f"Data being sent to Zoho CRM: {data}")
-        response = requests.post(zoho_url, json=data, headers=headers)
+        response = zoho_http.post(zoho_url, json=data, headers=headers, timeout=30)
         logger.info(f"Zoho CRM Response Status Code: {response.status_code}")
         logger.info(f"Zoho CRM Response Text: {response.text}")
 
         # If unauthorized, try refreshing token and re-sending
         if response.status_code == 401:
             logger.warning("Unauthorized. Refreshing access token and retrying...")
-            refresh_access_token()
-            headers['Authorization'] = f'Zoho-oauthtoken {access_token}'
-            response = requests.post(zoho_url, json=data, headers=headers)
+            token = zoho_tokens.refresh(stale_token=token)
+            headers['Authorization'] = f'Zoho-oauthtoken {token}'
+            response = zoho_http.post(zoho_url, json=data, headers=headers, timeout=30)
             logger.info(f"Retry Zoho CRM Response Status Code: {response.status_code}")
             logger.info(f"Retry Zoho CRM Response Text: {response.text}")
 
         if response.status_code in [200, 201]:
             logger.info("Data successfully sent to Zoho CRM.")
             logger.info(f"Response: {response.json()}")
+            return True
         else:
             logger.error(f"Failed to send data to Zoho CRM. Status: {response.status_code}")
             logger.error(f"Response: {response.text}")
+            return False
 
     except Exception as e:
         logger.error(f"Error while sending to Zoho: {e}")
+        return False
 
 
-def get_db_connection():
+# ----------------------------------------------------------------------
+#  MySQL connection pool
+# ----------------------------------------------------------------------
+class PooledConnection:
     """
-    Connects to the database using credentials from environment variables.
+    Thin wrapper around a pymysql connection handed out by ConnectionPool.
+    Behaves like the raw connection, except that close() gives it back
+    to the pool instead of tearing down the TCP connection.
     """
-    try:
-        connection = pymysql.connect(
-            host=os.getenv('DB_HOST'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASS'),
-            database=os.getenv('DB_NAME'),
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor
-        )
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool.release(self._raw)
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of pymysql connections.
+    - At most `size` connections exist at any time; callers wait up to
+      `timeout` seconds for a free one.
+    - Idle connections older than `max_idle` seconds are closed and replaced.
+    - Connections idle longer than `ping_interval` seconds are pinged
+      (with reconnect) before they are handed out.
+    - Returned connections with a transaction still open are rolled back, so a
+      failed or uncommitted transaction never leaks to the next borrower;
+      committed work costs no extra round-trip.
+    """
+
+    def __init__(self, size=5, max_idle=300, timeout=5, ping_interval=30, **connect_kwargs):
+        self.size = size
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self._connect_kwargs = connect_kwargs
+        self._idle = []  # list of (connection, last_used), newest last
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._counters = {
+            "created": 0,
+            "reused": 0,
+            "pinged": 0,
+            "discarded": 0,
+            "timeouts": 0,
+            "errors": 0,
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _connect(self):
+        connection = pymysql.connect(**self._connect_kwargs)
+        self._count("created")
         logger.info("Database connection established.")
         return connection
-    except Exception as e:
-        logger.error(f"Error connecting to the database: {e}")
-        return None
 
+    def _discard(self, connection):
+        self._count("discarded")
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    @metrics.timed("db_pool_acquire")
+    def acquire(self):
+        """
+        Returns a PooledConnection, or None if no connection could be obtained.
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            self._count("timeouts")
+            logger.error("Database pool exhausted: no free connection within %ss.", self.timeout)
+            return None
 
-def log_chat(thread_id, user_message, assistant_response, ip_address=None, region=None, city=None):
+        try:
+            connection = None
+            while connection is None:
+                with self._lock:
+                    entry = self._idle.pop() if self._idle else None
+                if entry is None:
+                    connection = self._connect()
+                    break
+                candidate, last_used = entry
+                idle_for = time.time() - last_used
+                if idle_for > self.max_idle:
+                    self._discard(candidate)
+                    continue
+                if idle_for > self.ping_interval:
+                    try:
+                        candidate.ping(reconnect=True)
+                        self._count("pinged")
+                    except Exception as e:
+                        logger.warning(f"Discarding dead pooled DB connection: {e}")
+                        self._discard(candidate)
+                        continue
+                self._count("reused")
+                connection = candidate
+        except Exception as e:
+            self._slots.release()
+            self._count("errors")
+            logger.error(f"Error connecting to the database: {e}")
+            return None
+
+        with self._lock:
+            self._in_use += 1
+        return PooledConnection(self, connection)
+
+    def release(self, connection):
+        with self._lock:
+            self._in_use -= 1
+        try:
+            if not connection.open:
+                self._discard(connection)
+                return
+            try:
+                # server_status comes with every reply, so this check is free
+                if connection.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+                    connection.rollback()
+            except Exception as e:
+                logger.warning(f"Discarding pooled DB connection that failed to roll back: {e}")
+                self._discard(connection)
+                return
+            with self._lock:
+                self._idle.append((connection, time.time()))
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({
+                "size": self.size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+            })
+        return stats
+
+
+db_pool = ConnectionPool(
+    size=int(os.getenv("DB_POOL_SIZE", 5)),
+    max_idle=float(os.getenv("DB_POOL_MAX_IDLE", 300)),
+    timeout=float(os.getenv("DB_POOL_TIMEOUT", 5)),
+    ping_interval=float(os.getenv("DB_POOL_PING_INTERVAL", 30)),
+    host=os.getenv('DB_HOST'),
+    user=os.getenv('DB_USER'),
+    password=os.getenv('DB_PASS'),
+    database=os.getenv('DB_NAME'),
+    charset='utf8mb4',
+    cursorclass=pymysql.cursors.DictCursor
+)
+
+
+def get_db_connection():
     """
-    Logs the conversation (user_message and assistant_response) into the database, if connected.
+    Borrows a connection from the shared MySQL pool (credentials from environment variables).
+    Callers still call connection.close() when done, which returns it to the pool.
     """
-    connection = get_db_connection()
-    if connection is None:
-        logger.error("Failed to log chat: No database connection.")
-        return
-    try:
-        with connection.cursor() as cursor:
-            sql = """
-            INSERT INTO chatlog (thread_id, user_message, assistant_response, ip_address, region, city) 
-            VALUES (%s, %s, %s, %s, %s, %s)
-            """
-            cursor.execute(sql, (thread_id, user_message, assistant_response, ip_address, region, city))
-            connection.commit()
-            logger.info("Chat data logged to database with IP and location.")
-    except Exception as e:
-        logger.error(f"Error inserting into the database: {e}")
-    finally:
-        connection.close()
+    return db_pool.acquire()
 
 
-def log_chat_ersatz(thread_id, user_message, assistant_response, ip_address, region, city):
+# ----------------------------------------------------------------------
+#  Write-behind chat log writer
+# ----------------------------------------------------------------------
+CHAT_LOG_TABLES = ("chatlog",) + tuple(site["log_table"] for site in LAW_SITES)
+
+
+@metrics.timed("db_chat_log_insert")
+def insert_chat_rows(table, rows):
     """
-    Logs the conversation for /ersatzbaustoffverordnung into the ersatzbaustoffverordnung_log table.
-    Now stores the user's IP, region, and city (instead of empty strings).
+    Inserts a batch of (thread_id, user_message, assistant_response, ip_address, region, city)
+    rows into one of the CHAT_LOG_TABLES with a single multi-row INSERT.
+    Returns True on success.
     """
+    if table not in CHAT_LOG_TABLES:
+        logger.error(f"Refusing to log into unknown table: {table}")
+        return False
     connection = get_db_connection()
     if connection is None:
-        logger.error("Failed to log ersatz chat: No database connection.")
-        return
-    
+        logger.error(f"Failed to log {len(rows)} chat row(s) into {table}: No database connection.")
+        return False
     try:
         with connection.cursor() as cursor:
-            sql = """
-                INSERT INTO ersatzbaustoffverordnung_log 
+            sql = f"""
+                INSERT INTO {table}
                 (thread_id, user_message, assistant_response, ip_address, region, city)
                 VALUES (%s, %s, %s, %s, %s, %s)
             """
-            cursor.execute(sql, (thread_id, user_message, assistant_response, ip_address, region, city))
+            cursor.executemany(sql, rows)
             connection.commit()
-            logger.info("Chat data logged to ersatzbaustoffverordnung_log with location fields.")
+            logger.info(f"Logged {len(rows)} chat row(s) to {table}.")
+            return True
     except Exception as e:
-        logger.error(f"Error inserting into ersatzbaustoffverordnung_log: {e}")
+        logger.error(f"Error inserting into {table}: {e}")
+        return False
     finally:
         connection.close()
 
 
-def log_chat_kreislauf(thread_id, user_message, assistant_response):
+class ChatLogWriter:
     """
-    Logs chats for /kreislaufwirtschaftsgesetz into kreislaufwirtschaftsgesetz_logs.
+    Takes chat log inserts off the request path.
+    Endpoints enqueue rows; a background thread groups them per table and
+    writes them with executemany once `batch_size` rows are pending or
+    `flush_interval` seconds have passed. The queue is bounded; when it is
+    full the `policy` decides what happens:
+      - "sync":  write the row directly on the calling thread (nothing is lost)
+      - "block": wait up to `enqueue_timeout` seconds for space, then drop
+      - "drop":  drop the row immediately
+    stop() (registered with atexit) drains everything that is still queued.
     """
-    connection = get_db_connection()
-    if connection is None:
-        logger.error("Failed to log kreislauf chat: No database connection.")
-        return
-    
-    try:
-        with connection.cursor() as cursor:
-            sql = """
-                INSERT INTO kreislaufwirtschaftsgesetz_logs
-                (thread_id, user_message, assistant_response, ip_address, region, city)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """
-            cursor.execute(sql, (thread_id, user_message, assistant_response, '', '', ''))
-            connection.commit()
-            logger.info("Chat data logged to kreislaufwirtschaftsgesetz_logs.")
-    except Exception as e:
-        logger.error(f"Error inserting into kreislaufwirtschaftsgesetz_logs: {e}")
-    finally:
-        connection.close()
 
+    _STOP = object()
+
+    def __init__(self, max_queue=10000, batch_size=50, flush_interval=1.0,
+                 policy="sync", enqueue_timeout=0.5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.enqueue_timeout = enqueue_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+        self._counters = {
+            "enqueued": 0,
+            "written": 0,
+            "batches": 0,
+            "failed": 0,
+            "dropped": 0,
+            "written_sync": 0,
+        }
 
-def log_chat_bundesbodenschutz(thread_id, user_message, assistant_response):
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _ensure_started(self):
+        # Started lazily (and re-started after a fork) so every worker process gets its own thread.
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+                return
+            self._worker = threading.Thread(target=self._run, name="chat-log-writer", daemon=True)
+            self._worker_pid = os.getpid()
+            self._worker.start()
+
+    def enqueue(self, table, row):
+        """
+        Queues one chat row for `table`. Returns True if the row was queued or written.
+        """
+        self._ensure_started()
+        try:
+            if self.policy == "block":
+                self._queue.put((table, row), timeout=self.enqueue_timeout)
+            else:
+                self._queue.put_nowait((table, row))
+            self._count("enqueued")
+            return True
+        except queue.Full:
+            pass
+
+        if self.policy == "sync":
+            logger.warning(f"Chat log queue full, writing to {table} synchronously.")
+            if insert_chat_rows(table, [row]):
+                self._count("written_sync")
+                return True
+            self._count("failed")
+            return False
+
+        logger.error(f"Chat log queue full, dropping row for {table}.")
+        self._count("dropped")
+        return False
+
+    def _write(self, pending):
+        for table, rows in pending.items():
+            if not rows:
+                continue
+            if insert_chat_rows(table, rows):
+                self._count("written", len(rows))
+                self._count("batches")
+            else:
+                self._count("failed", len(rows))
+        pending.clear()
+
+    def _run(self):
+        pending = {}
+        pending_count = 0
+        last_flush = time.time()
+        while True:
+            timeout = max(0.0, self.flush_interval - (time.time() - last_flush))
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            stop = item is self._STOP
+            if item is not None and not stop:
+                table, row = item
+                pending.setdefault(table, []).append(row)
+                pending_count += 1
+
+            if stop or pending_count >= self.batch_size or time.time() - last_flush >= self.flush_interval:
+                if pending_count:
+                    self._write(pending)
+                pending_count = 0
+                last_flush = time.time()
+
+            if item is not None:
+                self._queue.task_done()
+            if stop:
+                return
+
+    def stop(self, timeout=10):
+        """
+        Flushes everything still queued and stops the background thread.
+        """
+        worker = self._worker
+        if worker is None or not worker.is_alive() or self._worker_pid != os.getpid():
+            return
+        self._queue.put(self._STOP)
+        worker.join(timeout)
+        if worker.is_alive():
+            logger.error("Chat log writer did not finish flushing before shutdown.")
+        else:
+            logger.info("Chat log writer flushed and stopped.")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats["queued"] = self._queue.qsize()
+        return stats
+
+
+chat_log_writer = ChatLogWriter(
+    max_queue=int(os.getenv("CHATLOG_QUEUE_SIZE", 10000)),
+    batch_size=int(os.getenv("CHATLOG_BATCH_SIZE", 50)),
+    flush_interval=float(os.getenv("CHATLOG_FLUSH_INTERVAL", 1.0)),
+    policy=os.getenv("CHATLOG_QUEUE_POLICY", "sync"),
+    enqueue_timeout=float(os.getenv("CHATLOG_ENQUEUE_TIMEOUT", 0.5)),
+)
+atexit.register(chat_log_writer.stop)
+
+
+def log_chat(thread_id, user_message, assistant_response, ip_address=None, region=None, city=None):
     """
-    Logs chats for /bundesbodenschutzverordnung into bundesbodenschutzverordnung_logs.
+    Queues the conversation (user_message and assistant_response) for the chatlog table.
     """
-    connection = get_db_connection()
-    if connection is None:
-        logger.error("Failed to log bundesboden chat: No database connection.")
-        return
-    
-    try:
+    chat_log_writer.enqueue("chatlog", (thread_id, user_message, assistant_response, ip_address, region, city))
+
+
+def log_site_chat(site, thread_id, user_message, assistant_response, ip_address="", region="", city=""):
+    """
+    Queues a law-site conversation into the site's log table.
+    IP, region and city are only kept for sites with store_location.
+    """
+    if not site["store_location"]:
+        ip_address, region, city = '', '', ''
+    chat_log_writer.enqueue(site["log_table"], (thread_id, user_message, assistant_response, ip_address, region, city))
+
+
+# ----------------------------------------------------------------------
+#  Zoho CRM outbox (durable queue for confirmed requests)
+# ----------------------------------------------------------------------
+class ZohoOutbox:
+    """
+    Durable, MySQL-backed queue of deals waiting to be sent to Zoho CRM.
+    - enqueue() stores the deal and returns immediately. Deals are keyed by a
+      hash of the conversation and the deal's content (dedupe_key()), so a
+      repeated confirmation of the same deal is ignored while a second,
+      different deal of the same conversation is queued as well.
+    - A background worker claims due rows, calls send_to_zoho() and retries
+      failures with exponential backoff (plus jitter).
+    - After `max_attempts` failures a row is marked 'dead' and shows up in
+      dead_letters() (GET /zoho_queue) instead of being dropped.
+    Rows being sent are leased for `lease` seconds, so several workers or
+    instances can share the table and a crashed sender's rows are retried.
+    No database connection is held while talking to Zoho.
+    """
+
+    # Fields that change with every turn without making it a different deal
+    VOLATILE_FIELDS = ("gespraechsverlauf",)
+
+    CREATE_TABLE = """
+        CREATE TABLE IF NOT EXISTS zoho_outbox (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            dedupe_key VARCHAR(191) NOT NULL UNIQUE,
+            payload MEDIUMTEXT NOT NULL,
+            status VARCHAR(16) NOT NULL DEFAULT 'pending',
+            attempts INT NOT NULL DEFAULT 0,
+            next_attempt_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            last_error TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_zoho_outbox_due (status, next_attempt_at)
+        )
+    """
+
+    def __init__(self, poll_interval=5, max_attempts=8, base_delay=30, max_delay=3600, lease=120, batch_size=10):
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease = lease
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._worker = None
+        self._worker_pid = None
+        self._table_ready = False
+        self._counters = {"enqueued": 0, "duplicates": 0, "sent": 0, "retried": 0, "dead": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _ensure_table(self, connection):
+        if self._table_ready:
+            return
         with connection.cursor() as cursor:
-            sql = """
-                INSERT INTO bundesbodenschutzverordnung_logs
-                (thread_id, user_message, assistant_response, ip_address, region, city)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """
-            cursor.execute(sql, (thread_id, user_message, assistant_response, '', '', ''))
+            cursor.execute(self.CREATE_TABLE)
+        connection.commit()
+        self._table_ready = True
+
+    def ensure_started(self):
+        """
+        Starts the delivery thread for this process (again after a fork).
+        """
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+                return
+            self._worker = threading.Thread(target=self._run, name="zoho-outbox", daemon=True)
+            self._worker_pid = os.getpid()
+            self._worker.start()
+
+    @classmethod
+    def dedupe_key(cls, scope, user_details):
+        """
+        sha256 over the conversation (scope) and the deal's content.
+        """
+        deal = {name: value for name, value in user_details.items() if name not in cls.VOLATILE_FIELDS}
+        content = json.dumps([scope, deal], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    @metrics.timed("zoho_outbox_enqueue")
+    def enqueue(self, scope, user_details):
+        """
+        Queues a deal for Zoho; `scope` identifies the conversation (its thread id).
+        Returns True if it is queued (or was already).
+        If the database is unavailable the deal is sent from a background thread instead.
+        """
+        self.ensure_started()
+        dedupe_key = self.dedupe_key(scope, user_details)
+        connection = get_db_connection()
+        if connection is None:
+            logger.error("Zoho outbox unavailable (no DB connection), sending directly in the background.")
+            threading.Thread(target=send_to_zoho, args=(user_details,), daemon=True).start()
+            return True
+        try:
+            self._ensure_table(connection)
+            with connection.cursor() as cursor:
+                inserted = cursor.execute(
+                    "INSERT IGNORE INTO zoho_outbox (dedupe_key, payload) VALUES (%s, %s)",
+                    (dedupe_key, json.dumps(user_details, ensure_ascii=False))
+                )
             connection.commit()
-            logger.info("Chat data logged to bundesbodenschutzverordnung_logs.")
-    except Exception as e:
-        logger.error(f"Error inserting into bundesbodenschutzverordnung_logs: {e}")
-    finally:
-        connection.close()
+            if inserted:
+                self._count("enqueued")
+                logger.info(f"Zoho deal {dedupe_key[:12]} queued.")
+                self._wakeup.set()
+            else:
+                self._count("duplicates")
+                logger.info(f"Zoho deal {dedupe_key[:12]} already queued, ignoring duplicate.")
+            return True
+        except Exception as e:
+            logger.error(f"Error queueing Zoho deal, sending directly in the background: {e}")
+            threading.Thread(target=send_to_zoho, args=(user_details,), daemon=True).start()
+            return True
+        finally:
+            connection.close()
+
+    def _claim(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT id, payload, attempts FROM zoho_outbox
+                WHERE status IN ('pending', 'sending') AND next_attempt_at <= NOW()
+                ORDER BY next_attempt_at LIMIT %s
+                """,
+                (self.batch_size,)
+            )
+            rows = cursor.fetchall()
+            claimed = []
+            for row in rows:
+                # Lease the row; rowcount 0 means another worker got it first
+                if cursor.execute(
+                    """
+                    UPDATE zoho_outbox
+                    SET status = 'sending', next_attempt_at = NOW() + INTERVAL %s SECOND
+                    WHERE id = %s AND attempts = %s AND status IN ('pending', 'sending')
+                      AND next_attempt_at <= NOW()
+                    """,
+                    (self.lease, row["id"], row["attempts"])
+                ):
+                    claimed.append(row)
+        connection.commit()
+        return claimed
+
+    def _finish(self, row, ok, error=None):
+        attempts = row["attempts"] + 1
+        connection = get_db_connection()
+        if connection is None:
+            # The lease runs out and the deal is picked up again
+            logger.error(f"Zoho deal {row['id']}: no DB connection to record the attempt.")
+            return
+        try:
+            self._record_attempt(connection, row, attempts, ok, error)
+        finally:
+            connection.close()
+
+    def _record_attempt(self, connection, row, attempts, ok, error):
+        with connection.cursor() as cursor:
+            if ok:
+                cursor.execute(
+                    "UPDATE zoho_outbox SET status = 'sent', attempts = %s, last_error = NULL WHERE id = %s",
+                    (attempts, row["id"])
+                )
+                self._count("sent")
+            elif attempts >= self.max_attempts:
+                cursor.execute(
+                    "UPDATE zoho_outbox SET status = 'dead', attempts = %s, last_error = %s WHERE id = %s",
+                    (attempts, error, row["id"])
+                )
+                self._count("dead")
+                logger.error(f"Zoho deal {row['id']} moved to dead letters after {attempts} attempts.")
+            else:
+                delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+                delay = delay * random.uniform(0.8, 1.2)
+                cursor.execute(
+                    """
+                    UPDATE zoho_outbox
+                    SET status = 'pending', attempts = %s, last_error = %s,
+                        next_attempt_at = NOW() + INTERVAL %s SECOND
+                    WHERE id = %s
+                    """,
+                    (attempts, error, int(delay), row["id"])
+                )
+                self._count("retried")
+                logger.warning(f"Zoho deal {row['id']} failed (attempt {attempts}), retrying in {int(delay)}s.")
+        connection.commit()
+
+    def process_due(self):
+        """
+        Sends every due deal once. Returns the number of deals processed.
+        """
+        connection = get_db_connection()
+        if connection is None:
+            return 0
+        try:
+            self._ensure_table(connection)
+            rows = self._claim(connection)
+        finally:
+            # Released before the HTTP calls, each of which may take up to the Zoho timeout
+            connection.close()
+        for row in rows:
+            try:
+                ok = send_to_zoho(json.loads(row["payload"]))
+                error = None if ok else "Zoho CRM rejected the deal"
+            except Exception as e:
+                ok, error = False, str(e)
+            self._finish(row, ok, error)
+        return len(rows)
+
+    def _run(self):
+        while True:
+            try:
+                processed = self.process_due()
+            except Exception as e:
+                logger.error(f"Error in Zoho outbox worker: {e}")
+                processed = 0
+            if processed < self.batch_size:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def counts(self):
+        """
+        Number of deals per status (None without a database connection).
+        """
+        connection = get_db_connection()
+        if connection is None:
+            return None
+        try:
+            self._ensure_table(connection)
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT status, COUNT(*) AS count FROM zoho_outbox GROUP BY status")
+                return {row["status"]: row["count"] for row in cursor.fetchall()}
+        finally:
+            connection.close()
+
+    def dead_letters(self, limit=100):
+        """
+        Status counts plus the most recent dead deals (without the personal data in the payload).
+        """
+        connection = get_db_connection()
+        if connection is None:
+            return None
+        try:
+            self._ensure_table(connection)
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT status, COUNT(*) AS count FROM zoho_outbox GROUP BY status")
+                counts = {row["status"]: row["count"] for row in cursor.fetchall()}
+                cursor.execute(
+                    """
+                    SELECT id, attempts, last_error, created_at, updated_at
+                    FROM zoho_outbox WHERE status = 'dead' ORDER BY updated_at DESC LIMIT %s
+                    """,
+                    (limit,)
+                )
+                dead = cursor.fetchall()
+            return {"counts": counts, "dead": dead}
+        finally:
+            connection.close()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+zoho_outbox = ZohoOutbox(
+    poll_interval=float(os.getenv("ZOHO_QUEUE_POLL_INTERVAL", 5)),
+    max_attempts=int(os.getenv("ZOHO_QUEUE_MAX_ATTEMPTS", 8)),
+    base_delay=float(os.getenv("ZOHO_QUEUE_BASE_DELAY", 30)),
+    max_delay=float(os.getenv("ZOHO_QUEUE_MAX_DELAY", 3600)),
+)
+
+
+# ----------------------------------------------------------------------
+#  Route handlers shared by the Flask app and the ASGI app (asgi.py)
+# ----------------------------------------------------------------------
+class RouteRequest:
+    """
+    The parts of an HTTP request the route handlers use. Filled in by the
+    front end (flask_view() below, quart_view() in asgi.py).
+    """
+    __slots__ = ("data", "session_cookie", "accept", "authorization")
+
+    def __init__(self, data=None, session_cookie=None, accept="", authorization=""):
+        self.data = data if data is not None else {}
+        self.session_cookie = session_cookie
+        self.accept = accept or ""
+        self.authorization = authorization or ""
+
+    @property
+    def stream(self):
+        """
+        True if the caller opted into streaming, either with {"stream": true}
+        in the body or an "Accept: text/event-stream" header.
+        """
+        return bool(self.data.get("stream")) or "text/event-stream" in self.accept
+
+
+class RouteReply:
+    """
+    A route handler's answer, turned into a response by the front end:
+    a JSON payload with its status, a plain text body (text) or an iterator
+    of SSE events (events). session_id, if given, is set as the session cookie.
+    """
+    __slots__ = ("payload", "status", "session_id", "text", "mimetype", "events")
+
+    def __init__(self, payload=None, status=200, session_id=None, text=None, mimetype="text/plain", events=None):
+        self.payload = payload
+        self.status = status
+        self.session_id = session_id
+        self.text = text
+        self.mimetype = mimetype
+        self.events = events
+
+
+SESSION_COOKIE = {"httponly": True, "samesite": "None", "secure": True}
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+ERROR_RESPONSE = "Entschuldigung, ein Fehler ist aufgetreten."
+
+# (rule, endpoint, handler, methods), registered on the Flask app at the end of this file
+ROUTES = []
+
+
+def register_route(rule, methods=("POST",), endpoint=None):
+    """
+    Registers handler(RouteRequest) -> RouteReply for the given URL rule.
+    """
+    def register(handler):
+        ROUTES.append((rule, endpoint or handler.__name__, handler, list(methods)))
+        return handler
+    return register
+
+
+# Stats and metrics routes need "Authorization: Bearer <ADMIN_TOKEN>"; without a token they are disabled
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+if not ADMIN_TOKEN:
+    logger.warning("ADMIN_TOKEN is not set, the stats and /metrics endpoints are disabled.")
+
+
+def admin_only(handler):
+    """
+    Lets only callers with the admin bearer token through to the handler.
+    """
+    @functools.wraps(handler)
+    def guarded(req):
+        scheme, _, token = req.authorization.partition(" ")
+        authorized = scheme.lower() == "bearer" and hmac.compare_digest(token.strip().encode(), ADMIN_TOKEN.encode())
+        if not ADMIN_TOKEN or not authorized:
+            return RouteReply({"message": "Nicht autorisiert."}, 401)
+        return handler(req)
+    return guarded
+
+
+# ----------------------------------------------------------------------
+#  Streaming responses (Server-Sent Events)
+# ----------------------------------------------------------------------
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+class ReleasingEvents:
+    """
+    Iterator over a stream's SSE events that calls release() exactly once:
+    when the events run out or when close() is called. Unlike a finally block
+    in the generator, this also holds for a stream that is closed before it
+    was ever started (the client went away before the first event).
+    """
+
+    def __init__(self, events, release):
+        self._events = events
+        self._release = release
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._events)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        try:
+            self._events.close()
+        finally:
+            release, self._release = self._release, None
+            if release is not None:
+                release()
+
+
+def stream_run_response(session_id, thread_id, assistant_id, finalize, route, additional_messages=None, release=None):
+    """
+    Runs the assistant through the OpenAI run stream and forwards every text
+    delta to the browser as an SSE "delta" event. Once the run is complete,
+    finalize(full_text) does the usual post-processing (summary, Zoho, logging)
+    and its result is sent as a "done" event carrying the same fields as the
+    JSON response ({"response", "thread_id"}).
+    A run past the route's deadline is cancelled (see RunExecutor.stream) and
+    ends the stream with an "error" event carrying TIMEOUT_RESPONSE.
+    release() (the session's run lock) is called once the stream is over or
+    closed, see ReleasingEvents.
+    """
+    def generate():
+        parts = []
+        try:
+            # Closing the deltas (client gone) cancels the run right away
+            with closing(run_executor.stream(route, thread_id, assistant_id, additional_messages)) as deltas:
+                for text in deltas:
+                    parts.append(text)
+                    yield sse_event("delta", {"delta": text})
+            response_message = "".join(parts)
+            logger.info(f"Streamed response from {route}: {response_message}")
+            response_message = finalize(response_message)
+            yield sse_event("done", {"response": response_message, "thread_id": thread_id})
+        except RunTimeoutError as e:
+            logger.error(f"Timeout while streaming {route}: {e}")
+            yield sse_event("error", {"response": TIMEOUT_RESPONSE})
+        except Exception as e:
+            logger.error(f"Error while streaming {route}: {e}")
+            yield sse_event("error", {"response": ERROR_RESPONSE})
+
+    events = generate()
+    if release is not None:
+        events = ReleasingEvents(events, release)
+    return RouteReply(session_id=session_id, events=events)
+
+
+def stream_text_response(session_id, thread_id, response_message, typing_delay=None):
+    """
+    SSE reply for an answer that is already known (e.g. from the answer cache).
+    With a typing_delay (canned answers) only the "done" event is sent, carrying
+    typing_delay like the JSON reply, so the front-end shows its typing indicator.
+    """
+    if typing_delay:
+        done = {"response": response_message, "thread_id": thread_id, "typing_delay": typing_delay}
+        return RouteReply(session_id=session_id, events=[sse_event("done", done)])
+    events = [
+        sse_event("delta", {"delta": response_message}),
+        sse_event("done", {"response": response_message, "thread_id": thread_id}),
+    ]
+    return RouteReply(session_id=session_id, events=events)
+
+
+# "Special" questions from the chat widget buttons, answered with a random canned response
+SPECIAL_RESPONSES = {
+    "ich benötige ein baugrundgutachten": [
+        "Hallo! Gerne helfe ich Ihnen dabei. Wissen Sie, wie viele Rammkernsondierungen Sie benötigen oder haben Sie genaue Vorgaben für das Baugrundgutachten, oder benötigen Sie Beratung?",
+        "Guten Tag! Benötigen Sie allgemeine Infos zum Baugrundgutachten oder möchten Sie direkt einen Preis?",
+        "Guten Tag! Möchten Sie einen Preis wissen oder haben Sie andere Fragen?"
+    ],
+    "ich benötige eine deklarationsanalyse": [
+        "Super! Zwei Fragen hierzu: 1. Wissen Sie, nach welcher Verordnung die Deklarationsanalyse durchgeführt werden soll? 2. Wie viele Laboranalysen benötigen Sie? Wenn nicht, können wir das zusammen klären.",
+        "Kein Problem! Wissen Sie, nach welcher Verordnung die Deklarationsanalyse durchgeführt werden soll und wie viele Laboranalysen Sie benötigen? Wenn nicht, können wir das zusammen klären.",
+        "Okay! Und wissen Sie schon was für eine Deklarationsanalyse Sie benötigen, also nach welcher Verordnung oder sollen wir das zusammen klären?"
+    ],
+    "ich möchte boden / bauschutt entsorgen": [
+        "Gerne! Haben Sie schon eine Deklarationsanalyse für das Material vorliegen?",
+        "Okay! Haben Sie bereits eine Deklarationsanalyse für das Material? Falls ja, können Sie hier auf der Webseite eine Anfrage stellen und die Deklarationsanalyse samt Probenahmeprotokoll direkt hochladen, damit wir Ihnen ein Preis nennen können.",
+        "Kein Problem! Haben Sie bereits eine Deklarationsanalyse für das Material vorliegen? Falls ja, können Sie diese hochladen oder die relevanten Informationen teilen. Falls keine Analyse vorliegt, könnte ich Ihnen die Kosten für eine Deklarationsanalyse berechnen. Wie möchten Sie fortfahren?"
+    ],
+    "ich benötige boden / recyclingmaterial": [
+        "Hallo! Wie viel Material benötigen Sie denn?",
+        "Okay! Brauchen Sie Boden oder Recyclingmaterial?",
+        "Gerne! Wie viel und was für Material benötigen Sie denn?"
+    ]
+}
+
+# The front-end shows a typing indicator this long before a special response,
+# so canned answers still feel typed without holding a server worker.
+SPECIAL_TYPING_DELAY_MS = int(os.getenv("SPECIAL_TYPING_DELAY_MS", 1000))
+
+# Words in an assistant answer that mark it as a summary of the request
+SUMMARY_KEYWORDS = ["zusammenfassung", "überblick", "summary", "zusammenfassen", "zusammen"]
+
+# Assistant answers that confirm the request => parse summary + send to Zoho
+CONFIRMATION_PHRASES = [
+    "prima! dann werde ich die anfrage so an meine kollegen weiterleiten.",
+    "prima! ich werde die anfrage so an meine kollegen weiterleiten.",
+    "ihre anfrage wird weitergeleitet.",
+    "prima! dann leite ich die anfrage an meine kollegen weiter.",
+    "super! ich werde die anfrage an meine kollegen weiterleiten."
+]
+
+
+class IntentMatcher:
+    """
+    Classifies user messages and assistant answers, built once at startup.
+    - match_special(message): the SPECIAL_RESPONSES key a user message asks
+      for, ignoring case, punctuation and spacing; with fuzzy_cutoff > 0, typos
+      in longer words match too (see _fuzzy_special).
+    - classify_response(text): {"summary", "confirmation"} subset for an
+      assistant answer, found in a single regex pass.
+    """
+
+    # Words shorter than this must match exactly in a fuzzy match, so "kein"
+    # cannot pass for "ein" and turn a negation into the request
+    FUZZY_MIN_WORD_LENGTH = 6
+
+    def __init__(self, special_responses, summary_keywords, confirmation_phrases, fuzzy_cutoff=0):
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self._special = {self.normalize(question): question for question in special_responses}
+        self._special_words = {normalized: normalized.split() for normalized in self._special}
+        # Longest alternatives first, so a confirmation phrase wins over a keyword inside it
+        alternatives = [("confirmation", phrase) for phrase in confirmation_phrases]
+        alternatives += [("summary", keyword) for keyword in summary_keywords]
+        alternatives.sort(key=lambda item: len(item[1]), reverse=True)
+        self._intent_of = {phrase.lower(): intent for intent, phrase in alternatives}
+        self._response_re = re.compile("|".join(re.escape(phrase.lower()) for _, phrase in alternatives))
+
+    @staticmethod
+    def normalize(text):
+        return " ".join(re.findall(r"\w+", text.lower()))
+
+    def match_special(self, message):
+        normalized = self.normalize(message)
+        question = self._special.get(normalized)
+        if question is None and self.fuzzy_cutoff > 0 and normalized:
+            question = self._fuzzy_special(normalized)
+            if question is not None:
+                logger.info(f"Fuzzy special match: '{message}' -> '{question}'")
+        return question
+
+    def _fuzzy_special(self, normalized):
+        """
+        Word by word: the same number of words, short words equal and long words
+        at least fuzzy_cutoff similar. A whole word can never be added or dropped
+        ("nicht"), which a ratio over the whole message would allow.
+        """
+        words = normalized.split()
+        for special, special_words in self._special_words.items():
+            if len(special_words) == len(words) and all(
+                word == special_word or (
+                    min(len(word), len(special_word)) >= self.FUZZY_MIN_WORD_LENGTH
+                    and difflib.SequenceMatcher(None, word, special_word).ratio() >= self.fuzzy_cutoff
+                )
+                for word, special_word in zip(words, special_words)
+            ):
+                return self._special[special]
+        return None
+
+    def classify_response(self, text):
+        return {self._intent_of[match] for match in self._response_re.findall(text.lower())}
+
 
+intent_matcher = IntentMatcher(
+    SPECIAL_RESPONSES,
+    SUMMARY_KEYWORDS,
+    CONFIRMATION_PHRASES,
+    fuzzy_cutoff=float(os.getenv("INTENT_FUZZY_CUTOFF", 0)),
+)
 
-def log_chat_lagapn98(thread_id, user_message, assistant_response):
+
+def record_turn(session_id, user_message, assistant_message):
     """
-    Logs chats for /lagapn98 into lagapn98_logs.
+    Appends one exchange to the session's local transcript, in the same
+    "USER: ..." / "BOT: ..." form that is sent to Zoho as gespraechsverlauf.
     """
-    connection = get_db_connection()
-    if connection is None:
-        logger.error("Failed to log lagapn98 chat: No database connection.")
-        return
-    
     try:
-        with connection.cursor() as cursor:
-            sql = """
-                INSERT INTO lagapn98_logs
-                (thread_id, user_message, assistant_response, ip_address, region, city)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """
-            cursor.execute(sql, (thread_id, user_message, assistant_response, '', '', ''))
-            connection.commit()
-            logger.info("Chat data logged to lagapn98_logs.")
+        session_store.append_transcript(session_id, [f"USER: {user_message}", f"BOT: {assistant_message}"])
     except Exception as e:
-        logger.error(f"Error inserting into lagapn98_logs: {e}")
-    finally:
-        connection.close()
+        logger.error(f"Could not record transcript for session {session_id}: {e}")
 
 
-def log_chat_deponie(thread_id, user_message, assistant_response):
+def conversation_transcript(session_id, thread_id):
     """
-    Logs chats for /deponieverordnung into deponieverordnung_logs.
+    Returns the whole conversation as text, lines separated by a blank line.
+    Built from the session's local transcript; only if that is missing
+    (e.g. a session that predates it) the full thread is fetched from OpenAI.
     """
-    connection = get_db_connection()
-    if connection is None:
-        logger.error("Failed to log deponie chat: No database connection.")
-        return
-    
-    try:
-        with connection.cursor() as cursor:
-            sql = """
-                INSERT INTO deponieverordnung_logs
-                (thread_id, user_message, assistant_response, ip_address, region, city)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """
-            cursor.execute(sql, (thread_id, user_message, assistant_response, '', '', ''))
-            connection.commit()
-            logger.info("Chat data logged to deponieverordnung_logs.")
-    except Exception as e:
-        logger.error(f"Error inserting into deponieverordnung_logs: {e}")
-    finally:
-        connection.close()
+    lines = session_store.get_transcript(session_id)
+    if lines:
+        return "\n\n".join(lines)
+
+    logger.info(f"No local transcript for session {session_id}, fetching thread {thread_id}.")
+    # Let's fetch the ENTIRE conversation from the thread
+    with metrics.stage("openai_messages_list"):
+        all_conversation_msgs = list(client.beta.threads.messages.list(thread_id=thread_id))
+    # Reverse it so the earliest message is first, newest last
+    all_conversation_msgs.reverse()
+
+    # We'll store each line as "USER: text" or "BOT: text"
+    conversation_history = []
+    for msg in all_conversation_msgs:
+        if msg.role == "user":
+            sender = "USER"
+        else:
+            sender = "BOT"
+
+        text = msg.content[0].text.value
+        conversation_history.append(f"{sender}: {text}")
+
+    # Join them with double newlines => blank line between
+    return "\n\n".join(conversation_history)
 
 
+def finalize_berater_response(session_id, thread_id, user_message, response_message,
+                              ip_address, region, city):
+    """
+    Post-processing for a finished /askberater answer: stores summaries,
+    hands confirmed requests to Zoho and logs the turn.
+    Returns the (possibly amended) message for the user.
+    """
+    record_turn(session_id, user_message, response_message)
+    intents = intent_matcher.classify_response(response_message)
+
+    # 3) Check if it's a summary => store
+    if "summary" in intents:
+        session_store.update(session_id, summary=response_message)
+        logger.info(f"Summary stored for session {session_id}.")
+
+    # If the assistant says one of these confirmations, we parse + send to Zoho
+    if "confirmation" in intents:
+        logger.info("Assistant provided the confirmation message.")
+        confirmed_summary = (session_store.get(session_id) or {}).get('summary')
+        if confirmed_summary:
+            user_details = extract_details_from_summary(confirmed_summary)
+            if user_details:
+                # Store the entire conversation in user_details
+                user_details["gespraechsverlauf"] = conversation_transcript(session_id, thread_id)
+
+                # Add IP, region, city
+                user_details["ip_address"] = ip_address
+                user_details["region"] = region
+                user_details["city"] = city
+
+                logger.info(f"Parsed User Details: {user_details}")
+                # Delivered to Zoho by the outbox worker (with retries)
+                zoho_outbox.enqueue(thread_id, user_details)
+                response_message += "\n\nIhre Daten wurden erfolgreich übermittelt."
+            else:
+                logger.error("Failed to parse user details from the summary.")
+                response_message = "Entschuldigung, es gab ein Problem beim Verarbeiten Ihrer Daten."
+        else:
+            logger.error("No summary found to confirm.")
+            response_message = "Entschuldigung, ich konnte Ihre Zusammenfassung nicht finden."
+    else:
+        logger.info("Assistant did not provide the confirmation message.")
+
+    log_chat(thread_id, user_message, response_message, ip_address, region, city)
+    return response_message
 
 
-@app.route("/askberater", methods=["POST"])
-def ask1():
+@register_route("/askberater")
+def ask1(req):
     """
     Main endpoint for handling user queries to the chatbot/assistant.
-    Checks if the query matches a "special question" that requires a delay
-    and a random response. Otherwise, it falls back to the normal OpenAI logic.
+    Checks if the query matches a "special question" that is answered locally
+    with a random response (the front-end adds the typing delay). Otherwise, it falls back to the normal OpenAI logic.
     Either way, we give the user the same threadId.
     """
     try:
         logger.info("Received request at /askberater")
 
-        data = request.json or {}
+        data = req.data
         user_message = data.get("message", "")
         thread_id_from_body = data.get("threadId")  # Fallback thread ID from front-end
         ip_address = data.get("ip_address", "")
@@ -446,197 +3034,99 @@ def ask1():
 
         # ----------------------------------------------------------------------
         # STEP A: Retrieve or create the OpenAI thread (and session) FIRST
-        session_id = request.cookies.get("session_id")
-
-        # If no session_id, check if front-end gave us a threadId
-        if not session_id and thread_id_from_body:
-            matching_session_id = None
-            for possible_session_id, session_info in session_data.items():
-                if session_info["thread"].id == thread_id_from_body:
-                    matching_session_id = possible_session_id
-                    break
-            if matching_session_id:
-                logger.info("Found matching session based on front-end threadId.")
-                session_id = matching_session_id
-
-        # If still no session_id, create a brand-new one
-        if not session_id:
-            session_id = str(uuid.uuid4())
-            session_data[session_id] = {
-                "thread": client.beta.threads.create(),
-                "user_details": {},
-                "summary": None
-            }
-            logger.info(f"New session created with ID: {session_id}")
-        elif session_id not in session_data:
-            # If we have a session_id but it's not in session_data, create it
-            session_data[session_id] = {
-                "thread": client.beta.threads.create(),
-                "user_details": {},
-                "summary": None
-            }
-            logger.info(f"Session data initialized for existing session ID: {session_id}")
-
-        # Now we have a valid sessionId, get the threadId
-        thread_id = session_data[session_id]["thread"].id
-        logger.info(f"Using thread ID: {thread_id}")
+        session_id, thread_id, _ = get_or_create_session(req.session_cookie, thread_id_from_body)
+        tracer.annotate(assistant_id=assistant_id_berater, thread_id=thread_id)
 
         # ----------------------------------------------------------------------
-        # STEP B: Define "special" questions + responses
-        SPECIAL_RESPONSES = {
-            "ich benötige ein baugrundgutachten": [
-                "Hallo! Gerne helfe ich Ihnen dabei. Wissen Sie, wie viele Rammkernsondierungen Sie benötigen oder haben Sie genaue Vorgaben für das Baugrundgutachten, oder benötigen Sie Beratung?",
-                "Guten Tag! Benötigen Sie allgemeine Infos zum Baugrundgutachten oder möchten Sie direkt einen Preis?",
-                "Guten Tag! Möchten Sie einen Preis wissen oder haben Sie andere Fragen?"
-            ],
-            "ich benötige eine deklarationsanalyse": [
-                "Super! Zwei Fragen hierzu: 1. Wissen Sie, nach welcher Verordnung die Deklarationsanalyse durchgeführt werden soll? 2. Wie viele Laboranalysen benötigen Sie? Wenn nicht, können wir das zusammen klären.",
-                "Kein Problem! Wissen Sie, nach welcher Verordnung die Deklarationsanalyse durchgeführt werden soll und wie viele Laboranalysen Sie benötigen? Wenn nicht, können wir das zusammen klären.",
-                "Okay! Und wissen Sie schon was für eine Deklarationsanalyse Sie benötigen, also nach welcher Verordnung oder sollen wir das zusammen klären?"
-            ],
-            "ich möchte boden / bauschutt entsorgen": [
-                "Gerne! Haben Sie schon eine Deklarationsanalyse für das Material vorliegen?",
-                "Okay! Haben Sie bereits eine Deklarationsanalyse für das Material? Falls ja, können Sie hier auf der Webseite eine Anfrage stellen und die Deklarationsanalyse samt Probenahmeprotokoll direkt hochladen, damit wir Ihnen ein Preis nennen können.",
-                "Kein Problem! Haben Sie bereits eine Deklarationsanalyse für das Material vorliegen? Falls ja, können Sie diese hochladen oder die relevanten Informationen teilen. Falls keine Analyse vorliegt, könnte ich Ihnen die Kosten für eine Deklarationsanalyse berechnen. Wie möchten Sie fortfahren?"
-            ],
-            "ich benötige boden / recyclingmaterial": [
-                "Hallo! Wie viel Material benötigen Sie denn?",
-                "Okay! Brauchen Sie Boden oder Recyclingmaterial?",
-                "Gerne! Wie viel und was für Material benötigen Sie denn?"
-            ]
-        }
+        # STEP B: Check for "special" question
+        special_question = intent_matcher.match_special(user_message)
+        if special_question:
+            tracer.annotate(special=True)
+            # Pick a random response
+            response_message = random.choice(SPECIAL_RESPONSES[special_question])
+            logger.info("Returning a special (random) response.")
 
-        # ----------------------------------------------------------------------
-        # STEP C: Check for "special" question
-        if user_message.lower().strip() in SPECIAL_RESPONSES:
-            # Optionally store the user message in the thread
-            client.beta.threads.messages.create(
-                thread_id=thread_id,
-                role="user",
-                content=user_message
-            )
+            thread_id = reply_thread_id(session_id, thread_id)
+            # Keep both messages with the session; the next real run adds them to the thread
+            queue_thread_messages(session_id, thread_id, [("user", user_message), ("assistant", response_message)])
 
-            # Pick a random response
-            random_response = random.choice(SPECIAL_RESPONSES[user_message.lower().strip()])
-
-            # Delay
-            time.sleep(1)
-            response_message = random_response
-            logger.info("Returning a special delayed (random) response.")
-
-            # Optionally store the assistant's special response in the thread
-            client.beta.threads.messages.create(
-                thread_id=thread_id,
-                role="assistant",
-                content=response_message
-            )
+            record_turn(session_id, user_message, response_message)
 
             # Log to DB
             log_chat("special-no-openai", user_message, response_message, ip_address, region, city)
 
-            # Return special response + same thread_id
-            response = make_response(jsonify({"response": response_message, "thread_id": thread_id}))
-            response.set_cookie("session_id", session_id, httponly=True, samesite="None", secure=True)
-            return response
+            if req.stream:
+                return stream_text_response(session_id, thread_id, response_message, SPECIAL_TYPING_DELAY_MS)
+
+            # Return special response + same thread_id; the front-end simulates typing for typing_delay ms
+            return RouteReply({
+                "response": response_message,
+                "thread_id": thread_id,
+                "typing_delay": SPECIAL_TYPING_DELAY_MS
+            }, session_id=session_id)
 
         # ----------------------------------------------------------------------
-        # STEP D: Normal OpenAI flow
+        # STEP C: Normal OpenAI flow
 
         # Include region note if available
         user_message_for_gpt = user_message
         #if region and region.lower() != "unavailable":
         #    user_message_for_gpt = f"(HINWEIS: Der Benutzer befindet sich in {region}.)\n\n{user_message}"
 
-        # 1) Insert user's message
-        client.beta.threads.messages.create(
-            thread_id=thread_id,
-            role="user",
-            content=user_message_for_gpt
-        )
-
-        # 2) Run the assistant
-        run = client.beta.threads.runs.create_and_poll(thread_id=thread_id, assistant_id=assistant_id_berater)
-        all_msgs = list(client.beta.threads.messages.list(thread_id=thread_id, run_id=run.id))
-
-        # The newest message is usually last in all_msgs, so let's read it:
-        response_message = all_msgs[0].content[0].text.value
-        logger.info(f"Response from OpenAI: {response_message}")
-
-        # 3) Check if it's a summary => store
-        if ("zusammenfassung" in response_message.lower() or
-            "überblick" in response_message.lower() or
-            "summary" in response_message.lower() or
-            "zusammenfassen" in response_message.lower() or
-            "zusammen" in response_message.lower()):
-            session_data[session_id]['summary'] = response_message
-            logger.info(f"Summary stored for session {session_id}.")
-
-        confirmation_phrases = [
-            "prima! dann werde ich die anfrage so an meine kollegen weiterleiten.",
-            "prima! ich werde die anfrage so an meine kollegen weiterleiten.",
-            "ihre anfrage wird weitergeleitet.",
-            "prima! dann leite ich die anfrage an meine kollegen weiter.",
-            "super! ich werde die anfrage an meine kollegen weiterleiten."
-        ]
-
-        # If the assistant says one of these confirmations, we parse + send to Zoho
-        if any(phrase in response_message.lower() for phrase in confirmation_phrases):
-            logger.info("Assistant provided the confirmation message.")
-            confirmed_summary = session_data[session_id].get('summary')
-            if confirmed_summary:
-                user_details = extract_details_from_summary(confirmed_summary)
-                if user_details:
-                    # Let's fetch the ENTIRE conversation from the thread
-                    all_conversation_msgs = list(client.beta.threads.messages.list(thread_id=thread_id))
-                    # Reverse it so the earliest message is first, newest last
-                    all_conversation_msgs.reverse()
-
-                    # We'll store each line as "USER: text" or "BOT: text"
-                    # Add a blank line between them for readability
-                    conversation_history = []
-                    for msg in all_conversation_msgs:
-                        if msg.role == "user":
-                            sender = "USER"
-                        else:
-                            sender = "BOT"
-
-                        text = msg.content[0].text.value
-                        # Add "USER: text" with a blank line after
-                        conversation_history.append(f"{sender}: {text}")
-
-                    # Join them with double newlines => blank line between
-                    full_conversation = "\n\n".join(conversation_history)
-
-                    # Store in user_details
-                    user_details["gespraechsverlauf"] = full_conversation
-
-                    # Add IP, region, city
-                    user_details["ip_address"] = ip_address
-                    user_details["region"] = region
-                    user_details["city"] = city
-
-                    logger.info(f"Parsed User Details: {user_details}")
-                    send_to_zoho(user_details)
-                    response_message += "\n\nIhre Daten wurden erfolgreich übermittelt."
-                else:
-                    logger.error("Failed to parse user details from the summary.")
-                    response_message = "Entschuldigung, es gab ein Problem beim Verarbeiten Ihrer Daten."
-            else:
-                logger.error("No summary found to confirm.")
-                response_message = "Entschuldigung, ich konnte Ihre Zusammenfassung nicht finden."
-        else:
-            logger.info("Assistant did not provide the confirmation message.")
-
-        # 4) Log + return
-        log_chat(thread_id, user_message, response_message, ip_address, region, city)
-
-        response = make_response(jsonify({"response": response_message, "thread_id": thread_id}))
-        response.set_cookie("session_id", session_id, httponly=True, samesite='None', secure=True)
-        return response
+        # One run at a time per session; a second message waits for the first answer
+        if req.stream:
+            with SessionRunLock(session_id) as run_lock:
+                # The run adds the user's message (the thread is created on the first run)
+                thread_id, additional_messages = prepare_run(session_id, thread_id, user_message_for_gpt)
+                tracer.annotate(thread_id=thread_id)
+                return stream_run_response(
+                    session_id, thread_id, assistant_id_berater,
+                    lambda text: finalize_berater_response(
+                        session_id, thread_id, user_message, text, ip_address, region, city
+                    ),
+                    "/askberater",
+                    additional_messages,
+                    release=run_lock.hand_over()
+                )
+
+        def run_batch(take_messages):
+            with SessionRunLock(session_id):
+                # 1) The run adds the user's message(s) (the thread is created on the first run)
+                messages = take_messages()
+                run_thread_id, additional_messages = prepare_run(session_id, thread_id, *messages)
+                tracer.annotate(thread_id=run_thread_id)
+
+                # 2) Run the assistant (cancelled after the route's deadline)
+                run = run_executor.run("/askberater", run_thread_id, assistant_id_berater, additional_messages)
+                with metrics.stage("openai_messages_list"):
+                    all_msgs = list(client.beta.threads.messages.list(thread_id=run_thread_id, run_id=run.id))
+
+                # The newest message is usually last in all_msgs, so let's read it:
+                response_message = all_msgs[0].content[0].text.value
+                logger.info(f"Response from OpenAI: {response_message}")
+
+                # 3) Summary detection, Zoho confirmation and logging
+                response_message = finalize_berater_response(
+                    session_id, run_thread_id, "\n".join(messages), response_message, ip_address, region, city
+                )
+            return response_message, run_thread_id
+
+        # Messages sent in quick succession are answered by one run (COALESCE_WINDOW)
+        response_message, thread_id = coalesced_run(("/askberater", session_id), user_message_for_gpt, run_batch)
+
+        return RouteReply({"response": response_message, "thread_id": thread_id}, session_id=session_id)
+
+    except RunBusyError:
+        logger.warning("Previous run of this session is still active, giving up.")
+        return RouteReply({"response": BUSY_RESPONSE}, 429)
+
+    except RunTimeoutError as e:
+        logger.error(f"Timeout in /askberater: {e}")
+        return RouteReply({"response": TIMEOUT_RESPONSE}, 504)
 
     except Exception as e:
         logger.error(f"Error in /askberater: {e}")
-        return jsonify({"response": "Entschuldigung, ein Fehler ist aufgetreten."}), 500
+        return RouteReply({"response": ERROR_RESPONSE}, 500)
 
 
 
@@ -644,381 +3134,575 @@ def ask1():
 
 
 
-@app.route("/ersatzbaustoffverordnung", methods=["POST"])
-def ersatzbaustoffverordnung():
+# ----------------------------------------------------------------------
+#  Background thread writes + answer cache for the law-info assistants
+# ----------------------------------------------------------------------
+class ThreadWriter:
     """
-    Endpoint for a simple assistant that responds to user questions related to
-    Ersatzbaustoffverordnung. Maintains thread IDs for conversation continuity.
-    Now also logs IP address, region, and city.
+    Deletes throwaway OpenAI threads in the background.
     """
-    try:
-        logger.info("Received request at /ersatzbaustoffverordnung")
-
-        # Parse the incoming JSON payload
-        data = request.json or {}
-        user_message = data.get("message", "").strip()
-        thread_id_from_body = data.get("threadId", "")  # Optional thread ID from frontend
-
-        ip_address = data.get("ip_address", "Unavailable")
-        region = data.get("region", "Unavailable")
-        city = data.get("city", "Unavailable")
-
-        logger.info(f"User message: {user_message}, IP: {ip_address}, Region: {region}, City: {city}")
-
-        # Get the assistant ID for this endpoint
-        assistant_id = os.getenv("ASSISTANT_ID_ersatzbaustoffverordnung.online")
-        if not assistant_id:
-            logger.error("ASSISTANT_ID_ersatzbaustoffverordnung is not set in environment variables.")
-            return jsonify({"response": "Assistant configuration error."}), 500
-
-        # Session and thread management
-        session_id = request.cookies.get("session_id")
-        if not session_id and thread_id_from_body:
-            matching_session_id = None
-            for possible_session_id, session_info in session_data.items():
-                if session_info["thread"].id == thread_id_from_body:
-                    matching_session_id = possible_session_id
-                    break
-            if matching_session_id:
-                session_id = matching_session_id
-
-        if not session_id:
-            session_id = str(uuid.uuid4())
-            session_data[session_id] = {
-                "thread": client.beta.threads.create(),
-                "user_details": {},
-                "summary": None
-            }
-            logger.info(f"New session created with ID: {session_id}")
-        elif session_id not in session_data:
-            session_data[session_id] = {
-                "thread": client.beta.threads.create(),
-                "user_details": {},
-                "summary": None
-            }
-            logger.info(f"Session data initialized for existing session ID: {session_id}")
-
-        thread_id = session_data[session_id]["thread"].id
-        logger.info(f"Using thread ID: {thread_id}")
-
-        # Add user message to the thread
-        client.beta.threads.messages.create(
-            thread_id=thread_id, 
-            role="user", 
-            content=user_message
-        )
-
-        # Call the assistant
-        run = client.beta.threads.runs.create_and_poll(
-            thread_id=thread_id, 
-            assistant_id=assistant_id
-        )
-        messages = list(client.beta.threads.messages.list(thread_id=thread_id, run_id=run.id))
-
-        # Extract the response
-        response_message = messages[0].content[0].text.value
-        logger.info(f"Response from Ersatzbaustoffverordnung assistant: {response_message}")
 
-        # >>> NOW log the conversation with IP, region, city
-        log_chat_ersatz(thread_id, user_message, response_message, ip_address, region, city)
+    def __init__(self, max_workers=4):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="thread-writer")
 
-        # Return the assistant's response
-        response = make_response(jsonify({"response": response_message, "thread_id": thread_id}))
-        response.set_cookie("session_id", session_id, httponly=True, samesite="None", secure=True)
-        return response
+    def delete(self, thread_id):
+        """
+        Deletes a throwaway thread in the background.
+        """
+        def _delete():
+            try:
+                client.beta.threads.delete(thread_id)
+            except Exception as e:
+                logger.warning(f"Could not delete thread {thread_id}: {e}")
+        return self._executor.submit(_delete)
 
-    except Exception as e:
-        logger.error(f"Error in /ersatzbaustoffverordnung: {e}")
-        return jsonify({"response": "Entschuldigung, ein Fehler ist aufgetreten."}), 500
 
+thread_writer = ThreadWriter(max_workers=int(os.getenv("THREAD_WRITER_WORKERS", 4)))
 
 
-@app.route("/kreislaufwirtschaftsgesetz", methods=["POST"])
-def kreislaufwirtschaftsgesetz():
+class ThreadPool:
     """
-    Endpoint for a simple assistant about Kreislaufwirtschaftsgesetz.
-    Logs to kreislaufwirtschaftsgesetz_logs.
+    Keeps up to `size` empty OpenAI threads created ahead of time, so a new
+    conversation does not wait for threads.create().
+    - take() hands out a ready thread (or None when the pool is empty) and
+      wakes the background refill.
+    - Threads older than `max_age` seconds are deleted instead of handed out.
+    - Pooled threads are deleted again at shutdown.
     """
-    try:
-        logger.info("Received request at /kreislaufwirtschaftsgesetz")
-
-        data = request.json or {}
-        user_message = data.get("message", "").strip()
-        thread_id_from_body = data.get("threadId")  # Optional
-
-        assistant_id = os.getenv("ASSISTANT_ID_kreislaufwirtschaftsgesetz.online")
-        if not assistant_id:
-            logger.error("ASSISTANT_ID_kreislaufwirtschaftsgesetz is not set.")
-            return jsonify({"response": "Assistant configuration error."}), 500
-
-        # Session logic
-        session_id = request.cookies.get("session_id")
-        if not session_id and thread_id_from_body:
-            matching_session_id = None
-            for possible_session_id, session_info in session_data.items():
-                if session_info["thread"].id == thread_id_from_body:
-                    matching_session_id = possible_session_id
-                    break
-            if matching_session_id:
-                session_id = matching_session_id
-
-        if not session_id:
-            session_id = str(uuid.uuid4())
-            session_data[session_id] = {
-                "thread": client.beta.threads.create(),
-                "user_details": {},
-                "summary": None
-            }
-            logger.info(f"New session created with ID: {session_id}")
-        elif session_id not in session_data:
-            session_data[session_id] = {
-                "thread": client.beta.threads.create(),
-                "user_details": {},
-                "summary": None
-            }
-            logger.info(f"Session data initialized for existing session ID: {session_id}")
-
-        thread_id = session_data[session_id]["thread"].id
-        logger.info(f"Using thread ID: {thread_id}")
-
-        # Send user message
-        client.beta.threads.messages.create(thread_id=thread_id, role="user", content=user_message)
 
-        # Call the assistant
-        run = client.beta.threads.runs.create_and_poll(thread_id=thread_id, assistant_id=assistant_id)
-        messages = list(client.beta.threads.messages.list(thread_id=thread_id, run_id=run.id))
-
-        response_message = messages[0].content[0].text.value
-        logger.info(f"Response from Kreislaufwirtschaftsgesetz: {response_message}")
+    def __init__(self, size=5, max_age=3600):
+        self.size = size
+        self.max_age = max_age
+        self._threads = deque()  # (thread_id, created_at), oldest first
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._worker = None
+        self._worker_pid = None
+        self._counters = {"hits": 0, "misses": 0, "created": 0, "discarded": 0}
+
+    def take(self):
+        now = time.time()
+        stale = []
+        thread_id = None
+        with self._lock:
+            while self._threads:
+                candidate, created_at = self._threads.pop()
+                if now - created_at <= self.max_age:
+                    thread_id = candidate
+                    break
+                stale.append(candidate)
+            self._counters["hits" if thread_id else "misses"] += 1
+            self._counters["discarded"] += len(stale)
+        for stale_id in stale:
+            thread_writer.delete(stale_id)
+        self.ensure_started()
+        self._wakeup.set()
+        return thread_id
+
+    def ensure_started(self):
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+                return
+            if self._worker_pid != os.getpid():
+                # Threads pooled by the parent process belong to the parent
+                self._threads.clear()
+            self._worker = threading.Thread(target=self._run, name="thread-pool-refill", daemon=True)
+            self._worker_pid = os.getpid()
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.clear()
+            self._discard_stale()
+            while self.available() < self.size:
+                try:
+                    with metrics.stage("openai_thread_create"):
+                        thread_id = client.beta.threads.create().id
+                except Exception as e:
+                    logger.error(f"Could not pre-create OpenAI thread: {e}")
+                    break
+                with self._lock:
+                    self._threads.append((thread_id, time.time()))
+                    self._counters["created"] += 1
+            self._wakeup.wait(timeout=max(self.max_age / 4, 30))
+
+    def _discard_stale(self):
+        cutoff = time.time() - self.max_age
+        with self._lock:
+            stale = []
+            while self._threads and self._threads[0][1] < cutoff:
+                stale.append(self._threads.popleft()[0])
+            self._counters["discarded"] += len(stale)
+        for thread_id in stale:
+            thread_writer.delete(thread_id)
+
+    def available(self):
+        with self._lock:
+            return len(self._threads)
+
+    def drain(self):
+        """
+        Deletes all pooled threads (at shutdown, so they are not left behind as orphans).
+        """
+        with self._lock:
+            thread_ids = [thread_id for thread_id, _ in self._threads]
+            self._threads.clear()
+        for thread_id in thread_ids:
+            try:
+                client.beta.threads.delete(thread_id)
+            except Exception as e:
+                logger.warning(f"Could not delete pooled thread {thread_id}: {e}")
 
-        # Log to kreislauf table
-        log_chat_kreislauf(thread_id, user_message, response_message)
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({"available": len(self._threads), "size": self.size, "max_age": self.max_age})
+        return stats
 
-        response = make_response(jsonify({"response": response_message, "thread_id": thread_id}))
-        response.set_cookie("session_id", session_id, httponly=True, samesite="None", secure=True)
-        return response
 
-    except Exception as e:
-        logger.error(f"Error in /kreislaufwirtschaftsgesetz: {e}")
-        return jsonify({"response": "Entschuldigung, ein Fehler ist aufgetreten."}), 500
+thread_pool = None
+if int(os.getenv("THREAD_POOL_SIZE", 0)) > 0:
+    thread_pool = ThreadPool(
+        size=int(os.getenv("THREAD_POOL_SIZE", 0)),
+        max_age=float(os.getenv("THREAD_POOL_MAX_AGE", 3600)),
+    )
+    atexit.register(thread_pool.drain)
+    logger.info("Pre-warmed OpenAI thread pool is enabled.")
 
 
-@app.route("/bundesbodenschutzverordnung", methods=["POST"])
-def bundesbodenschutzverordnung():
+class AnswerCache:
     """
-    Endpoint for a simple assistant about Bundesbodenschutzverordnung.
-    Logs to bundesbodenschutzverordnung_logs.
+    TTL + LRU cache of first-turn answers, keyed on (assistant_id, normalized message).
+    Entries are scoped to the assistant id, so answers from a replaced assistant
+    are never served; invalidate() drops them right away.
     """
-    try:
-        logger.info("Received request at /bundesbodenschutzverordnung")
-
-        data = request.json or {}
-        user_message = data.get("message", "").strip()
-        thread_id_from_body = data.get("threadId", "")
-
-        assistant_id = os.getenv("ASSISTANT_ID_bundesbodenschutzverordnung.online")
-        if not assistant_id:
-            logger.error("ASSISTANT_ID_bundesbodenschutzverordnung is not set.")
-            return jsonify({"response": "Assistant configuration error."}), 500
-
-        # Session logic
-        session_id = request.cookies.get("session_id")
-        if not session_id and thread_id_from_body:
-            matching_session_id = None
-            for possible_session_id, session_info in session_data.items():
-                if session_info["thread"].id == thread_id_from_body:
-                    matching_session_id = possible_session_id
-                    break
-            if matching_session_id:
-                session_id = matching_session_id
-
-        if not session_id:
-            session_id = str(uuid.uuid4())
-            session_data[session_id] = {
-                "thread": client.beta.threads.create(),
-                "user_details": {},
-                "summary": None
-            }
-            logger.info(f"New session created with ID: {session_id}")
-        elif session_id not in session_data:
-            session_data[session_id] = {
-                "thread": client.beta.threads.create(),
-                "user_details": {},
-                "summary": None
-            }
-            logger.info(f"Session data initialized for existing session ID: {session_id}")
 
-        thread_id = session_data[session_id]["thread"].id
-        logger.info(f"Using thread ID: {thread_id}")
-
-        # Send user message
-        client.beta.threads.messages.create(thread_id=thread_id, role="user", content=user_message)
-
-        # Call assistant
-        run = client.beta.threads.runs.create_and_poll(thread_id=thread_id, assistant_id=assistant_id)
-        messages = list(client.beta.threads.messages.list(thread_id=thread_id, run_id=run.id))
-
-        response_message = messages[0].content[0].text.value
-        logger.info(f"Response from Bundesbodenschutzverordnung: {response_message}")
-
-        # Log to bundesbodenschutzverordnung_logs
-        log_chat_bundesbodenschutz(thread_id, user_message, response_message)
+    def __init__(self, max_entries=500, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (assistant_id, text) -> (answer, stored_at)
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0, "invalidated": 0}
+
+    @staticmethod
+    def normalize(text):
+        text = re.sub(r"\s+", " ", text.lower()).strip()
+        return text.rstrip("?!. ")
+
+    def get(self, assistant_id, message):
+        key = (assistant_id, self.normalize(message))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[1] > self.ttl:
+                del self._entries[key]
+                self._counters["evicted"] += 1
+                entry = None
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return entry[0]
+
+    def put(self, assistant_id, message, answer):
+        if not answer:
+            return
+        key = (assistant_id, self.normalize(message))
+        with self._lock:
+            self._entries[key] = (answer, time.time())
+            self._entries.move_to_end(key)
+            self._counters["stored"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evicted"] += 1
+
+    def invalidate(self, assistant_id=None):
+        with self._lock:
+            keys = [k for k in self._entries if assistant_id is None or k[0] == assistant_id]
+            for k in keys:
+                del self._entries[k]
+            self._counters["invalidated"] += len(keys)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({"size": len(self._entries), "max_entries": self.max_entries, "ttl": self.ttl})
+        return stats
+
+
+answer_cache = None
+if os.getenv("ANSWER_CACHE_ENABLED", "0").lower() in ("1", "true", "yes"):
+    answer_cache = AnswerCache(
+        max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 500)),
+        ttl=float(os.getenv("ANSWER_CACHE_TTL", 3600)),
+    )
+    logger.info("Answer cache for first-turn law-site questions is enabled.")
+
+
+def law_site_view(site):
+    """
+    Builds the endpoint for one of the simple law-info assistants in LAW_SITES.
+    Maintains thread IDs for conversation continuity and logs every turn
+    into the site's log table.
+    """
+    route = site["route"]
 
-        response = make_response(jsonify({"response": response_message, "thread_id": thread_id}))
-        response.set_cookie("session_id", session_id, httponly=True, samesite="None", secure=True)
-        return response
+    def view(req):
+        try:
+            logger.info(f"Received request at {route}")
+
+            data = req.data
+            user_message = data.get("message", "").strip()
+            thread_id_from_body = data.get("threadId", "")  # Optional thread ID from frontend
+
+            ip_address = data.get("ip_address", "Unavailable")
+            region = data.get("region", "Unavailable")
+            city = data.get("city", "Unavailable")
+
+            logger.info(f"User message: {user_message}, IP: {ip_address}, Region: {region}, City: {city}")
+
+            assistant_id = site["assistant_id"]
+            if not assistant_id:
+                logger.error(f"{site['assistant_env']} is not set in environment variables.")
+                return RouteReply({"response": "Assistant configuration error."}, 500)
+
+            session_id, thread_id, is_new = get_or_create_session(req.session_cookie, thread_id_from_body)
+            tracer.annotate(assistant_id=assistant_id, thread_id=thread_id)
+
+            # First turn of a new session: repeated questions come from the answer cache
+            use_cache = answer_cache is not None and site.get("cache_answers") and is_new
+            if use_cache:
+                cached = answer_cache.get(assistant_id, user_message)
+                tracer.annotate(cache_hit=cached is not None)
+                if cached is not None:
+                    logger.info(f"Answer cache hit for {route}.")
+                    thread_id = reply_thread_id(session_id, thread_id)
+                    # The next real run adds this exchange to the thread
+                    queue_thread_messages(session_id, thread_id, [("user", user_message), ("assistant", cached)])
+                    record_turn(session_id, user_message, cached)
+                    log_site_chat(site, thread_id, user_message, cached, ip_address, region, city)
+                    if req.stream:
+                        return stream_text_response(session_id, thread_id, cached)
+                    return RouteReply({"response": cached, "thread_id": thread_id}, session_id=session_id)
+
+            def finish(response_message, run_thread_id=None, user_text=user_message):
+                # Only single-message turns are cached, coalesced ones would not fit the key
+                if use_cache and user_text == user_message:
+                    answer_cache.put(assistant_id, user_message, response_message)
+                record_turn(session_id, user_text, response_message)
+                log_site_chat(site, run_thread_id or thread_id, user_text, response_message, ip_address, region, city)
+                return response_message
+
+            # One run at a time per session; a second message waits for the first answer
+            if req.stream:
+                with SessionRunLock(session_id) as run_lock:
+                    # The run adds the user's message (the thread is created on the first run)
+                    thread_id, additional_messages = prepare_run(session_id, thread_id, user_message)
+                    tracer.annotate(thread_id=thread_id)
+                    return stream_run_response(
+                        session_id, thread_id, assistant_id, finish, route, additional_messages,
+                        release=run_lock.hand_over()
+                    )
+
+            def run_batch(take_messages):
+                with SessionRunLock(session_id):
+                    messages = take_messages()
+                    run_thread_id, additional_messages = prepare_run(session_id, thread_id, *messages)
+                    tracer.annotate(thread_id=run_thread_id)
+
+                    # Call the assistant (cancelled after the route's deadline)
+                    run = run_executor.run(route, run_thread_id, assistant_id, additional_messages)
+                    with metrics.stage("openai_messages_list"):
+                        run_messages = list(client.beta.threads.messages.list(thread_id=run_thread_id, run_id=run.id))
+
+                    response_message = run_messages[0].content[0].text.value
+                    logger.info(f"Response from {site['name']} assistant: {response_message}")
+
+                    finish(response_message, run_thread_id, "\n".join(messages))
+                return response_message, run_thread_id
+
+            # Messages sent in quick succession are answered by one run (COALESCE_WINDOW)
+            response_message, thread_id = coalesced_run((route, session_id), user_message, run_batch)
+
+            return RouteReply({"response": response_message, "thread_id": thread_id}, session_id=session_id)
+
+        except RunBusyError:
+            logger.warning(f"Previous run of this session is still active at {route}, giving up.")
+            return RouteReply({"response": BUSY_RESPONSE}, 429)
+
+        except RunTimeoutError as e:
+            logger.error(f"Timeout in {route}: {e}")
+            return RouteReply({"response": TIMEOUT_RESPONSE}, 504)
+
+        except Exception as e:
+            logger.error(f"Error in {route}: {e}")
+            return RouteReply({"response": ERROR_RESPONSE}, 500)
+
+    view.__name__ = route.strip("/")
+    return view
+
+
+for site in LAW_SITES:
+    register_route(site["route"], endpoint=site["route"].strip("/"))(law_site_view(site))
 
-    except Exception as e:
-        logger.error(f"Error in /bundesbodenschutzverordnung: {e}")
-        return jsonify({"response": "Entschuldigung, ein Fehler ist aufgetreten."}), 500
 
 
-@app.route("/lagapn98", methods=["POST"])
-def lagapn98():
+# ----------------------------------------------------------------------
+#  Price resolution for /pricefinder
+# ----------------------------------------------------------------------
+class PriceResolver:
     """
-    Endpoint for a simple assistant about LAGA PN 98.
-    Logs to lagapn98_logs.
+    In-memory price cache for (postcode, verordnung, klasse), warmed from the
+    'preisanfragen' table so most lookups never reach the pricefinder assistant.
+    - A fresh price always replaces an expired one. Among fresh prices, CRM
+      prices (source='crm', logged by /log_crm_price) win over assistant
+      prices; within the same source the newest price wins.
+    - Without an exact postcode match, the best price for the same postcode
+      prefix (e.g. first 3, then 2 digits) is used.
+    - Prices older than `ttl` seconds are ignored; the cache is reloaded from
+      the database every `refresh_interval` seconds in the background, so
+      prices logged by other workers show up too.
     """
-    try:
-        logger.info("Received request at /lagapn98")
-
-        data = request.json or {}
-        user_message = data.get("message", "").strip()
-        thread_id_from_body = data.get("threadId", "")
-
-        assistant_id = os.getenv("ASSISTANT_ID_laga-pn-98.online")
-        if not assistant_id:
-            logger.error("ASSISTANT_ID_lagapn98 is not set.")
-            return jsonify({"response": "Assistant configuration error."}), 500
-
-        session_id = request.cookies.get("session_id")
-        if not session_id and thread_id_from_body:
-            matching_session_id = None
-            for possible_session_id, session_info in session_data.items():
-                if session_info["thread"].id == thread_id_from_body:
-                    matching_session_id = possible_session_id
-                    break
-            if matching_session_id:
-                session_id = matching_session_id
-
-        if not session_id:
-            session_id = str(uuid.uuid4())
-            session_data[session_id] = {
-                "thread": client.beta.threads.create(),
-                "user_details": {},
-                "summary": None
-            }
-            logger.info(f"New session created with ID: {session_id}")
-        elif session_id not in session_data:
-            session_data[session_id] = {
-                "thread": client.beta.threads.create(),
-                "user_details": {},
-                "summary": None
-            }
-            logger.info(f"Session data initialized for existing session ID: {session_id}")
-
-        thread_id = session_data[session_id]["thread"].id
-        logger.info(f"Using thread ID: {thread_id}")
 
-        client.beta.threads.messages.create(thread_id=thread_id, role="user", content=user_message)
+    SOURCE_RANK = {"crm": 2, "openai": 1}
+
+    def __init__(self, ttl=7 * 86400, refresh_interval=900, prefix_lengths=(3, 2)):
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.prefix_lengths = prefix_lengths
+        self._exact = {}
+        self._by_prefix = {n: {} for n in prefix_lengths}
+        self._lock = threading.Lock()
+        self._last_warm = None
+        self._warming = False
+        self._counters = {"hits_exact": 0, "hits_prefix": 0, "misses": 0, "warm_rows": 0}
+
+    @staticmethod
+    def _key(postcode, verordnung, klasse):
+        return (
+            re.sub(r'\D', '', postcode or ''),
+            " ".join((verordnung or '').lower().split()),
+            " ".join((klasse or '').lower().split()),
+        )
 
-        run = client.beta.threads.runs.create_and_poll(thread_id=thread_id, assistant_id=assistant_id)
-        messages = list(client.beta.threads.messages.list(thread_id=thread_id, run_id=run.id))
+    def _better(self, new, old, now):
+        if old is None:
+            return True
+        new_fresh, old_fresh = self._fresh(new, now), self._fresh(old, now)
+        if new_fresh != old_fresh:
+            return new_fresh
+        new_rank = self.SOURCE_RANK.get(new["source"], 0)
+        old_rank = self.SOURCE_RANK.get(old["source"], 0)
+        if new_rank != old_rank:
+            return new_rank > old_rank
+        return new["at"] >= old["at"]
+
+    def _fresh(self, entry, now):
+        return entry is not None and now - entry["at"] <= self.ttl
+
+    def record(self, postcode, verordnung, klasse, price, source, at=None):
+        """
+        Adds a known price (from the assistant, the CRM or the database).
+        """
+        if source not in self.SOURCE_RANK or price is None:
+            return
+        postcode, verordnung, klasse = self._key(postcode, verordnung, klasse)
+        if not postcode:
+            return
+        now = time.time()
+        entry = {"price": float(price), "source": source, "at": at if at is not None else now}
+        with self._lock:
+            key = (postcode, verordnung, klasse)
+            if self._better(entry, self._exact.get(key), now):
+                self._exact[key] = entry
+            for n in self.prefix_lengths:
+                prefix_key = (postcode[:n], verordnung, klasse)
+                if self._better(entry, self._by_prefix[n].get(prefix_key), now):
+                    self._by_prefix[n][prefix_key] = entry
+
+    def lookup(self, postcode, verordnung, klasse):
+        """
+        Returns {"price", "source", "match"} or None on a miss.
+        """
+        self._maybe_refresh()
+        postcode, verordnung, klasse = self._key(postcode, verordnung, klasse)
+        now = time.time()
+        with self._lock:
+            entry = self._exact.get((postcode, verordnung, klasse))
+            if postcode and self._fresh(entry, now):
+                self._counters["hits_exact"] += 1
+                return {"price": entry["price"], "source": entry["source"], "match": "exact"}
+            for n in self.prefix_lengths:
+                if len(postcode) < n:
+                    continue
+                entry = self._by_prefix[n].get((postcode[:n], verordnung, klasse))
+                if self._fresh(entry, now):
+                    self._counters["hits_prefix"] += 1
+                    return {"price": entry["price"], "source": entry["source"], "match": f"prefix{n}"}
+            self._counters["misses"] += 1
+            return None
 
-        response_message = messages[0].content[0].text.value
-        logger.info(f"Response from LAGA PN 98: {response_message}")
+    def warm(self):
+        """
+        Loads recent prices from 'preisanfragen' (only crm/openai rows).
+        """
+        connection = get_db_connection()
+        if connection is None:
+            logger.error("Failed to warm price cache: No DB connection.")
+            return
+        try:
+            with connection.cursor() as cursor:
+                sql = """
+                    SELECT postcode, verordnung, klasse, preis, source, created_at
+                    FROM preisanfragen
+                    WHERE source IN ('crm', 'openai')
+                      AND created_at >= NOW() - INTERVAL %s SECOND
+                """
+                cursor.execute(sql, (int(self.ttl),))
+                rows = cursor.fetchall()
+            for row in rows:
+                created_at = row.get("created_at")
+                at = created_at.timestamp() if created_at else None
+                self.record(row["postcode"], row["verordnung"], row["klasse"], row["preis"], row["source"], at)
+            with self._lock:
+                self._counters["warm_rows"] += len(rows)
+            logger.info(f"Price cache warmed with {len(rows)} row(s) from preisanfragen.")
+        except Exception as e:
+            logger.error(f"Error warming price cache from preisanfragen: {e}")
+        finally:
+            connection.close()
+
+    def _maybe_refresh(self):
+        with self._lock:
+            due = self._last_warm is None or time.time() - self._last_warm >= self.refresh_interval
+            if not due or self._warming:
+                return
+            self._warming = True
+            self._last_warm = time.time()
+        threading.Thread(target=self._refresh, name="price-cache-warm", daemon=True).start()
+
+    def _refresh(self):
+        try:
+            self.warm()
+        finally:
+            with self._lock:
+                self._warming = False
 
-        # Log to lagapn98_logs
-        log_chat_lagapn98(thread_id, user_message, response_message)
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({"size": len(self._exact), "ttl": self.ttl})
+        return stats
 
-        response = make_response(jsonify({"response": response_message, "thread_id": thread_id}))
-        response.set_cookie("session_id", session_id, httponly=True, samesite="None", secure=True)
-        return response
 
-    except Exception as e:
-        logger.error(f"Error in /lagapn98: {e}")
-        return jsonify({"response": "Entschuldigung, ein Fehler ist aufgetreten."}), 500
+price_resolver = PriceResolver(
+    ttl=float(os.getenv("PRICE_CACHE_TTL", 7 * 86400)),
+    refresh_interval=float(os.getenv("PRICE_CACHE_REFRESH", 900)),
+    prefix_lengths=tuple(int(n) for n in os.getenv("PRICE_PREFIX_LENGTHS", "3,2").split(",") if n.strip()),
+)
 
 
-@app.route("/deponieverordnung", methods=["POST"])
-def deponieverordnung():
+def format_price(price):
     """
-    Endpoint for a simple assistant about Deponieverordnung.
-    Logs to deponieverordnung_logs.
+    Formats a cached price the way the pricefinder assistant answers (number only).
     """
-    try:
-        logger.info("Received request at /deponieverordnung")
+    return f"{price:.2f}"
 
-        data = request.json or {}
-        user_message = data.get("message", "").strip()
-        thread_id_from_body = data.get("threadId", "")
-
-        assistant_id = os.getenv("ASSISTANT_ID_deponieverordnung.online")
-        if not assistant_id:
-            logger.error("ASSISTANT_ID_deponieverordnung is not set.")
-            return jsonify({"response": "Assistant configuration error."}), 500
-
-        session_id = request.cookies.get("session_id")
-        if not session_id and thread_id_from_body:
-            matching_session_id = None
-            for possible_session_id, session_info in session_data.items():
-                if session_info["thread"].id == thread_id_from_body:
-                    matching_session_id = possible_session_id
-                    break
-            if matching_session_id:
-                session_id = matching_session_id
-
-        if not session_id:
-            session_id = str(uuid.uuid4())
-            session_data[session_id] = {
-                "thread": client.beta.threads.create(),
-                "user_details": {},
-                "summary": None
-            }
-            logger.info(f"New session created with ID: {session_id}")
-        elif session_id not in session_data:
-            session_data[session_id] = {
-                "thread": client.beta.threads.create(),
-                "user_details": {},
-                "summary": None
-            }
-            logger.info(f"Session data initialized for existing session ID: {session_id}")
-
-        thread_id = session_data[session_id]["thread"].id
-        logger.info(f"Using thread ID: {thread_id}")
 
-        client.beta.threads.messages.create(thread_id=thread_id, role="user", content=user_message)
+# ----------------------------------------------------------------------
+#  Stateless pricing path (no visitor thread involved)
+# ----------------------------------------------------------------------
+PRICE_BATCH_SIZE = int(os.getenv("PRICE_BATCH_SIZE", 20))  # max items per assistant run
 
-        run = client.beta.threads.runs.create_and_poll(thread_id=thread_id, assistant_id=assistant_id)
-        messages = list(client.beta.threads.messages.list(thread_id=thread_id, run_id=run.id))
 
-        response_message = messages[0].content[0].text.value
-        logger.info(f"Response from Deponieverordnung: {response_message}")
+def build_price_prompt(items):
+    """
+    Fixed, minimal prompt for the pricefinder assistant.
+    items: list of (postcode, verordnung, klasse).
+    """
+    if len(items) == 1:
+        postcode, verordnung, klasse = items[0]
+        return (
+            f"Postcode: {postcode}, Verordnung: {verordnung}, Klasse: {klasse}. "
+            f"Please return only the numeric price in euros (no extra text)."
+        )
+    lines = [
+        f"{n}. Postcode: {postcode}, Verordnung: {verordnung}, Klasse: {klasse}"
+        for n, (postcode, verordnung, klasse) in enumerate(items, start=1)
+    ]
+    return (
+        "\n".join(lines) + "\n"
+        "For each numbered line return exactly one line '<number>: <price>' with only "
+        "the numeric price in euros (no extra text)."
+    )
+
+
+def parse_price_value(text):
+    """
+    Parses the numeric price out of an assistant answer like '12,50 €'. Returns None if impossible.
+    """
+    price_str = re.sub(r'[^0-9.,]', '', (text or '').strip())
+    price_str = price_str.replace(',', '.')
+    try:
+        return float(price_str)
+    except ValueError:
+        return None
 
-        # Log to deponieverordnung_logs
-        log_chat_deponie(thread_id, user_message, response_message)
 
-        response = make_response(jsonify({"response": response_message, "thread_id": thread_id}))
-        response.set_cookie("session_id", session_id, httponly=True, samesite="None", secure=True)
-        return response
+def parse_price_answer(text, count):
+    """
+    Splits the assistant's answer into one raw answer per requested item (None where missing).
+    """
+    if count == 1:
+        return [text]
+    answers = [None] * count
+    for line in text.splitlines():
+        match = re.match(r'\s*(\d+)\s*[:.)-]\s*(.+)', line)
+        if match and 1 <= int(match.group(1)) <= count:
+            answers[int(match.group(1)) - 1] = match.group(2).strip()
+    return answers
 
-    except Exception as e:
-        logger.error(f"Error in /deponieverordnung: {e}")
-        return jsonify({"response": "Entschuldigung, ein Fehler ist aufgetreten."}), 500
 
+def ask_price_assistant(items):
+    """
+    Asks the pricefinder assistant for one or more prices in a single run on a
+    short-lived thread (created together with the prompt and deleted afterwards),
+    so the cost per lookup stays constant and visitor threads are never touched.
+    Returns one raw answer per item (None where the assistant gave none).
+    """
+    results = []
+    for start in range(0, len(items), PRICE_BATCH_SIZE):
+        chunk = items[start:start + PRICE_BATCH_SIZE]
+        run = client.beta.threads.create_and_run(
+            assistant_id=assistant_id_pricefinder,
+            thread={"messages": [{"role": "user", "content": build_price_prompt(chunk)}]}
+        )
+        try:
+            run = run_executor.wait("/pricefinder", run)
+            with metrics.stage("openai_messages_list"):
+                messages = list(client.beta.threads.messages.list(thread_id=run.thread_id, run_id=run.id))
+        finally:
+            thread_writer.delete(run.thread_id)
+        if not messages:
+            logger.error("No messages returned from pricefinder assistant.")
+            results.extend([None] * len(chunk))
+            continue
+        results.extend(parse_price_answer(messages[0].content[0].text.value, len(chunk)))
+    return results
 
 
-@app.route("/pricefinder", methods=["POST"])
-def pricefinder():
+@register_route("/pricefinder")
+def pricefinder(req):
     """
     Replaces the old /pricefinder endpoint that used Zoho CRM.
-    1) Calls the assistant to get a numeric price.
+    1) Answers from the price cache (CRM prices first), else asks the assistant for a
+       numeric price in a single-shot run (the visitor's chat thread is left alone).
     2) Stores that price in the 'preisanfragen' table along with IP, region, and city.
     3) Returns the price to the caller.
     """
     try:
         logger.info("Received request at /pricefinder")
-        data = request.json or {}
+        data = req.data
         postcode   = data.get("postcode", "").strip()
         verordnung = data.get("verordnung", "").strip()
         klasse     = data.get("klasse", "").strip()
@@ -1028,68 +3712,46 @@ def pricefinder():
         region     = data.get("region", "").strip()
         city       = data.get("city", "").strip()
 
-        # --- session logic unchanged ----------------------------------
+        # --- session: only echoed back, pricing never touches the visitor's thread
         thread_id_from_body = data.get("threadId", "")
-        session_id = request.cookies.get("session_id")
-        if not session_id and thread_id_from_body:
-            for possible_session_id, session_info in session_data.items():
-                if session_info["thread"].id == thread_id_from_body:
-                    session_id = possible_session_id
-                    break
-        if not session_id:
-            session_id = str(uuid.uuid4())
-            session_data[session_id] = {
-                "thread": client.beta.threads.create(),
-                "user_details": {},
-                "summary": None
-            }
-            logger.info(f"New session created with ID: {session_id}")
-        elif session_id not in session_data:
-            session_data[session_id] = {
-                "thread": client.beta.threads.create(),
-                "user_details": {},
-                "summary": None
-            }
-            logger.info(f"Session data re-initialized for existing session ID: {session_id}")
-        thread_id = session_data[session_id]["thread"].id
-        logger.info(f"Using thread ID: {thread_id}")
-
-        # Create a message for the assistant
-        user_message = (
-            f"Postcode: {postcode}, Verordnung: {verordnung}, Klasse: {klasse}. "
-            f"Please return only the numeric price in euros (no extra text)."
-        )
-        client.beta.threads.messages.create(
-            thread_id=thread_id,
-            role="user",
-            content=user_message
-        )
-
-        # Run the assistant
-        run = client.beta.threads.runs.create_and_poll(
-            thread_id=thread_id,
-            assistant_id=os.getenv("ASSISTANT_ID_pricefinder", "")
-        )
-        messages = list(client.beta.threads.messages.list(thread_id=thread_id, run_id=run.id))
-        if not messages:
-            logger.error("No messages returned from pricefinder assistant.")
-            return jsonify({"response": "Keine Antwort erhalten.", "thread_id": thread_id}), 200
+        session_id = find_session_id(req.session_cookie, thread_id_from_body)
+        record = session_store.get(session_id) if session_id else None
+        thread_id = record["thread_id"] if record else (thread_id_from_body or None)
+
+        def price_response(response_message):
+            return RouteReply({
+                "response": response_message,
+                "thread_id": thread_id
+            }, session_id=session_id if record else None)
+
+        # Known price => no assistant run
+        cached = price_resolver.lookup(postcode, verordnung, klasse)
+        tracer.annotate(cache_hit=cached is not None)
+        if cached is not None:
+            response_message = format_price(cached["price"])
+            logger.info(f"Price cache hit ({cached['source']}, {cached['match']}) => {response_message}")
+            store_in_preisanfragen(
+                postcode, verordnung, klasse, cached["price"],
+                ip_address, region, city, source="cache"
+            )
+            return price_response(response_message)
 
-        response_message = messages[0].content[0].text.value
+        # Single-shot assistant run on a short-lived thread
+        response_message = ask_price_assistant([(postcode, verordnung, klasse)])[0]
+        if response_message is None:
+            return RouteReply({"response": "Keine Antwort erhalten.", "thread_id": thread_id})
         logger.info(f"Response from pricefinder assistant: {response_message}")
 
         # Parse numeric price
-        price_str = re.sub(r'[^0-9.,]', '', response_message.strip())
-        price_str = price_str.replace(',', '.')
-        try:
-            numeric_price = float(price_str)
+        numeric_price = parse_price_value(response_message)
+        if numeric_price is not None:
             logger.info(f"Parsed numeric price => {numeric_price}")
-        except ValueError:
-            logger.error(f"Could not parse numeric price from => {price_str}")
-            numeric_price = None
+        else:
+            logger.error(f"Could not parse numeric price from => {response_message}")
 
         # If numeric, store in SQL 'preisanfragen' with IP info
         if numeric_price is not None:
+            price_resolver.record(postcode, verordnung, klasse, numeric_price, "openai")
             store_in_preisanfragen(
                 postcode, verordnung, klasse, numeric_price,
                 ip_address, region, city, source="openai"     # ← pass source
@@ -1097,16 +3759,15 @@ def pricefinder():
         else:
             logger.info("Assistant did not return a numeric price => skip SQL insert.")
 
-        response = make_response(jsonify({
-            "response": response_message,
-            "thread_id": thread_id
-        }))
-        response.set_cookie("session_id", session_id, httponly=True, samesite="None", secure=True)
-        return response
+        return price_response(response_message)
+
+    except RunTimeoutError as e:
+        logger.error(f"Timeout in /pricefinder: {e}")
+        return RouteReply({"response": TIMEOUT_RESPONSE}, 504)
 
     except Exception as e:
         logger.error(f"Error in /pricefinder: {e}")
-        return jsonify({"response": "Entschuldigung, ein Fehler ist aufgetreten."}), 500
+        return RouteReply({"response": ERROR_RESPONSE}, 500)
 
 
 # ----------------------------------------------------------------------
@@ -1120,6 +3781,20 @@ def store_in_preisanfragen(postcode, verordnung, klasse, price,
     Table columns: id, postcode, verordnung, klasse, preis,
                    ip_address, region, city, source, created_at
     """
+    store_many_in_preisanfragen([(
+        postcode, verordnung, klasse, price,
+        ip_address, region, city, source
+    )])
+
+
+@metrics.timed("db_preisanfragen_insert")
+def store_many_in_preisanfragen(rows):
+    """
+    Store several prices in 'preisanfragen' with one multi-row INSERT.
+    rows: (postcode, verordnung, klasse, preis, ip_address, region, city, source) tuples
+    """
+    if not rows:
+        return
     connection = get_db_connection()
     if connection is None:
         logger.error("Failed to store in preisanfragen: No DB connection.")
@@ -1132,20 +3807,146 @@ def store_in_preisanfragen(postcode, verordnung, klasse, price,
                      ip_address, region, city, source)
                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
             """
-            cursor.execute(sql, (
-                postcode, verordnung, klasse, price,
-                ip_address, region, city, source
-            ))
+            cursor.executemany(sql, rows)
             connection.commit()
-            logger.info("Inserted into preisanfragen price=%s source=%s", price, source)
+            logger.info("Inserted %s row(s) into preisanfragen (first price=%s source=%s)",
+                        len(rows), rows[0][3], rows[0][7])
     except Exception as e:
         logger.error(f"Error inserting into preisanfragen: {e}")
     finally:
         connection.close()
 
 
-@app.route("/preisvorschlag", methods=["POST"])
-def preisvorschlag():
+# ----------------------------------------------------------------------
+#  Bulk price lookups
+# ----------------------------------------------------------------------
+PRICE_BULK_MAX_ITEMS = int(os.getenv("PRICE_BULK_MAX_ITEMS", 200))
+price_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("PRICE_BULK_WORKERS", 4)), thread_name_prefix="price-bulk"
+)
+
+
+def parse_price_items(raw_items):
+    """
+    Validates the "items" list of a bulk request into (postcode, verordnung, klasse) tuples.
+    Raises ValueError on bad input.
+    """
+    if not isinstance(raw_items, list) or not raw_items:
+        raise ValueError("items must be a non-empty list")
+    if len(raw_items) > PRICE_BULK_MAX_ITEMS:
+        raise ValueError(f"at most {PRICE_BULK_MAX_ITEMS} items per request")
+    items = []
+    for raw in raw_items:
+        if not isinstance(raw, dict):
+            raise ValueError("every item must be an object")
+        items.append((
+            str(raw.get("postcode", "")).strip(),
+            str(raw.get("verordnung", "")).strip(),
+            str(raw.get("klasse", "")).strip(),
+        ))
+    return items
+
+
+def plan_bulk_prices(items):
+    """
+    Answers what the price cache knows and collects the rest.
+    Returns (results, misses): results has one dict per item (None for misses),
+    misses maps each distinct uncached item to the indexes asking for it.
+    """
+    results = [None] * len(items)
+    misses = OrderedDict()
+    for index, (postcode, verordnung, klasse) in enumerate(items):
+        cached = price_resolver.lookup(postcode, verordnung, klasse)
+        if cached is not None:
+            results[index] = {
+                "response": format_price(cached["price"]),
+                "price": cached["price"],
+                "source": "cache",
+            }
+        else:
+            misses.setdefault((postcode, verordnung, klasse), []).append(index)
+    return results, misses
+
+
+def complete_bulk_prices(items, results, misses, answers, ip_address, region, city):
+    """
+    Fills in the assistant answers for the misses, feeds the price cache and
+    writes every priced item to 'preisanfragen' in one multi-row insert.
+    """
+    for item, answer in zip(misses, answers):
+        price = parse_price_value(answer) if answer is not None else None
+        if price is not None:
+            price_resolver.record(*item, price, "openai")
+        for index in misses[item]:
+            results[index] = {
+                "response": answer if answer is not None else "Keine Antwort erhalten.",
+                "price": price,
+                "source": "openai",
+            }
+
+    rows = []
+    for (postcode, verordnung, klasse), result in zip(items, results):
+        result.update({"postcode": postcode, "verordnung": verordnung, "klasse": klasse})
+        if result["price"] is not None:
+            rows.append((postcode, verordnung, klasse, result["price"], ip_address, region, city, result["source"]))
+    store_many_in_preisanfragen(rows)
+    return results
+
+
+def resolve_prices_bulk(items, ip_address="", region="", city=""):
+    """
+    Resolves many (postcode, verordnung, klasse) items: cache first, then the
+    remaining distinct items in batched single-shot assistant runs executed
+    concurrently on the bounded price_executor. A run that fails or times out
+    only leaves its own items without a price; the rest is still returned and stored.
+    """
+    results, misses = plan_bulk_prices(items)
+    tracer.annotate(items=len(items), cache_misses=len(misses))
+    missing = list(misses)
+    chunks = [missing[i:i + PRICE_BATCH_SIZE] for i in range(0, len(missing), PRICE_BATCH_SIZE)]
+    futures = [price_executor.submit(ask_price_assistant, chunk) for chunk in chunks]
+    answers = []
+    for chunk, future in zip(chunks, futures):
+        try:
+            answers.extend(future.result())
+        except Exception as e:
+            logger.error(f"Bulk price run for {len(chunk)} item(s) failed: {e}")
+            answers.extend([None] * len(chunk))
+    logger.info(f"Bulk prices: {len(items)} item(s), {len(missing)} from the assistant in {len(chunks)} run(s).")
+    return complete_bulk_prices(items, results, misses, answers, ip_address, region, city)
+
+
+@register_route("/pricefinder_bulk")
+def pricefinder_bulk(req):
+    """
+    Bulk version of /pricefinder for price tables.
+    Body: {"items": [{"postcode", "verordnung", "klasse"}, ...], "ip_address", "region", "city"}
+    Returns {"results": [{"postcode", "verordnung", "klasse", "response", "price", "source"}, ...]}
+    in the order of the request.
+    """
+    try:
+        logger.info("Received request at /pricefinder_bulk")
+        data = req.data
+        try:
+            items = parse_price_items(data.get("items"))
+        except ValueError as e:
+            return RouteReply({"response": f"Ungültige Anfrage: {e}"}, 400)
+
+        results = resolve_prices_bulk(
+            items,
+            data.get("ip_address", "").strip(),
+            data.get("region", "").strip(),
+            data.get("city", "").strip(),
+        )
+        return RouteReply({"results": results})
+
+    except Exception as e:
+        logger.error(f"Error in /pricefinder_bulk: {e}")
+        return RouteReply({"response": ERROR_RESPONSE}, 500)
+
+
+@register_route("/preisvorschlag")
+def preisvorschlag(req):
     """
     Receives the user's suggested price + the system's fetched price,
     along with postcode, verordnung, klasse.
@@ -1164,7 +3965,7 @@ def preisvorschlag():
     try:
         logger.info("Received request at /preisvorschlag")
 
-        data = request.json or {}
+        data = req.data
         fetched_price   = data.get("fetchedPrice", "").strip()
         suggested_price = data.get("suggestedPrice", "").strip()
         postcode        = data.get("postcode", "").strip()
@@ -1181,11 +3982,11 @@ def preisvorschlag():
 
         store_in_preisvorschlag(postcode, verordnung, klasse, fetched_float, suggested_float, ip_address, region, city)
 
-        return jsonify({"message": "Preisvorschlag gespeichert!"})
+        return RouteReply({"message": "Preisvorschlag gespeichert!"})
 
     except Exception as e:
         logger.error(f"Error in /preisvorschlag: {e}")
-        return jsonify({"message": "Ein Fehler ist aufgetreten."}), 500
+        return RouteReply({"message": "Ein Fehler ist aufgetreten."}, 500)
 
 
 def parse_price_to_float(price_str):
@@ -1201,6 +4002,7 @@ def parse_price_to_float(price_str):
         return 0.0
 
 
+@metrics.timed("db_preisvorschlag_insert")
 def store_in_preisvorschlag(postcode, verordnung, klasse, fetched_price, suggested_price, ip_address, region, city):
     """
     Insert the user-suggested price and fetched price into 'preisvorschlag' table,
@@ -1230,26 +4032,191 @@ def store_in_preisvorschlag(postcode, verordnung, klasse, fetched_price, suggest
         connection.close()
 
 
-@app.route("/log_crm_price", methods=["POST"])
-def log_crm_price():
+@register_route("/log_crm_price")
+def log_crm_price(req):
     """
     Called by PHP/JS to log a CRM-served price.
     """
     try:
-        data        = request.json or {}
+        data        = req.data
         postcode    = data.get("postcode", "").strip()
         verordnung  = data.get("verordnung", "").strip()
         klasse      = data.get("klasse", "").strip()
         preis       = float(data.get("preis", 0))
 
+        price_resolver.record(postcode, verordnung, klasse, preis, "crm")
         store_in_preisanfragen(postcode, verordnung, klasse, preis,
                                source="crm")      # helper now accepts it
-        return {"status": "ok"}, 200
+        return RouteReply({"status": "ok"})
     except Exception as e:
         logger.error("Error in /log_crm_price: %s", e)
-        return {"status": "error"}, 500
+        return RouteReply({"status": "error"}, 500)
+
+
+
+
+@register_route("/db_pool_stats", methods=["GET"])
+@admin_only
+def db_pool_stats(req):
+    """
+    Returns the current MySQL connection pool counters.
+    """
+    return RouteReply(db_pool.stats())
+
+
+@register_route("/session_stats", methods=["GET"])
+@admin_only
+def session_stats(req):
+    """
+    Returns the current session store size and eviction counters.
+    """
+    return RouteReply(session_store.stats())
+
+
+@register_route("/zoho_queue", methods=["GET"])
+@admin_only
+def zoho_queue(req):
+    """
+    Returns the Zoho outbox status counts and its dead letters.
+    """
+    view = zoho_outbox.dead_letters()
+    if view is None:
+        return RouteReply({"message": "Keine Datenbankverbindung."}, 503)
+    view["worker"] = zoho_outbox.stats()
+    view["token"] = zoho_tokens.stats()
+    return RouteReply(view)
+
+
+@register_route("/price_cache_stats", methods=["GET"])
+@admin_only
+def price_cache_stats(req):
+    """
+    Returns the price cache hit/miss counters.
+    """
+    return RouteReply(price_resolver.stats())
+
+
+@register_route("/answer_cache_stats", methods=["GET"])
+@admin_only
+def answer_cache_stats(req):
+    """
+    Returns the answer cache hit/miss counters (empty if the cache is disabled).
+    """
+    return RouteReply(answer_cache.stats() if answer_cache is not None else {})
+
+
+@register_route("/thread_pool_stats", methods=["GET"])
+@admin_only
+def thread_pool_stats(req):
+    """
+    Returns the pre-warmed thread pool counters (empty if the pool is disabled).
+    """
+    return RouteReply(thread_pool.stats() if thread_pool is not None else {})
+
+
+@register_route("/run_stats", methods=["GET"])
+@admin_only
+def run_stats(req):
+    """
+    Returns the assistant run counters per route (durations, polls, timeouts).
+    """
+    return RouteReply(run_executor.stats())
+
+
+def queue_depths():
+    """
+    Items waiting in the in-process queues (for the queue_depth gauge).
+    """
+    depths = {
+        "chat_log": chat_log_writer.stats()["queued"],
+    }
+    if message_coalescer is not None:
+        depths["coalescer"] = message_coalescer.stats()["open"]
+    return depths
+
+
+def db_pool_connections():
+    stats = db_pool.stats()
+    return {"in_use": stats["in_use"], "idle": stats["idle"]}
+
+
+def cache_entries():
+    entries = {"price": price_resolver.stats()["size"]}
+    if answer_cache is not None:
+        entries["answer"] = answer_cache.stats()["size"]
+    return entries
+
+
+metrics.gauge("sessions", "Sessions held by the session store.", lambda: session_store.stats()["size"])
+metrics.gauge("db_pool_size", "Maximum number of MySQL connections.", lambda: db_pool.size)
+metrics.gauge("db_pool_connections", "MySQL connections by state.", db_pool_connections, label="state")
+metrics.gauge("queue_depth", "Items waiting in in-process queues.", queue_depths, label="queue")
+metrics.gauge("zoho_outbox_deals", "Deals in the Zoho outbox by status.", zoho_outbox.counts, label="status")
+metrics.gauge("thread_pool_available", "Pre-warmed OpenAI threads ready to use.",
+              lambda: thread_pool.available() if thread_pool is not None else None)
+metrics.gauge("cache_entries", "Entries in the price and answer caches.", cache_entries, label="cache")
+
+
+@register_route("/trace_stats", methods=["GET"])
+@admin_only
+def trace_stats(req):
+    """
+    Returns the tracing counters (traced / kept requests, exported spans).
+    """
+    return RouteReply(tracer.stats())
+
+
+@register_route("/metrics", methods=["GET"])
+@admin_only
+def prometheus_metrics(req):
+    """
+    Returns all metrics in the Prometheus text exposition format.
+    """
+    return RouteReply(text=metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+# ----------------------------------------------------------------------
+#  Flask front end
+# ----------------------------------------------------------------------
+def flask_reply(reply):
+    """
+    Turns a RouteReply into a Flask response.
+    """
+    if reply.events is not None:
+        response = Response(reply.events, mimetype="text/event-stream", headers=SSE_HEADERS)
+    elif reply.text is not None:
+        response = Response(reply.text, status=reply.status, mimetype=reply.mimetype)
+    else:
+        response = make_response(jsonify(reply.payload), reply.status)
+    if reply.session_id:
+        response.set_cookie("session_id", reply.session_id, **SESSION_COOKIE)
+    return response
+
+
+def flask_view(handler):
+    def view():
+        return flask_reply(handler(RouteRequest(
+            request.get_json(silent=True) or {},
+            request.cookies.get("session_id"),
+            request.headers.get("Accept", ""),
+            request.headers.get("Authorization", ""),
+        )))
+
+    view.__doc__ = handler.__doc__
+    return view
+
+
+for rule, endpoint, handler, methods in ROUTES:
+    app.add_url_rule(rule, endpoint, flask_view(handler), methods=methods)
 
 
+@app.before_request
+def start_background_workers():
+    # Pending Zoho deals from earlier runs are delivered even before the next confirmation
+    zoho_outbox.ensure_started()
+    zoho_tokens.ensure_started()
+    if thread_pool is not None:
+        thread_pool.ensure_started()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,9 @@
+import logging
+import os
+
+# newbot reads its configuration at import time
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("ASSISTANT_ID_berater", "asst_berater")
+os.environ.setdefault("ASSISTANT_ID_pricefinder", "asst_price")
+
+logging.disable(logging.CRITICAL)
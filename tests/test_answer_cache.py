@@ -0,0 +1,97 @@
+from types import SimpleNamespace
+
+import pytest
+
+import newbot
+
+SITE = newbot.LAW_SITES[0]
+
+
+@pytest.fixture
+def cache():
+    return newbot.AnswerCache(max_entries=2, ttl=100)
+
+
+def test_hit_ignores_case_spacing_and_trailing_punctuation(cache):
+    cache.put("asst", "Was ist eine Ersatzbaustoffverordnung?", "Antwort")
+
+    assert cache.get("asst", "  was ist   eine ersatzbaustoffverordnung ") == "Antwort"
+    assert cache.get("other_asst", "Was ist eine Ersatzbaustoffverordnung?") is None
+
+
+def test_expired_entries_are_dropped(cache, monkeypatch):
+    cache.put("asst", "Frage", "Antwort")
+    now = newbot.time.time()
+    monkeypatch.setattr(newbot.time, "time", lambda: now + 101)
+
+    assert cache.get("asst", "Frage") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_least_recently_used_entry_is_evicted(cache):
+    cache.put("asst", "eins", "1")
+    cache.put("asst", "zwei", "2")
+    cache.get("asst", "eins")
+    cache.put("asst", "drei", "3")
+
+    assert cache.get("asst", "zwei") is None
+    assert cache.get("asst", "eins") == "1"
+    assert cache.stats()["evicted"] == 1
+
+
+def test_invalidate_drops_one_assistant(cache):
+    cache.put("asst", "eins", "1")
+    cache.put("other_asst", "eins", "1")
+
+    cache.invalidate("asst")
+
+    assert cache.get("asst", "eins") is None
+    assert cache.get("other_asst", "eins") == "1"
+
+
+@pytest.fixture
+def law_site(monkeypatch, cache):
+    """The first law site with a memory session store and a stand-in assistant that counts runs."""
+    runs = []
+    monkeypatch.setattr(newbot, "answer_cache", cache)
+    monkeypatch.setattr(newbot, "session_store", newbot.InMemorySessionStore(max_entries=100, ttl=100))
+    monkeypatch.setattr(newbot, "thread_pool", None)
+    monkeypatch.setattr(newbot, "message_coalescer", None)
+    monkeypatch.setattr(newbot.chat_log_writer, "enqueue", lambda *args: None)
+    monkeypatch.setitem(SITE, "assistant_id", "asst_law")
+
+    def run(route, thread_id, assistant_id, additional_messages=None):
+        runs.append(thread_id)
+        return SimpleNamespace(id=f"run_{len(runs)}")
+
+    answer = SimpleNamespace(content=[SimpleNamespace(text=SimpleNamespace(value="Antwort vom Assistenten"))])
+    monkeypatch.setattr(newbot.run_executor, "run", run)
+    monkeypatch.setattr(newbot, "client", SimpleNamespace(beta=SimpleNamespace(threads=SimpleNamespace(
+        create=lambda messages=(): SimpleNamespace(id=f"thread_{len(runs) + 1}"),
+        messages=SimpleNamespace(list=lambda thread_id, run_id: [answer]),
+    ))))
+    return runs
+
+
+def ask(web, message):
+    return web.post(SITE["route"], json={"message": message}).get_json()
+
+
+def test_first_turn_of_a_new_session_is_served_from_the_cache(law_site):
+    first = ask(newbot.app.test_client(), "Was regelt die Verordnung?")
+    second = ask(newbot.app.test_client(), "was regelt die verordnung")
+
+    assert first["response"] == second["response"] == "Antwort vom Assistenten"
+    assert len(law_site) == 1
+    assert second["thread_id"].startswith(newbot.LOCAL_THREAD_PREFIX)
+
+
+def test_later_turns_are_not_served_from_the_cache(law_site):
+    ask(newbot.app.test_client(), "Was regelt die Verordnung?")
+    web = newbot.app.test_client()
+    ask(web, "Hallo")
+
+    # Same question, but no longer the first turn of this session
+    ask(web, "Was regelt die Verordnung?")
+
+    assert len(law_site) == 3
@@ -0,0 +1,33 @@
+import pytest
+
+import newbot
+
+
+@pytest.fixture
+def stored(monkeypatch):
+    monkeypatch.setattr(newbot, "get_db_connection", lambda: None)
+    monkeypatch.setattr(newbot, "price_resolver", newbot.PriceResolver(ttl=100, refresh_interval=3600))
+    monkeypatch.setattr(newbot, "PRICE_BATCH_SIZE", 1)
+    rows = []
+    monkeypatch.setattr(newbot, "store_many_in_preisanfragen", rows.extend)
+    return rows
+
+
+def test_failed_run_only_loses_its_own_items(monkeypatch, stored):
+    def ask_price_assistant(chunk):
+        if chunk[0][0] == "20095":
+            raise newbot.RunTimeoutError("run_1")
+        return ["Der Preis beträgt 42 € pro Tonne."]
+
+    monkeypatch.setattr(newbot, "ask_price_assistant", ask_price_assistant)
+    newbot.price_resolver.record("10115", "LAGA", "Z1", 20, "crm")
+    items = [("10115", "LAGA", "Z1"), ("20095", "LAGA", "Z1"), ("80331", "LAGA", "Z2")]
+
+    results = newbot.resolve_prices_bulk(items)
+
+    assert [(result["postcode"], result["price"], result["source"]) for result in results] == [
+        ("10115", 20.0, "cache"),
+        ("20095", None, "openai"),
+        ("80331", 42.0, "openai"),
+    ]
+    assert [row[0] for row in stored] == ["10115", "80331"]
@@ -0,0 +1,83 @@
+import time
+
+import pytest
+
+import newbot
+
+
+@pytest.fixture
+def inserted(monkeypatch):
+    batches = []
+
+    def insert_chat_rows(table, rows):
+        batches.append((table, list(rows)))
+        return True
+
+    monkeypatch.setattr(newbot, "insert_chat_rows", insert_chat_rows)
+    return batches
+
+
+def row(n):
+    return (f"thread_{n}", "frage", "antwort", "", "", "")
+
+
+def test_rows_are_written_in_batches_per_table(inserted):
+    writer = newbot.ChatLogWriter(batch_size=3, flush_interval=60)
+
+    for n in range(3):
+        writer.enqueue("chatlog", row(n))
+    writer.enqueue("lagapn98_chatlog", row(9))
+    writer.stop()
+
+    assert ("chatlog", [row(0), row(1), row(2)]) in inserted
+    assert ("lagapn98_chatlog", [row(9)]) in inserted
+    assert writer.stats()["written"] == 4
+    assert writer.stats()["queued"] == 0
+
+
+def test_flush_interval_writes_partial_batch(inserted):
+    writer = newbot.ChatLogWriter(batch_size=100, flush_interval=0.05)
+    writer.enqueue("chatlog", row(1))
+
+    deadline = time.time() + 2
+    while not inserted and time.time() < deadline:
+        time.sleep(0.01)
+    writer.stop()
+
+    assert inserted[0] == ("chatlog", [row(1)])
+
+
+def full_writer(policy):
+    writer = newbot.ChatLogWriter(max_queue=1, policy=policy, enqueue_timeout=0.01)
+    # No worker thread: the queue stays full after one row
+    writer._ensure_started = lambda: None
+    writer.enqueue("chatlog", row(0))
+    return writer
+
+
+def test_full_queue_with_sync_policy_writes_directly(inserted):
+    writer = full_writer("sync")
+
+    assert writer.enqueue("chatlog", row(1))
+    assert inserted == [("chatlog", [row(1)])]
+    assert writer.stats()["written_sync"] == 1
+
+
+@pytest.mark.parametrize("policy", ["drop", "block"])
+def test_full_queue_drops_rows(inserted, policy):
+    writer = full_writer(policy)
+
+    assert not writer.enqueue("chatlog", row(1))
+    assert inserted == []
+    assert writer.stats()["dropped"] == 1
+
+
+def test_failed_insert_is_counted(monkeypatch):
+    monkeypatch.setattr(newbot, "insert_chat_rows", lambda table, rows: False)
+    writer = newbot.ChatLogWriter(batch_size=1)
+
+    writer.enqueue("chatlog", row(1))
+    writer.stop()
+
+    assert writer.stats()["failed"] == 1
+    assert writer.stats()["written"] == 0
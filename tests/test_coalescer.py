@@ -0,0 +1,90 @@
+import threading
+
+import pytest
+
+import newbot
+
+
+@pytest.fixture
+def coalescer(monkeypatch):
+    coalescer = newbot.MessageCoalescer(window=0.2)
+    monkeypatch.setattr(newbot, "message_coalescer", coalescer)
+    return coalescer
+
+
+def send_concurrently(messages, run_batch):
+    results = {}
+
+    def send(message):
+        try:
+            results[message] = newbot.coalesced_run(("/askberater", "s1"), message, run_batch)
+        except Exception as e:
+            results[message] = e
+
+    threads = [threading.Thread(target=send, args=(message,)) for message in messages]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_without_coalescer_each_message_runs_alone(monkeypatch):
+    monkeypatch.setattr(newbot, "message_coalescer", None)
+
+    assert newbot.coalesced_run(("/askberater", "s1"), "Hallo", lambda take: take()) == ["Hallo"]
+
+
+def test_messages_within_the_window_share_one_run(coalescer):
+    runs = []
+
+    def run_batch(take_messages):
+        messages = take_messages()
+        runs.append(messages)
+        return "Antwort auf " + ", ".join(messages)
+
+    results = send_concurrently(["a", "b", "c"], run_batch)
+
+    assert len(runs) == 1
+    assert sorted(runs[0]) == ["a", "b", "c"]
+    assert len(set(results.values())) == 1
+    assert coalescer.stats() == {"batches": 1, "coalesced": 2, "open": 0, "window": 0.2}
+
+
+def test_message_after_the_batch_closed_starts_a_new_run(coalescer):
+    taken = threading.Event()
+    release = threading.Event()
+    runs = []
+
+    def run_batch(take_messages):
+        messages = take_messages()
+        runs.append(messages)
+        taken.set()
+        release.wait(5)
+        return messages
+
+    leader = threading.Thread(target=newbot.coalesced_run, args=(("/askberater", "s1"), "a", run_batch))
+    leader.start()
+    taken.wait(5)
+    # The leader's run is still going on; its batch no longer takes messages
+    results = {}
+    second = threading.Thread(target=lambda: results.update(b=newbot.coalesced_run(("/askberater", "s1"), "b", run_batch)))
+    second.start()
+    release.set()
+    leader.join()
+    second.join()
+
+    assert runs == [["a"], ["b"]]
+    assert results["b"] == ["b"]
+    assert coalescer.stats()["coalesced"] == 0
+
+
+def test_leader_failure_reaches_the_followers(coalescer):
+    def run_batch(take_messages):
+        take_messages()
+        raise newbot.RunTimeoutError("run_1")
+
+    results = send_concurrently(["a", "b"], run_batch)
+
+    assert all(isinstance(result, newbot.RunTimeoutError) for result in results.values())
+    assert coalescer.stats()["open"] == 0
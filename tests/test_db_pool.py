@@ -0,0 +1,93 @@
+import pytest
+
+import newbot
+
+
+class FakeConnection:
+    def __init__(self, fail_rollback=False):
+        self.open = True
+        self.fail_rollback = fail_rollback
+        self.rollbacks = 0
+        self.server_status = 0
+
+    def begin(self):
+        self.server_status |= newbot.SERVER_STATUS.SERVER_STATUS_IN_TRANS
+
+    def commit(self):
+        self.server_status &= ~newbot.SERVER_STATUS.SERVER_STATUS_IN_TRANS
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.server_status &= ~newbot.SERVER_STATUS.SERVER_STATUS_IN_TRANS
+        if self.fail_rollback:
+            raise RuntimeError("connection lost")
+
+    def ping(self, reconnect=True):
+        pass
+
+    def close(self):
+        self.open = False
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    created = []
+
+    def connect(**kwargs):
+        created.append(FakeConnection())
+        return created[-1]
+
+    monkeypatch.setattr(newbot.pymysql, "connect", connect)
+    return created
+
+
+def test_release_rolls_back_open_transaction_and_reuses(connections):
+    pool = newbot.ConnectionPool(size=1)
+
+    connection = pool.acquire()
+    connections[0].begin()
+    connection.close()
+    connection = pool.acquire()
+
+    assert len(connections) == 1
+    assert connections[0].rollbacks == 1
+    assert pool.stats()["reused"] == 1
+    connection.close()
+
+
+def test_release_discards_connection_that_fails_to_roll_back(connections):
+    pool = newbot.ConnectionPool(size=1)
+
+    connection = pool.acquire()
+    connections[0].begin()
+    connections[0].fail_rollback = True
+    connection.close()
+
+    assert not connections[0].open
+    assert pool.stats()["idle"] == 0
+    assert pool.stats()["discarded"] == 1
+    # The slot is free again, the next borrower gets a fresh connection
+    pool.acquire()
+    assert len(connections) == 2
+
+
+def test_release_after_commit_skips_the_rollback(connections):
+    pool = newbot.ConnectionPool(size=1)
+
+    connection = pool.acquire()
+    connections[0].begin()
+    connections[0].commit()
+    connection.close()
+
+    assert connections[0].rollbacks == 0
+    assert pool.stats()["idle"] == 1
+
+
+def test_acquire_times_out_when_exhausted(connections):
+    pool = newbot.ConnectionPool(size=1, timeout=0.05)
+
+    held = pool.acquire()
+    assert pool.acquire() is None
+    assert pool.stats()["timeouts"] == 1
+    held.close()
+    assert pool.acquire() is not None
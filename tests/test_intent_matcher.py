@@ -0,0 +1,37 @@
+import pytest
+
+import newbot
+
+
+def matcher(fuzzy_cutoff=0):
+    return newbot.IntentMatcher(newbot.SPECIAL_RESPONSES, newbot.SUMMARY_KEYWORDS, newbot.CONFIRMATION_PHRASES,
+                                fuzzy_cutoff=fuzzy_cutoff)
+
+
+def test_fuzzy_matching_is_off_by_default():
+    assert newbot.intent_matcher.fuzzy_cutoff == 0
+    assert matcher().match_special("Ich benötige ein Baugrundgutachen") is None
+
+
+def test_exact_match_ignores_case_punctuation_and_spacing():
+    assert matcher().match_special("  Ich benötige ein BAUGRUNDGUTACHTEN! ") == "ich benötige ein baugrundgutachten"
+
+
+@pytest.mark.parametrize("fuzzy_cutoff", [0, 0.9, 0.8])
+@pytest.mark.parametrize("message", [
+    "Ich benötige kein Baugrundgutachten",
+    "Ich benötige keine Deklarationsanalyse",
+    "Ich möchte Boden / Bauschutt nicht entsorgen",
+    "Ich benötige Baugrundgutachten",
+])
+def test_negations_and_dropped_words_never_match(message, fuzzy_cutoff):
+    assert matcher(fuzzy_cutoff).match_special(message) is None
+
+
+def test_typo_in_a_long_word_matches_when_enabled():
+    assert matcher(0.9).match_special("Ich benötige ein Baugrundgutachen") == "ich benötige ein baugrundgutachten"
+    assert matcher(0.9).match_special("ich möchte boden / bauschut entsorgen") == "ich möchte boden / bauschutt entsorgen"
+
+
+def test_classify_response():
+    assert matcher().classify_response("Vielen Dank! Ihre Anfrage wird weitergeleitet.") == {"confirmation"}
@@ -0,0 +1,52 @@
+import time
+
+import pytest
+
+import newbot
+
+
+@pytest.fixture
+def resolver(monkeypatch):
+    # No database: the background warm-up finds nothing to load
+    monkeypatch.setattr(newbot, "get_db_connection", lambda: None)
+    return newbot.PriceResolver(ttl=100, refresh_interval=3600)
+
+
+def test_crm_price_wins_over_assistant_price(resolver):
+    resolver.record("10115", "LAGA", "Z1", 20, "crm")
+    resolver.record("10115", "LAGA", "Z1", 30, "openai")
+
+    assert resolver.lookup("10115", "laga", " z1 ") == {"price": 20.0, "source": "crm", "match": "exact"}
+
+
+def test_newest_price_of_same_source_wins(resolver):
+    resolver.record("10115", "LAGA", "Z1", 20, "openai", at=time.time() - 10)
+    resolver.record("10115", "LAGA", "Z1", 25, "openai")
+
+    assert resolver.lookup("10115", "LAGA", "Z1")["price"] == 25.0
+
+
+def test_fresh_price_replaces_stale_crm_price(resolver):
+    resolver.record("10115", "LAGA", "Z1", 20, "crm", at=time.time() - 1000)
+    assert resolver.lookup("10115", "LAGA", "Z1") is None
+
+    resolver.record("10115", "LAGA", "Z1", 30, "openai")
+
+    assert resolver.lookup("10115", "LAGA", "Z1") == {"price": 30.0, "source": "openai", "match": "exact"}
+    assert resolver.lookup("10188", "LAGA", "Z1") == {"price": 30.0, "source": "openai", "match": "prefix3"}
+
+
+def test_stale_price_does_not_replace_fresh_one(resolver):
+    resolver.record("10115", "LAGA", "Z1", 30, "openai")
+    resolver.record("10115", "LAGA", "Z1", 20, "crm", at=time.time() - 1000)
+
+    assert resolver.lookup("10115", "LAGA", "Z1")["price"] == 30.0
+
+
+def test_prefix_match_and_miss(resolver):
+    resolver.record("10115", "LAGA", "Z1", 20, "openai")
+
+    assert resolver.lookup("10188", "LAGA", "Z1")["match"] == "prefix3"
+    assert resolver.lookup("10999", "LAGA", "Z1")["match"] == "prefix2"
+    assert resolver.lookup("80331", "LAGA", "Z1") is None
+    assert resolver.stats()["misses"] == 1
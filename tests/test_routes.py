@@ -0,0 +1,48 @@
+import pytest
+
+import newbot
+
+ADMIN_ROUTES = [rule for rule, _, handler, methods in newbot.ROUTES if methods == ["GET"]]
+
+
+@pytest.fixture
+def client():
+    return newbot.app.test_client()
+
+
+def test_every_stats_route_is_admin_only():
+    assert "/metrics" in ADMIN_ROUTES and "/zoho_queue" in ADMIN_ROUTES
+    for rule, _, handler, methods in newbot.ROUTES:
+        if methods == ["GET"]:
+            assert hasattr(handler, "__wrapped__"), rule
+
+
+@pytest.mark.parametrize("rule", ADMIN_ROUTES)
+def test_admin_routes_are_disabled_without_token(client, monkeypatch, rule):
+    monkeypatch.setattr(newbot, "ADMIN_TOKEN", "")
+
+    assert client.get(rule, headers={"Authorization": "Bearer "}).status_code == 401
+
+
+def test_admin_routes_need_the_bearer_token(client, monkeypatch):
+    monkeypatch.setattr(newbot, "ADMIN_TOKEN", "s3cret")
+
+    assert client.get("/session_stats").status_code == 401
+    assert client.get("/session_stats", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    assert client.get("/session_stats", headers={"Authorization": "Basic s3cret"}).status_code == 401
+
+    response = client.get("/session_stats", headers={"Authorization": "Bearer s3cret"})
+    assert response.status_code == 200
+    assert "size" in response.get_json()
+
+    response = client.get("/metrics", headers={"Authorization": "Bearer s3cret"})
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+
+
+def test_streamed_canned_answer_keeps_the_typing_delay():
+    reply = newbot.stream_text_response("s1", "thread_1", "Hallo!", typing_delay=1000)
+
+    assert list(reply.events) == [
+        newbot.sse_event("done", {"response": "Hallo!", "thread_id": "thread_1", "typing_delay": 1000})
+    ]
@@ -0,0 +1,172 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import newbot
+
+
+class FakeRuns:
+    """OpenAI runs stand-in: a run reports each status of `statuses` in turn, then stays at the last."""
+
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.cancelled = []
+        self.retrieves = 0
+
+    def _run(self, status):
+        return SimpleNamespace(id="run_1", thread_id="thread_1", assistant_id="asst", status=status)
+
+    def create(self, thread_id, assistant_id, additional_messages):
+        return self._run(self.statuses[0])
+
+    def retrieve(self, thread_id, run_id):
+        self.retrieves += 1
+        if self.cancelled:
+            return self._run("cancelled")
+        return self._run(self.statuses[min(self.retrieves, len(self.statuses) - 1)])
+
+    def cancel(self, thread_id, run_id):
+        self.cancelled.append(run_id)
+
+    def stream(self, thread_id, assistant_id, additional_messages):
+        return FakeStream(self, self._run("in_progress"))
+
+
+class FakeStream:
+    """Run stream that sends `deltas`, then hangs (stuck=True) or completes."""
+
+    deltas = ["Hal", "lo"]
+    stuck = False
+
+    def __init__(self, runs, run):
+        self.runs = runs
+        self.current_run = run
+        self.closed = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.closed.set()
+
+    @property
+    def text_deltas(self):
+        yield from self.deltas
+        if self.stuck:
+            self.closed.wait(5)
+            raise ConnectionError("stream closed")
+        self.current_run = self.runs._run("completed")
+
+
+@pytest.fixture
+def executor():
+    return newbot.RunExecutor(default_deadline=0.3, min_interval=0.01, max_interval=0.02, cancel_wait=0.1)
+
+
+def use_runs(monkeypatch, statuses):
+    runs = FakeRuns(statuses)
+    monkeypatch.setattr(newbot, "client", SimpleNamespace(beta=SimpleNamespace(threads=SimpleNamespace(runs=runs))))
+    return runs
+
+
+def test_completed_run_is_returned(monkeypatch, executor):
+    use_runs(monkeypatch, ["queued", "in_progress", "completed"])
+
+    assert executor.run("/askberater", "thread_1", "asst").status == "completed"
+    assert executor.stats()["routes"]["/askberater"]["completed"] == 1
+
+
+def test_run_past_its_deadline_is_cancelled(monkeypatch, executor):
+    runs = use_runs(monkeypatch, ["in_progress"])
+
+    with pytest.raises(newbot.RunTimeoutError):
+        executor.run("/askberater", "thread_1", "asst")
+
+    assert runs.cancelled == ["run_1"]
+    assert executor.stats()["routes"]["/askberater"]["timeouts"] == 1
+
+
+def test_failed_run_raises(monkeypatch, executor):
+    runs = use_runs(monkeypatch, ["queued", "failed"])
+
+    with pytest.raises(newbot.RunFailedError):
+        executor.run("/askberater", "thread_1", "asst")
+
+    assert runs.cancelled == []
+    assert executor.stats()["routes"]["/askberater"]["failed"] == 1
+
+
+def test_run_waiting_for_tools_is_cancelled(monkeypatch, executor):
+    runs = use_runs(monkeypatch, ["requires_action"])
+
+    with pytest.raises(newbot.RunFailedError):
+        executor.run("/askberater", "thread_1", "asst")
+
+    assert runs.cancelled == ["run_1"]
+
+
+def test_stream_yields_the_deltas(monkeypatch, executor):
+    use_runs(monkeypatch, ["in_progress"])
+
+    assert list(executor.stream("/askberater", "thread_1", "asst")) == ["Hal", "lo"]
+    assert executor.stats()["routes"]["/askberater"]["completed"] == 1
+
+
+def test_stuck_stream_is_cancelled_at_the_deadline(monkeypatch, executor):
+    runs = use_runs(monkeypatch, ["in_progress"])
+    monkeypatch.setattr(FakeStream, "stuck", True)
+    deltas = []
+
+    started = time.monotonic()
+    with pytest.raises(newbot.RunTimeoutError):
+        for text in executor.stream("/askberater", "thread_1", "asst"):
+            deltas.append(text)
+
+    assert time.monotonic() - started < 2
+    assert deltas == ["Hal", "lo"]
+    assert runs.cancelled == ["run_1"]
+    assert executor.stats()["routes"]["/askberater"]["timeouts"] == 1
+
+
+def test_stream_closed_by_the_reader_cancels_the_run(monkeypatch, executor):
+    runs = use_runs(monkeypatch, ["in_progress"])
+
+    deltas = executor.stream("/askberater", "thread_1", "asst")
+    assert next(deltas) == "Hal"
+    deltas.close()
+
+    assert runs.cancelled == ["run_1"]
+    assert executor.stats()["routes"]["/askberater"]["failed"] == 1
+
+
+def test_stream_reply_ends_with_the_timeout_response(monkeypatch, executor):
+    use_runs(monkeypatch, ["in_progress"])
+    monkeypatch.setattr(FakeStream, "stuck", True)
+    monkeypatch.setattr(newbot, "run_executor", executor)
+    released = []
+
+    reply = newbot.stream_run_response("s1", "thread_1", "asst", lambda text: text, "/askberater",
+                                       release=lambda: released.append(True))
+    events = list(reply.events)
+
+    assert events[-1] == newbot.sse_event("error", {"response": newbot.TIMEOUT_RESPONSE})
+    assert released == [True]
+
+
+def test_stream_reply_closed_before_it_started_releases(monkeypatch, executor):
+    runs = use_runs(monkeypatch, ["in_progress"])
+    monkeypatch.setattr(newbot, "run_executor", executor)
+    released = []
+
+    reply = newbot.stream_run_response("s1", "thread_1", "asst", lambda text: text, "/askberater",
+                                       release=lambda: released.append(True))
+    reply.events.close()
+    reply.events.close()
+
+    assert released == [True]
+    assert runs.retrieves == 0
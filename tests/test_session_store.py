@@ -0,0 +1,138 @@
+import threading
+import time
+
+import fakeredis
+import pytest
+
+import newbot
+
+
+@pytest.fixture(params=["memory", "redis"])
+def store(request):
+    if request.param == "memory":
+        return newbot.InMemorySessionStore(max_entries=100, ttl=100)
+    client = fakeredis.FakeRedis(decode_responses=True)
+    return newbot.RedisSessionStore(max_entries=100, ttl=100, client=client)
+
+
+def run_concurrently(target, count):
+    threads = [threading.Thread(target=target, args=(n,)) for n in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_interface_is_abstract():
+    with pytest.raises(TypeError):
+        newbot.SessionStore()
+
+
+def test_create_get_update(store):
+    store.create("s1", None)
+
+    assert store.update("s1", thread_id="thread_1", summary="Zusammenfassung")["thread_id"] == "thread_1"
+    record = store.get("s1")
+    assert record["thread_id"] == "thread_1"
+    assert record["summary"] == "Zusammenfassung"
+    assert record["user_details"] == {}
+    assert store.update("missing", summary="x") is None
+
+
+def test_thread_index_follows_updates(store):
+    store.create("s1", "thread_1")
+    assert store.find_by_thread("thread_1") == "s1"
+
+    store.update("s1", thread_id="thread_2")
+    assert store.find_by_thread("thread_1") is None
+    assert store.find_by_thread("thread_2") == "s1"
+
+    store.evict("s1")
+    assert store.find_by_thread("thread_2") is None
+    assert store.get("s1") is None
+
+
+def test_pending_messages_are_taken_once(store):
+    store.create("s1", None)
+    store.append_pending("s1", [("user", "hallo"), ("assistant", "Guten Tag!")])
+    store.append_pending("s1", [("user", "weiter")])
+
+    assert store.take_pending("s1") == [["user", "hallo"], ["assistant", "Guten Tag!"], ["user", "weiter"]]
+    assert store.take_pending("s1") == []
+
+
+def test_concurrent_updates_of_different_fields_are_kept(store):
+    store.create("s1", None)
+
+    # Every worker keeps writing its own field; none may be overwritten with a stale value
+    run_concurrently(lambda n: [store.update("s1", **{f"field_{n}": i}) for i in range(50)], 8)
+
+    record = store.get("s1")
+    assert [record[f"field_{n}"] for n in range(8)] == [49] * 8
+
+
+def test_concurrent_pending_appends_are_not_lost(store):
+    store.create("s1", None)
+
+    run_concurrently(lambda n: [store.append_pending("s1", [("user", f"{n}-{i}")]) for i in range(25)], 8)
+
+    assert len(store.take_pending("s1")) == 200
+
+
+def test_run_lock_is_exclusive(store):
+    token = store.acquire_run_lock("s1", wait=1, lease=10)
+
+    assert token is not None
+    assert store.run_locked("s1")
+    assert store.acquire_run_lock("s1", wait=0.1, lease=10) is None
+
+    # Only the holder can release
+    store.release_run_lock("s1", "someone-else")
+    assert store.run_locked("s1")
+    store.release_run_lock("s1", token)
+    assert not store.run_locked("s1")
+    assert store.acquire_run_lock("s1", wait=0.1, lease=10) is not None
+
+
+def test_run_lock_waits_for_release(store):
+    token = store.acquire_run_lock("s1", wait=1, lease=10)
+    threading.Timer(0.1, store.release_run_lock, args=("s1", token)).start()
+
+    started = time.time()
+    assert store.acquire_run_lock("s1", wait=5, lease=10) is not None
+    assert time.time() - started < 2
+
+
+def test_run_lock_lease_expires(store):
+    assert store.acquire_run_lock("s1", wait=1, lease=0.1) is not None
+
+    assert store.acquire_run_lock("s1", wait=2, lease=10) is not None
+
+
+def test_run_lock_serializes_holders(store):
+    holders = []
+    overlaps = []
+
+    def run(n):
+        token = store.acquire_run_lock("s1", wait=10, lease=10)
+        holders.append(n)
+        if len(holders) > 1:
+            overlaps.append(n)
+        time.sleep(0.01)
+        holders.remove(n)
+        store.release_run_lock("s1", token)
+
+    run_concurrently(run, 6)
+
+    assert overlaps == []
+
+
+def test_lru_eviction(store):
+    store.max_entries = 2
+    for n in range(3):
+        store.create(f"s{n}", f"thread_{n}")
+
+    assert store.get("s0") is None
+    assert store.find_by_thread("thread_0") is None
+    assert store.get("s2") is not None
+    assert store.stats()["evicted_lru"] == 1
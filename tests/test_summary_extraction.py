@@ -0,0 +1,53 @@
+import pytest
+
+import newbot
+
+FIELDS = """Vorname: Max
+Nachname: Mustermann
+E-Mail: max@example.de
+Telefon: 0171 2345678
+Postleitzahl: 10115
+Menge: 300 t
+Beschreibung: Bodenaushub
+Geplanter Start: KW 23
+"""
+
+
+@pytest.fixture(autouse=True)
+def no_model_fallback(monkeypatch):
+    monkeypatch.setattr(newbot, "SUMMARY_EXTRACTION_MODEL", "")
+
+
+def test_markdown_bullets_are_parsed():
+    summary = "\n".join(f"- **{line.replace(':', ':**', 1)}" for line in FIELDS.splitlines())
+
+    details = newbot.extract_details_from_summary(summary)
+
+    assert details["email"] == "max@example.de"
+    assert details["geplanter_start"] == "KW 23"
+
+
+def test_prose_after_the_fields_does_not_overwrite_them():
+    summary = FIELDS + "Start: sobald Sie bestätigen, leite ich alles weiter.\nMenge: kann sich noch ändern\n"
+
+    details = newbot.extract_details_from_summary(summary)
+
+    assert details["geplanter_start"] == "KW 23"
+    assert details["quantity"] == "300 t"
+
+
+@pytest.mark.parametrize("label", ["Start", "Beginn", "Anzahl", "Umfang", "Mail"])
+def test_generic_words_are_not_field_labels(label):
+    assert newbot._summary_field_key(label) is None
+
+
+def test_json_block_is_parsed():
+    summary = 'Hier die Daten:\n```json\n{"first_name": "Max", "Nachname": "Mustermann", "email": null}\n```'
+
+    assert newbot._details_from_json(summary) == {"first_name": "Max", "last_name": "Mustermann"}
+
+
+def test_missing_required_field_returns_none():
+    summary = FIELDS.replace("Telefon: 0171 2345678\n", "")
+
+    assert newbot.extract_details_from_summary(summary) is None
@@ -0,0 +1,93 @@
+from types import SimpleNamespace
+
+import pytest
+
+import newbot
+
+
+class NoWritesClient:
+    """OpenAI stand-in: messages may only reach a thread through a run."""
+
+    def __init__(self):
+        self.created = []
+        self.beta = SimpleNamespace(threads=SimpleNamespace(
+            create=self._create,
+            messages=SimpleNamespace(create=self._reject),
+        ))
+
+    def _create(self, messages=()):
+        self.created.append(list(messages))
+        return SimpleNamespace(id="thread_new")
+
+    def _reject(self, **kwargs):
+        raise AssertionError("messages.create outside of a run")
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = newbot.InMemorySessionStore(max_entries=100, ttl=100)
+    monkeypatch.setattr(newbot, "session_store", store)
+    monkeypatch.setattr(newbot, "client", NoWritesClient())
+    store.client = newbot.client
+    monkeypatch.setattr(newbot, "thread_pool", None)
+    return store
+
+
+def test_messages_for_existing_thread_wait_for_the_next_run(store):
+    store.create("s1", "thread_1")
+
+    newbot.queue_thread_messages("s1", "thread_1", [("user", "Hallo"), ("assistant", "Guten Tag")])
+    thread_id, messages = newbot.prepare_run("s1", "thread_1", "Weiter")
+
+    assert thread_id == "thread_1"
+    assert messages == [
+        {"role": "user", "content": "Hallo"},
+        {"role": "assistant", "content": "Guten Tag"},
+        {"role": "user", "content": "Weiter"},
+    ]
+    assert store.take_pending("s1") == []
+
+
+def test_messages_during_a_run_are_kept_for_the_following_run(store):
+    store.create("s1", "thread_1")
+
+    with newbot.SessionRunLock("s1"):
+        # Another request of the session answers without a run meanwhile
+        newbot.queue_thread_messages("s1", "thread_1", [("user", "Hallo"), ("assistant", "Guten Tag")])
+
+    assert [message["content"] for message in newbot.prepare_run("s1", "thread_1")[1]] == ["Hallo", "Guten Tag"]
+
+
+def test_reply_without_run_hands_out_a_local_thread_id_cookieless_clients_can_send_back(store):
+    web = newbot.app.test_client(use_cookies=False)
+
+    reply = web.post("/askberater", json={"message": "Ich benötige ein Baugrundgutachten"}).get_json()
+
+    # Answered from local data: no thread was created for it
+    assert store.client.created == []
+    assert reply["thread_id"].startswith(newbot.LOCAL_THREAD_PREFIX)
+    session_id, thread_id, is_new = newbot.get_or_create_session(None, reply["thread_id"])
+    assert (thread_id, is_new) == (reply["thread_id"], False)
+    # The special exchange is still waiting for the session's next run
+    assert [role for role, _ in store.take_pending(session_id)] == ["user", "assistant"]
+
+
+def test_first_run_replaces_the_local_thread_id(store):
+    store.create("s1", None)
+    local_id = newbot.reply_thread_id("s1", None)
+    newbot.queue_thread_messages("s1", local_id, [("user", "Hallo"), ("assistant", "Guten Tag")])
+
+    thread_id, additional_messages = newbot.prepare_run("s1", local_id, "Weiter")
+
+    assert (thread_id, additional_messages) == ("thread_new", [])
+    assert [message["content"] for message in store.client.created[0]] == ["Hallo", "Guten Tag", "Weiter"]
+    assert newbot.find_session_id(None, "thread_new") == "s1"
+
+
+def test_run_uses_the_thread_created_by_an_earlier_request(store):
+    store.create("s1", None)
+    store.update("s1", thread_id="thread_1")
+
+    # The caller read the session before the other request's run created the thread
+    assert newbot.prepare_run("s1", None, "Weiter")[0] == "thread_1"
+    assert store.client.created == []
@@ -0,0 +1,46 @@
+import pytest
+
+import newbot
+
+
+@pytest.fixture
+def deleted(monkeypatch):
+    deleted = []
+    monkeypatch.setattr(newbot.thread_writer, "delete", deleted.append)
+    return deleted
+
+
+def make_pool(*ages):
+    """Pool holding thread_1, thread_2, ... created `ages` seconds ago, oldest first, without a refill worker."""
+    pool = newbot.ThreadPool(size=len(ages), max_age=100)
+    pool.ensure_started = lambda: None
+    now = newbot.time.time()
+    for number, age in enumerate(ages, 1):
+        pool._threads.append((f"thread_{number}", now - age))
+    return pool
+
+
+def test_newest_thread_is_handed_out_first(deleted):
+    pool = make_pool(30, 20, 10)
+
+    assert [pool.take(), pool.take()] == ["thread_3", "thread_2"]
+    assert pool.available() == 1
+    assert pool.stats()["hits"] == 2
+
+
+def test_stale_threads_are_deleted_instead_of_handed_out(deleted):
+    pool = make_pool(300, 200)
+
+    assert pool.take() is None
+    assert sorted(deleted) == ["thread_1", "thread_2"]
+    assert pool.stats()["misses"] == 1
+    assert pool.stats()["discarded"] == 2
+
+
+def test_refill_discards_only_the_stale_threads(deleted):
+    pool = make_pool(200, 150, 10)
+
+    pool._discard_stale()
+
+    assert deleted == ["thread_1", "thread_2"]
+    assert pool.take() == "thread_3"
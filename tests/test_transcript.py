@@ -0,0 +1,56 @@
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+
+import newbot
+
+
+def thread_message(role, text):
+    return SimpleNamespace(role=role, content=[SimpleNamespace(text=SimpleNamespace(value=text))])
+
+
+class ThreadClient:
+    """OpenAI stand-in whose messages.list returns `messages` newest first and counts the calls."""
+
+    def __init__(self, messages):
+        self.listed = 0
+        self.beta = SimpleNamespace(threads=SimpleNamespace(messages=SimpleNamespace(list=self._list)))
+        self._messages = messages
+
+    def _list(self, thread_id):
+        self.listed += 1
+        return list(reversed(self._messages))
+
+
+@pytest.fixture(params=["memory", "redis"])
+def store(request, monkeypatch):
+    if request.param == "memory":
+        store = newbot.InMemorySessionStore(max_entries=100, ttl=100)
+    else:
+        store = newbot.RedisSessionStore(max_entries=100, ttl=100, client=fakeredis.FakeRedis(decode_responses=True))
+    monkeypatch.setattr(newbot, "session_store", store)
+    return store
+
+
+def test_transcript_is_built_locally(store, monkeypatch):
+    client = ThreadClient([])
+    monkeypatch.setattr(newbot, "client", client)
+    store.create("s1", "thread_1")
+
+    newbot.record_turn("s1", "Ich benötige ein Baugrundgutachten", "Gerne!")
+    newbot.record_turn("s1", "Max Mustermann", "Danke.")
+
+    assert newbot.conversation_transcript("s1", "thread_1") == (
+        "USER: Ich benötige ein Baugrundgutachten\n\nBOT: Gerne!\n\nUSER: Max Mustermann\n\nBOT: Danke."
+    )
+    assert client.listed == 0
+
+
+def test_session_without_transcript_falls_back_to_the_thread(store, monkeypatch):
+    client = ThreadClient([thread_message("user", "Hallo"), thread_message("assistant", "Guten Tag")])
+    monkeypatch.setattr(newbot, "client", client)
+    store.create("s1", "thread_1")
+
+    assert newbot.conversation_transcript("s1", "thread_1") == "USER: Hallo\n\nBOT: Guten Tag"
+    assert client.listed == 1
@@ -0,0 +1,177 @@
+import re
+import time
+
+import pytest
+
+import newbot
+
+
+class OutboxTable:
+    """
+    Just enough of MySQL for the statements ZohoOutbox runs against zoho_outbox.
+    """
+
+    def __init__(self):
+        self.rows = {}
+        self.open_connections = 0
+
+    def connect(self):
+        self.open_connections += 1
+        return Connection(self)
+
+    def execute(self, sql, args):
+        sql = " ".join(sql.split())
+        now = time.time()
+        if sql.startswith("CREATE TABLE"):
+            return 0
+        if sql.startswith("INSERT IGNORE"):
+            dedupe_key, payload = args
+            if any(row["dedupe_key"] == dedupe_key for row in self.rows.values()):
+                return 0
+            row_id = len(self.rows) + 1
+            self.rows[row_id] = {"id": row_id, "dedupe_key": dedupe_key, "payload": payload,
+                                 "status": "pending", "attempts": 0, "next_attempt_at": now, "last_error": None}
+            return 1
+        if sql.startswith("SELECT id, payload, attempts"):
+            due = [row for row in self.rows.values()
+                   if row["status"] in ("pending", "sending") and row["next_attempt_at"] <= now]
+            return [{"id": row["id"], "payload": row["payload"], "attempts": row["attempts"]} for row in due][:args[0]]
+        if sql.startswith("UPDATE zoho_outbox SET status = 'sending'"):
+            lease, row_id, attempts = args
+            row = self.rows[row_id]
+            if row["attempts"] != attempts or row["next_attempt_at"] > now:
+                return 0
+            row.update(status="sending", next_attempt_at=now + lease)
+            return 1
+        status = re.search(r"SET status = '(\w+)'", sql).group(1)
+        if status == "sent":
+            attempts, row_id = args
+            self.rows[row_id].update(status="sent", attempts=attempts, last_error=None)
+        elif status == "dead":
+            attempts, error, row_id = args
+            self.rows[row_id].update(status="dead", attempts=attempts, last_error=error)
+        else:
+            attempts, error, delay, row_id = args
+            self.rows[row_id].update(status="pending", attempts=attempts, last_error=error,
+                                     next_attempt_at=now + delay)
+        return 1
+
+
+class Connection:
+    def __init__(self, table):
+        self.table = table
+        self.result = None
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, sql, args=None):
+        self.result = self.table.execute(sql, args)
+        return self.result if isinstance(self.result, int) else len(self.result)
+
+    def fetchall(self):
+        return self.result
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self.table.open_connections -= 1
+
+
+@pytest.fixture
+def table(monkeypatch):
+    table = OutboxTable()
+    monkeypatch.setattr(newbot, "get_db_connection", table.connect)
+    return table
+
+
+@pytest.fixture
+def outbox():
+    outbox = newbot.ZohoOutbox(max_attempts=2, base_delay=0)
+    # Deals are processed by the test, not by the background thread
+    outbox.ensure_started = lambda: None
+    return outbox
+
+
+DEAL = {"first_name": "Max", "last_name": "Muster", "email": "m@x.de", "gespraechsverlauf": "USER: ja"}
+
+
+def test_repeated_confirmation_of_same_deal_is_queued_once(table, outbox):
+    outbox.enqueue("thread_1", DEAL)
+    outbox.enqueue("thread_1", dict(DEAL, gespraechsverlauf="USER: ja\n\nUSER: ja, bitte"))
+
+    assert len(table.rows) == 1
+    assert outbox.stats()["duplicates"] == 1
+
+
+def test_second_deal_of_same_conversation_is_queued(table, outbox):
+    outbox.enqueue("thread_1", DEAL)
+    outbox.enqueue("thread_1", dict(DEAL, email="other@x.de"))
+    outbox.enqueue("thread_2", DEAL)
+
+    assert len(table.rows) == 3
+    assert all("thread" not in row["dedupe_key"] for row in table.rows.values())
+
+
+def test_no_connection_is_held_while_sending(table, outbox, monkeypatch):
+    held = []
+
+    def send_to_zoho(user_details):
+        held.append(table.open_connections)
+        return True
+
+    monkeypatch.setattr(newbot, "send_to_zoho", send_to_zoho)
+    outbox.enqueue("thread_1", DEAL)
+    outbox.enqueue("thread_2", DEAL)
+
+    assert outbox.process_due() == 2
+    assert held == [0, 0]
+    assert table.open_connections == 0
+    assert [row["status"] for row in table.rows.values()] == ["sent", "sent"]
+
+
+def test_failed_deal_is_retried_then_dead_lettered(table, outbox, monkeypatch):
+    results = iter([False, False])
+    monkeypatch.setattr(newbot, "send_to_zoho", lambda user_details: next(results))
+    outbox.enqueue("thread_1", DEAL)
+
+    outbox.process_due()
+    row = table.rows[1]
+    assert (row["status"], row["attempts"], row["last_error"]) == ("pending", 1, "Zoho CRM rejected the deal")
+
+    outbox.process_due()
+    assert (row["status"], row["attempts"]) == ("dead", 2)
+    assert outbox.stats() == {"enqueued": 1, "duplicates": 0, "sent": 0, "retried": 1, "dead": 1}
+
+
+def test_exception_while_sending_is_retried(table, outbox, monkeypatch):
+    def send_to_zoho(user_details):
+        raise RuntimeError("timeout")
+
+    monkeypatch.setattr(newbot, "send_to_zoho", send_to_zoho)
+    outbox.enqueue("thread_1", DEAL)
+    outbox.process_due()
+
+    assert (table.rows[1]["status"], table.rows[1]["last_error"]) == ("pending", "timeout")
+
+
+def test_leased_row_is_not_claimed_twice(table, outbox, monkeypatch):
+    sent = []
+
+    def send_to_zoho(user_details):
+        # Another worker polls while this one is still sending
+        sent.append(outbox.process_due())
+        return True
+
+    monkeypatch.setattr(newbot, "send_to_zoho", send_to_zoho)
+    outbox.enqueue("thread_1", DEAL)
+
+    assert outbox.process_due() == 1
+    assert sent == [0]
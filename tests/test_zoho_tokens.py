@@ -0,0 +1,99 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import newbot
+
+
+class TokenEndpoint:
+    """Zoho OAuth stand-in: hands out access_1, access_2, ... and counts the calls."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def post(self, url, params, timeout):
+        with self._lock:
+            self.calls += 1
+            token = f"access_{self.calls}"
+        time.sleep(self.delay)
+        return FakeResponse({"access_token": token, "expires_in": 3600})
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, data):
+        self._data = data
+        self.text = json.dumps(data)
+
+    def json(self):
+        return self._data
+
+
+@pytest.fixture
+def endpoint(monkeypatch):
+    endpoint = TokenEndpoint(delay=0.05)
+    monkeypatch.setattr(newbot.zoho_http, "post", endpoint.post)
+    return endpoint
+
+
+def make_manager(cache_path=None, expires_in=0):
+    manager = newbot.ZohoTokenManager("env_token", "refresh", "id", "secret",
+                                      cache_path=cache_path, expires_in=expires_in)
+    # No proactive refresh thread in tests
+    manager.ensure_started = lambda: None
+    return manager
+
+
+def test_concurrent_get_token_refreshes_once(endpoint):
+    manager = make_manager()
+    tokens = []
+
+    threads = [threading.Thread(target=lambda: tokens.append(manager.get_token())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert endpoint.calls == 1
+    assert tokens == ["access_1"] * 8
+    assert manager.stats()["shared_refreshes"] == 7
+
+
+def test_refresh_with_a_replaced_stale_token_skips_zoho(endpoint):
+    manager = make_manager()
+    manager.refresh()
+
+    assert manager.refresh(stale_token="env_token") == "access_1"
+    assert endpoint.calls == 1
+
+
+def test_token_is_saved_and_loaded_again(endpoint, tmp_path):
+    cache_path = str(tmp_path / "zoho_token.json")
+    make_manager(cache_path).refresh()
+
+    assert oct(os.stat(cache_path).st_mode & 0o777) == "0o600"
+    assert make_manager(cache_path).get_token() == "access_1"
+    assert endpoint.calls == 1
+
+
+def test_expired_cached_token_is_ignored(endpoint, tmp_path):
+    cache_path = tmp_path / "zoho_token.json"
+    cache_path.write_text(json.dumps({"access_token": "old", "expires_at": time.time() - 1}))
+
+    assert make_manager(str(cache_path), expires_in=3600).get_token() == "env_token"
+
+
+def test_worker_reuses_a_token_another_worker_refreshed(endpoint, tmp_path):
+    cache_path = str(tmp_path / "zoho_token.json")
+    first, second = make_manager(cache_path), make_manager(cache_path)
+
+    assert first.get_token() == "access_1"
+    # The second worker still holds the expired token, but finds the new one in the shared file
+    assert second.get_token() == "access_1"
+    assert endpoint.calls == 1